@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import Customer, ChatSession, LoanApplication, DocumentVerification
+from .models import Customer, ChatSession, LoanApplication, DocumentVerification, VerificationJob, IdempotentRequest
 
 
 @admin.register(Customer)
@@ -377,16 +377,22 @@ class LoanApplicationAdmin(admin.ModelAdmin):
     
     sanction_letter_preview.short_description = 'Sanction Letter'
     
-    actions = ['approve_applications', 'reject_applications']
+    actions = ['approve_applications', 'reject_applications', 'generate_sanction_letters', 'export_documents']
     
     def approve_applications(self, request, queryset):
-        """Approve selected applications"""
+        """Approve selected applications and generate their sanction letters"""
         from django.utils import timezone
-        updated = queryset.filter(status='pending').update(
+        from .sanction_letters import store_letters
+        pending_ids = list(queryset.filter(status='pending').values_list('id', flat=True))
+        updated = LoanApplication.objects.filter(id__in=pending_ids, status='pending').update(
             status='approved',
             approved_at=timezone.now()
         )
-        self.message_user(request, f'{updated} application(s) approved.')
+        stats = store_letters(LoanApplication.objects.filter(id__in=pending_ids, status='approved'))
+        self.message_user(
+            request,
+            f"{updated} application(s) approved, {stats['generated']} sanction letter(s) generated."
+        )
     
     approve_applications.short_description = 'Approve selected applications'
     
@@ -401,6 +407,29 @@ class LoanApplicationAdmin(admin.ModelAdmin):
         self.message_user(request, f'{updated} application(s) rejected.')
     
     reject_applications.short_description = 'Reject selected applications'
+    
+    def generate_sanction_letters(self, request, queryset):
+        """(Re)generate sanction letters for selected approved applications"""
+        from .sanction_letters import store_letters
+        stats = store_letters(queryset.filter(status__in=['approved', 'disbursed']))
+        self.message_user(
+            request,
+            f"{stats['generated']} sanction letter(s) generated, {stats['skipped']} already up to date."
+        )
+    
+    generate_sanction_letters.short_description = 'Generate sanction letters'
+    
+    def export_documents(self, request, queryset):
+        """Download the selected applications' sanction letters and salary slips as one ZIP"""
+        from django.http import StreamingHttpResponse
+        from django.utils import timezone
+        from .exports import iter_loan_archive
+        response = StreamingHttpResponse(iter_loan_archive(queryset), content_type='application/zip')
+        filename = f"loan_documents_{timezone.now():%Y%m%d_%H%M%S}.zip"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    export_documents.short_description = 'Download documents (ZIP)'
 
 
 @admin.register(DocumentVerification)
@@ -541,7 +570,76 @@ class DocumentVerificationAdmin(admin.ModelAdmin):
     extracted_data_display.short_description = 'Extracted Data'
 
 
+@admin.register(VerificationJob)
+class VerificationJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'id',
+        'session',
+        'kind',
+        'status',
+        'result_status',
+        'attempts',
+        'locked_by',
+        'created_at',
+        'finished_at'
+    ]
+    list_filter = [
+        'kind',
+        'status',
+        'created_at'
+    ]
+    readonly_fields = [
+        'id',
+        'session',
+        'kind',
+        'payload',
+        'result',
+        'result_status',
+        'error',
+        'attempts',
+        'locked_by',
+        'locked_at',
+        'created_at',
+        'updated_at',
+        'finished_at'
+    ]
+    exclude = ['image_data']
+
+
+@admin.register(IdempotentRequest)
+class IdempotentRequestAdmin(admin.ModelAdmin):
+    list_display = [
+        'key',
+        'session',
+        'path',
+        'status',
+        'response_status',
+        'created_at',
+        'completed_at'
+    ]
+    list_filter = [
+        'path',
+        'status',
+        'created_at'
+    ]
+    search_fields = [
+        'key'
+    ]
+    readonly_fields = [
+        'session',
+        'key',
+        'path',
+        'fingerprint',
+        'status',
+        'response_body',
+        'response_status',
+        'created_at',
+        'completed_at'
+    ]
+
+
 # Customize admin site header and title
 admin.site.site_header = "AI Loan Processing Admin"
 admin.site.site_title = "Loan Admin Portal"
-admin.site.index_title = "Welcome to AI Loan Processing System"
\ No newline at end of file
+admin.site.index_title = "Welcome to AI Loan Processing System"
+
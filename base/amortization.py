@@ -0,0 +1,166 @@
+from array import array
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+
+# Schedule columns are stored as array('d') (8 bytes per month) instead of lists of dicts
+AmortizationSchedule = namedtuple(
+    'AmortizationSchedule',
+    ['emi', 'total_interest', 'interest', 'principal', 'balance']
+)
+
+
+@lru_cache(maxsize=2048)
+def _cached_schedule(principal, annual_rate, tenure_months):
+    """Build and memoize the reducing-balance schedule for one (principal, rate, tenure)"""
+    emi = AmortizationEngine.calculate_emi(principal, annual_rate, tenure_months)
+    monthly_rate = annual_rate / 1200.0
+
+    interest = array('d', bytes(8 * tenure_months))
+    principal_paid = array('d', bytes(8 * tenure_months))
+    balance = array('d', bytes(8 * tenure_months))
+
+    outstanding = principal
+    for month in range(tenure_months):
+        month_interest = outstanding * monthly_rate
+        month_principal = emi - month_interest
+        if month == tenure_months - 1:
+            # Absorb floating point drift in the final instalment
+            month_principal = outstanding
+        outstanding -= month_principal
+        interest[month] = month_interest
+        principal_paid[month] = month_principal
+        balance[month] = outstanding if outstanding > 0 else 0.0
+
+    return AmortizationSchedule(emi, sum(interest), interest, principal_paid, balance)
+
+
+class AmortizationEngine:
+    """
+    Reducing-balance EMI, amortization schedules and total interest
+    """
+
+    @staticmethod
+    def default_annual_rate():
+        """Annual interest rate (percent) used when a loan has no explicit rate"""
+        return float(getattr(settings, 'LOAN_INTEREST_RATE', 12.0))
+
+    @staticmethod
+    def calculate_emi(principal, annual_rate, tenure_months):
+        """
+        EMI = P * r * (1 + r)^n / ((1 + r)^n - 1), with r the monthly rate
+        """
+        principal = float(principal)
+        tenure_months = int(tenure_months)
+        if tenure_months <= 0:
+            return 0.0
+
+        monthly_rate = float(annual_rate) / 1200.0
+        if monthly_rate == 0:
+            return principal / tenure_months
+
+        growth = (1 + monthly_rate) ** tenure_months
+        return principal * monthly_rate * growth / (growth - 1)
+
+    @staticmethod
+    def principal_for_emi(emi, annual_rate, tenure_months):
+        """
+        Largest principal this EMI repays (present value of the annuity):
+        P = EMI * ((1 + r)^n - 1) / (r * (1 + r)^n)
+        """
+        factor = AmortizationEngine.calculate_emi(1.0, annual_rate, tenure_months)
+        return float(emi) / factor if factor else 0.0
+
+    @staticmethod
+    def calculate_emis(principals, annual_rates, tenures):
+        """
+        EMI for many loans at once. annual_rates and tenures may be scalars
+        shared by every loan or sequences aligned with principals.
+        Returns: array('d') of EMIs
+        """
+        count = len(principals)
+        if not hasattr(annual_rates, '__len__'):
+            annual_rates = [annual_rates] * count
+        if not hasattr(tenures, '__len__'):
+            tenures = [tenures] * count
+
+        # Each distinct (rate, tenure) pair needs only one power computation
+        factors = {}
+        emis = array('d', bytes(8 * count))
+        for index, (principal, rate, tenure) in enumerate(zip(principals, annual_rates, tenures)):
+            key = (float(rate), int(tenure))
+            factor = factors.get(key)
+            if factor is None:
+                factor = AmortizationEngine.calculate_emi(1.0, *key)
+                factors[key] = factor
+            emis[index] = float(principal) * factor
+        return emis
+
+    @staticmethod
+    def total_interest(principal, annual_rate, tenure_months):
+        """Total interest paid over the life of the loan"""
+        return AmortizationEngine.schedule(principal, annual_rate, tenure_months).total_interest
+
+    @staticmethod
+    def total_interests(principals, annual_rates, tenures):
+        """Total interest for many loans at once (EMI * n - P). Returns: array('d')"""
+        count = len(principals)
+        if not hasattr(tenures, '__len__'):
+            tenures = [tenures] * count
+        emis = AmortizationEngine.calculate_emis(principals, annual_rates, tenures)
+        return array('d', (
+            emi * int(tenure) - float(principal) if int(tenure) > 0 else 0.0
+            for emi, principal, tenure in zip(emis, principals, tenures)
+        ))
+
+    @staticmethod
+    def schedule(principal, annual_rate, tenure_months):
+        """
+        Full month-by-month schedule (interest, principal, closing balance).
+        Schedules are memoized in an LRU; treat the returned arrays as read-only.
+        """
+        return _cached_schedule(
+            round(float(principal), 2), float(annual_rate), int(tenure_months)
+        )
+
+    @staticmethod
+    def portfolio_schedule(loans):
+        """
+        Aggregate monthly interest, principal and outstanding balance across loans.
+
+        loans: iterable of (principal, annual_rate, tenure_months)
+        Returns: dict of array('d') columns indexed by month
+        """
+        # Identical loans share one cached schedule and are added with a weight
+        counts = Counter(
+            (round(float(principal), 2), float(rate), int(tenure))
+            for principal, rate, tenure in loans
+        )
+        schedules = [(_cached_schedule(*key), count) for key, count in counts.items()]
+        months = max((len(s.interest) for s, _ in schedules), default=0)
+
+        interest = array('d', bytes(8 * months))
+        principal = array('d', bytes(8 * months))
+        balance = array('d', bytes(8 * months))
+        emi = array('d', bytes(8 * months))
+
+        for loan_schedule, count in schedules:
+            for month in range(len(loan_schedule.interest)):
+                interest[month] += count * loan_schedule.interest[month]
+                principal[month] += count * loan_schedule.principal[month]
+                balance[month] += count * loan_schedule.balance[month]
+                emi[month] += count * loan_schedule.emi
+
+        return {
+            'emi': emi,
+            'interest': interest,
+            'principal': principal,
+            'balance': balance
+        }
+
+    @staticmethod
+    def cache_info():
+        """LRU statistics for the schedule cache"""
+        return _cached_schedule.cache_info()
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class BaseConfig(AppConfig):
     name = 'base'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .timing import install_query_timing
+
+        connection_created.connect(install_query_timing, dispatch_uid='base.timing.install_query_timing')
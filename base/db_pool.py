@@ -0,0 +1,48 @@
+from django.db import connections
+
+
+def check_connection(connection):
+    """
+    Pool health check run before a connection is handed out (DATABASES OPTIONS['pool']['check']):
+    broken connections are discarded and replaced instead of failing the request.
+    psycopg_pool is imported on first use so settings stay cheap to load.
+    """
+    from psycopg_pool import ConnectionPool
+
+    ConnectionPool.check_connection(connection)
+
+
+def pool_stats():
+    """
+    Connection pool state per database alias with pooling enabled, None when no
+    database uses a pool. Counters are cumulative since the process started.
+    """
+    stats = {}
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor != 'postgresql' or not connection.settings_dict['OPTIONS'].get('pool'):
+            continue
+        raw = connection.pool.get_stats()
+        size = raw.get('pool_size', 0)
+        available = raw.get('pool_available', 0)
+        requests = raw.get('requests_num', 0)
+        wait_ms = raw.get('requests_wait_ms', 0)
+        stats[alias] = {
+            'min_size': raw.get('pool_min'),
+            'max_size': raw.get('pool_max'),
+            'size': size,
+            'in_use': size - available,
+            'idle': available,
+            'waiting': raw.get('requests_waiting', 0),
+            'requests': requests,
+            'requests_queued': raw.get('requests_queued', 0),
+            'wait_ms': {
+                'total': wait_ms,
+                'mean': round(wait_ms / requests, 2) if requests else 0.0,
+            },
+            'timeouts': raw.get('requests_errors', 0),
+            'connections_opened': raw.get('connections_num', 0),
+            'connection_errors': raw.get('connections_errors', 0),
+            'connections_lost': raw.get('connections_lost', 0),
+        }
+    return stats or None
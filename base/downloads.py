@@ -0,0 +1,193 @@
+import base64
+import os
+import re
+from collections import namedtuple
+
+from django.db.models.functions import Length, Substr
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+from .models import LoanApplication
+from .uploads import UPLOAD_CHUNK_SIZE
+
+
+# Decoded bytes per database read while streaming; a multiple of 3 so every
+# read starts on a base64 quantum boundary
+DOWNLOAD_CHUNK_SIZE = 4 * UPLOAD_CHUNK_SIZE
+
+# document -> (name field, base64 content field, content type field, etag field, timestamp field)
+STORED_DOCUMENTS = {
+    'sanction_letter': (
+        'sanction_letter_name',
+        'sanction_letter_content',
+        'sanction_letter_content_type',
+        'sanction_letter_etag',
+        'sanction_letter_generated_at',
+    ),
+    'salary_slip': (
+        'salary_slip_name',
+        'salary_slip_content',
+        'salary_slip_content_type',
+        None,
+        'updated_at',
+    ),
+}
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+StoredDocument = namedtuple(
+    'StoredDocument',
+    ['loan_id', 'customer_id', 'name', 'content_type', 'size', 'etag', 'last_modified', 'content_field']
+)
+
+
+def stored_document(loan_id, document):
+    """
+    Metadata of a stored base64 document, read without loading its content:
+    the decoded size comes from the text length and its trailing padding.
+    Returns: StoredDocument or None
+    """
+    name_field, content_field, type_field, etag_field, timestamp_field = STORED_DOCUMENTS[document]
+    row = (
+        LoanApplication.objects
+        .filter(id=loan_id)
+        .annotate(
+            encoded_length=Length(content_field),
+            encoded_tail=Substr(content_field, Length(content_field) - 1, 2)
+        )
+        .values_list(
+            'customer_id', name_field, type_field, 'encoded_length', 'encoded_tail',
+            etag_field or timestamp_field, timestamp_field
+        )
+        .first()
+    )
+    if not row or not row[3]:
+        return None
+
+    customer_id, name, content_type, encoded_length, tail, etag, last_modified = row
+    size = encoded_length // 4 * 3 - tail.count('=')
+    if not etag_field or not etag:
+        # Content only changes with a save of the application
+        etag = f"{document}-{loan_id}-{encoded_length}-{int(last_modified.timestamp()) if last_modified else 0}"
+
+    return StoredDocument(
+        loan_id, customer_id, name, content_type or 'application/octet-stream',
+        size, etag, last_modified, content_field
+    )
+
+
+def iter_document_bytes(stored, start=0, end=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Decoded bytes start..end (inclusive) of a stored document, one database
+    read of chunk_size bytes at a time
+    """
+    end = stored.size - 1 if end is None else end
+    position = start - start % 3
+
+    while position <= end:
+        encoded = (
+            LoanApplication.objects
+            .filter(id=stored.loan_id)
+            .annotate(encoded_chunk=Substr(stored.content_field, position // 3 * 4 + 1, chunk_size // 3 * 4))
+            .values_list('encoded_chunk', flat=True)
+            .first()
+        )
+        if not encoded:
+            # Document removed or replaced while streaming
+            return
+        data = base64.b64decode(encoded)
+        yield data[max(0, start - position):end + 1 - position]
+        position += chunk_size
+
+
+def parse_range(header, size):
+    """
+    Single byte range from a Range header.
+    Returns: (start, end) inclusive, None to serve the whole document
+    (absent, malformed or multi-range), or False when unsatisfiable
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, stored):
+    """A Range is honoured only if If-Range (when sent) still names this version"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == quote_etag(stored.etag)
+    since = parse_http_date_safe(if_range)
+    return bool(since and stored.last_modified and int(stored.last_modified.timestamp()) <= since)
+
+
+def not_modified_response(request, etag, last_modified):
+    """304 / 412 response when the request's validators match, else None"""
+    not_modified = get_conditional_response(
+        request,
+        etag=quote_etag(etag),
+        last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    if not_modified is not None:
+        not_modified['Cache-Control'] = 'private, no-cache'
+    return not_modified
+
+
+def document_response(request, stored, filename=None, attachment=False):
+    """
+    Stream a stored document with ETag / Last-Modified revalidation and
+    single-range (206) support. Content-Length is always exact.
+    """
+    not_modified = not_modified_response(request, stored.etag, stored.last_modified)
+    if not_modified is not None:
+        return not_modified
+    etag = quote_etag(stored.etag)
+    last_modified = int(stored.last_modified.timestamp()) if stored.last_modified else None
+
+    byte_range = parse_range(request.META.get('HTTP_RANGE'), stored.size)
+    if byte_range is not None and not _if_range_matches(request, stored):
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stored.size}'
+        return response
+
+    start, end = byte_range or (0, stored.size - 1)
+    if request.method == 'HEAD':
+        response = HttpResponse(status=206 if byte_range else 200, content_type=stored.content_type)
+    else:
+        response = StreamingHttpResponse(
+            iter_document_bytes(stored, start, end),
+            status=206 if byte_range else 200,
+            content_type=stored.content_type
+        )
+    response['Content-Length'] = str(end - start + 1)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{stored.size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+
+    response['Content-Disposition'] = content_disposition_header(
+        attachment, filename or os.path.basename(stored.name or '') or 'document'
+    )
+    return response
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# channel -> {(event loop, asyncio.Queue)} of the connections listening on it
+_listeners = defaultdict(set)
+_listeners_lock = threading.Lock()
+
+
+def session_channel(session_id):
+    return f'session:{session_id}'
+
+
+def customer_channel(customer_id):
+    return f'customer:{customer_id}'
+
+
+def publish(channel, event, **data):
+    """
+    Push an event to the WebSocket connections of this process listening on
+    channel. Safe to call from any thread; a no-op when nobody listens.
+    Connections in other processes pick changes up from the database (see
+    websocket.ResultWatcher).
+    """
+    message = {'type': 'event', 'event': event, **data}
+    with _listeners_lock:
+        listeners = list(_listeners.get(channel, ()))
+    for loop, queue in listeners:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+        except RuntimeError:
+            # The connection's event loop has already shut down
+            pass
+
+
+@contextmanager
+def listening(channel, queue):
+    """Deliver events published on channel to queue (call from the queue's event loop)"""
+    listener = (asyncio.get_running_loop(), queue)
+    with _listeners_lock:
+        _listeners[channel].add(listener)
+    try:
+        yield queue
+    finally:
+        with _listeners_lock:
+            _listeners[channel].discard(listener)
+            if not _listeners[channel]:
+                del _listeners[channel]
@@ -0,0 +1,191 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import IdempotentRequest
+
+
+# Clients send the key as a header, or as a field of the JSON body / form
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 100
+
+# Set on responses served from a stored result
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _request_data(request):
+    """The request's fields: the JSON body, else the form. None when the JSON is malformed"""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return {key: request.POST.get(key) for key in request.POST}
+
+
+def request_fingerprint(request, data):
+    """SHA-256 of the path, the fields (without the key) and the uploaded files' contents"""
+    digest = hashlib.sha256(request.path.encode('utf-8'))
+    fields = {key: value for key, value in data.items() if key != IDEMPOTENCY_FIELD}
+    digest.update(json.dumps(fields, sort_keys=True, default=str).encode('utf-8'))
+    for name in sorted(request.FILES):
+        upload = request.FILES[name]
+        digest.update(name.encode('utf-8'))
+        for chunk in upload.chunks():
+            digest.update(chunk)
+        upload.seek(0)
+    return digest.hexdigest()
+
+
+def _error(message, status, **extra):
+    return JsonResponse({'success': False, 'message': message, **extra}, status=status)
+
+
+def claim(request):
+    """
+    Look up the request's idempotency key.
+    Returns: (IdempotentRequest to complete, None) when the view should run,
+             (None, response) to answer without running it (replay / conflict),
+             (None, None) for requests without a key or session
+    """
+    data = _request_data(request)
+    if data is None:
+        return None, None
+    key = request.headers.get(IDEMPOTENCY_HEADER) or data.get(IDEMPOTENCY_FIELD)
+    session_id = data.get('session_id')
+    if not key or not session_id:
+        return None, None
+    key = str(key)
+    if len(key) > MAX_KEY_LENGTH:
+        return None, _error(f'Idempotency key must be at most {MAX_KEY_LENGTH} characters', 400)
+    fingerprint = request_fingerprint(request, data)
+
+    try:
+        with transaction.atomic():
+            record, created = IdempotentRequest.objects.get_or_create(
+                session_id=session_id,
+                key=key,
+                defaults={'path': request.path, 'fingerprint': fingerprint}
+            )
+    except (ValidationError, ValueError):
+        # Malformed session id: the view answers it
+        return None, None
+    except IntegrityError:
+        # Lost a race with a concurrent retry, or the session does not exist
+        record = IdempotentRequest.objects.filter(session_id=session_id, key=key).first()
+        if record is None:
+            return None, None
+        created = False
+    if created:
+        return record, None
+
+    now = timezone.now()
+    ttl = timedelta(hours=getattr(settings, 'IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    lock_timeout = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 120))
+    if record.created_at < now - ttl:
+        # Expired: the key starts over
+        return _take_over(record, request.path, fingerprint, now)
+    if record.fingerprint != fingerprint:
+        return None, _error('This idempotency key was already used for a different request.', 422)
+    if record.status == 'completed':
+        response = JsonResponse(record.response_body, status=record.response_status, safe=False)
+        response[REPLAYED_HEADER] = 'true'
+        return None, response
+    if record.created_at < now - lock_timeout:
+        # The first attempt died without finishing (worker killed mid-request)
+        return _take_over(record, request.path, fingerprint, now)
+    response = _error('This request is still being processed. Please retry shortly.', 409)
+    response['Retry-After'] = '1'
+    return None, response
+
+
+def _take_over(record, path, fingerprint, now):
+    """Restart a stale record for this attempt; only one concurrent retry wins"""
+    taken = IdempotentRequest.objects.filter(pk=record.pk, created_at=record.created_at).update(
+        path=path,
+        fingerprint=fingerprint,
+        status='in_progress',
+        response_body=None,
+        response_status=None,
+        created_at=now,
+        completed_at=None
+    )
+    if not taken:
+        response = _error('This request is still being processed. Please retry shortly.', 409)
+        response['Retry-After'] = '1'
+        return None, response
+    record.created_at = now
+    return record, None
+
+
+def complete(record, response):
+    """
+    Store the view's response for replay. Server errors are not stored, so a
+    retry runs the request again.
+    """
+    if response.status_code >= 500 or not response.get('Content-Type', '').startswith('application/json'):
+        release(record)
+        return
+    record.response_body = json.loads(response.content)
+    record.response_status = response.status_code
+    record.status = 'completed'
+    record.completed_at = timezone.now()
+    record.save(update_fields=['response_body', 'response_status', 'status', 'completed_at'])
+
+
+def release(record):
+    """Forget a request that failed, so its retry runs again"""
+    IdempotentRequest.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+
+
+def idempotent(view):
+    """
+    Make a session-scoped POST view safe to retry: the first response for each
+    (session, idempotency key) is stored and replayed to retries without running
+    the view again (no repeated model calls, messages or loan applications).
+    A retry while the first attempt is still running gets 409; a key reused for
+    a different request gets 422. Requests without a key run as usual.
+    Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            record, response = await sync_to_async(claim)(request)
+            if response is not None:
+                return response
+            if record is None:
+                return await view(request, *args, **kwargs)
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(record)
+                raise
+            await sync_to_async(complete)(record, response)
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        record, response = claim(request)
+        if response is not None:
+            return response
+        if record is None:
+            return view(request, *args, **kwargs)
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            release(record)
+            raise
+        complete(record, response)
+        return response
+    return wrapper
@@ -0,0 +1,291 @@
+import base64
+import functools
+import hashlib
+import io
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .uploads import inspect_upload
+
+
+# Normalized upload ready to be sent to a vision model
+NormalizedImage = namedtuple(
+    'NormalizedImage',
+    ['data', 'mime_type', 'width', 'height', 'sha256']
+)
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+
+# Result of the local quality pre-check; issues is a list of keys of QUALITY_ISSUE_MESSAGES
+QualityReport = namedtuple('QualityReport', ['passed', 'issues', 'metrics'])
+
+# Per image kind. Sharpness is the variance of the Laplacian on an 800px grayscale copy.
+QUALITY_THRESHOLDS = {
+    'document': {
+        'min_short_edge': 400,
+        'min_sharpness': 40.0,
+        'min_brightness': 45.0,
+        'max_brightness': 245.0,
+        'max_clipped_fraction': 0.45,
+        'max_aspect_ratio': 2.4,
+    },
+    'selfie': {
+        'min_short_edge': 240,
+        'min_sharpness': 8.0,
+        'min_brightness': 40.0,
+        'max_brightness': 245.0,
+        'max_clipped_fraction': 0.5,
+        'max_aspect_ratio': 2.4,
+    },
+}
+
+QUALITY_ISSUE_MESSAGES = {
+    'too_small': "the image resolution is too low",
+    'blurry': "the image looks blurry",
+    'too_dark': "the image is too dark",
+    'too_bright': "the image is overexposed",
+    'bad_aspect_ratio': "the image is cropped too narrowly",
+}
+
+_ANALYSIS_EDGE = 800
+
+
+@functools.lru_cache(maxsize=None)
+def _laplacian():
+    from PIL import ImageFilter
+    return ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128)
+
+
+class InvalidImageError(ValueError):
+    """Raised when an upload cannot be decoded as an image"""
+
+
+def read_image_bytes(image_file):
+    """Bytes of an uploaded file, file-like object or raw bytes (file position is restored)"""
+    if hasattr(image_file, 'read'):
+        image_file.seek(0)
+        data = image_file.read()
+        image_file.seek(0)
+        return data
+    return bytes(image_file)
+
+
+def _normalization_options():
+    """(max_edge, format, quality) from settings"""
+    max_edge = int(getattr(settings, 'IMAGE_MAX_EDGE', 1600))
+    image_format = str(getattr(settings, 'IMAGE_FORMAT', 'JPEG')).upper()
+    if image_format == 'JPG':
+        image_format = 'JPEG'
+    if image_format not in ('JPEG', 'WEBP'):
+        image_format = 'JPEG'
+    quality = int(getattr(settings, 'IMAGE_QUALITY', 85))
+    return max_edge, image_format, quality
+
+
+class _NormalizedCache:
+    """Bounded LRU of normalized images keyed by (sha256 of input, options)"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        max_entries = int(getattr(settings, 'IMAGE_CACHE_SIZE', 64))
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = _NormalizedCache()
+
+
+def _encode(image, max_edge, image_format, quality):
+    """Resize to max_edge and recompress; metadata (EXIF, ICC, XMP) is not carried over"""
+    from PIL import Image, ImageOps
+    
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    if image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            # Flatten transparency onto white instead of black
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    return output.getvalue(), image.size
+
+
+def normalize_image(image_file, sha256=None):
+    """
+    Prepare an upload for a vision call: fix EXIF rotation, downsize to the
+    configured long edge, recompress and strip metadata.
+
+    File-like uploads are hashed in chunks and decoded straight from the
+    stream, so the raw bytes are never copied into memory; pass sha256 when it
+    is already known (e.g. from uploads.inspect_upload).
+
+    Results are cached by content hash, and the normalized output is cached
+    under its own hash too, so normalizing twice does not recompress twice.
+    Returns: NormalizedImage
+    """
+    if hasattr(image_file, 'read'):
+        digest = sha256 or inspect_upload(image_file).sha256
+        source = image_file
+    else:
+        data = bytes(image_file)
+        digest = sha256 or hashlib.sha256(data).hexdigest()
+        source = io.BytesIO(data)
+    options = _normalization_options()
+
+    cached = _cache.get((digest, options))
+    if cached is not None:
+        return cached
+
+    # Pillow is imported on first use to keep it out of cold starts
+    from PIL import Image, UnidentifiedImageError
+    
+    max_edge, image_format, quality = options
+    try:
+        source.seek(0)
+        image = Image.open(source)
+        if image.format == 'JPEG':
+            # Let libjpeg decode at a reduced scale instead of full resolution
+            image.draft('RGB', (max_edge, max_edge))
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImageError(f"Unreadable image: {e}")
+    finally:
+        source.seek(0)
+
+    encoded, (width, height) = _encode(image, max_edge, image_format, quality)
+    normalized = NormalizedImage(
+        encoded,
+        MIME_TYPES[image_format],
+        width,
+        height,
+        hashlib.sha256(encoded).hexdigest()
+    )
+
+    _cache.set((digest, options), normalized)
+    _cache.set((normalized.sha256, options), normalized)
+    return normalized
+
+
+def to_data_url(normalized):
+    """data:<mime>;base64,... URL for an OpenAI image_url content part"""
+    encoded = base64.b64encode(normalized.data).decode('ascii')
+    return f"data:{normalized.mime_type};base64,{encoded}"
+
+
+def _quality_thresholds(kind):
+    thresholds = dict(QUALITY_THRESHOLDS.get(kind, QUALITY_THRESHOLDS['document']))
+    thresholds.update(getattr(settings, 'IMAGE_QUALITY_THRESHOLDS', {}).get(kind, {}))
+    return thresholds
+
+
+def assess_image_quality(image_file, kind='document'):
+    """
+    Cheap local check for resolution, blur, exposure and aspect ratio,
+    run before an image is sent to a vision model.
+
+    kind: 'document' (PAN card) or 'selfie'
+    Returns: QualityReport
+    """
+    from PIL import Image, ImageStat, UnidentifiedImageError
+    
+    data = read_image_bytes(image_file)
+    thresholds = _quality_thresholds(kind)
+    try:
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size  # Orientation does not change short/long edge
+        if image.format == 'JPEG':
+            image.draft('L', (_ANALYSIS_EDGE, _ANALYSIS_EDGE))
+        gray = image.convert('L')
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImageError(f"Unreadable image: {e}")
+
+    if max(gray.size) > _ANALYSIS_EDGE:
+        gray.thumbnail((_ANALYSIS_EDGE, _ANALYSIS_EDGE), Image.BILINEAR)
+
+    # Pillow leaves border pixels unfiltered, so drop them before measuring
+    laplacian = gray.filter(_laplacian())
+    if laplacian.width > 2 and laplacian.height > 2:
+        laplacian = laplacian.crop((1, 1, laplacian.width - 1, laplacian.height - 1))
+    sharpness = ImageStat.Stat(laplacian).var[0]
+
+    histogram = gray.histogram()
+    pixels = sum(histogram) or 1
+    brightness = sum(level * count for level, count in enumerate(histogram)) / pixels
+    clipped = (sum(histogram[:6]) + sum(histogram[250:])) / pixels
+
+    short_edge, long_edge = sorted((width, height))
+    aspect_ratio = long_edge / short_edge if short_edge else float('inf')
+
+    issues = []
+    if short_edge < thresholds['min_short_edge']:
+        issues.append('too_small')
+    if sharpness < thresholds['min_sharpness']:
+        issues.append('blurry')
+    if brightness < thresholds['min_brightness']:
+        issues.append('too_dark')
+    elif brightness > thresholds['max_brightness']:
+        issues.append('too_bright')
+    elif clipped > thresholds['max_clipped_fraction']:
+        issues.append('too_bright' if brightness >= 128 else 'too_dark')
+    if aspect_ratio > thresholds['max_aspect_ratio']:
+        issues.append('bad_aspect_ratio')
+
+    metrics = {
+        'width': width,
+        'height': height,
+        'sharpness': round(sharpness, 1),
+        'brightness': round(brightness, 1),
+        'clipped_fraction': round(clipped, 3),
+        'aspect_ratio': round(aspect_ratio, 2),
+    }
+    return QualityReport(not issues, issues, metrics)
+
+
+def describe_quality_issues(issues, subject='photo'):
+    """User-facing retry message for a failed QualityReport"""
+    reasons = [QUALITY_ISSUE_MESSAGES.get(issue, issue) for issue in issues]
+    if len(reasons) > 1:
+        reason_text = ', '.join(reasons[:-1]) + ' and ' + reasons[-1]
+    else:
+        reason_text = reasons[0] if reasons else 'the image could not be used'
+    return (
+        f"We couldn't use this {subject} photo because {reason_text}. "
+        f"Please retake it in good lighting, hold the camera steady and keep the whole "
+        f"{subject} in frame."
+    )
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,303 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from .timing import record
+
+
+BUSY_MESSAGE = "We're handling a lot of requests right now. Please try again in a few seconds."
+
+# Rough token estimate of a request before it is sent: text at ~4 characters
+# per token, a flat amount per image and an allowance for the completion
+CHARS_PER_TOKEN = 4
+IMAGE_TOKEN_ESTIMATE = 800
+COMPLETION_TOKEN_ESTIMATE = 300
+
+# Recent waits kept for the wait time percentiles
+WAIT_SAMPLES = 1000
+
+# Waiters re-check at least this often (async waiters cannot be notified)
+POLL_INTERVAL = 0.05
+
+
+class LLMBusyError(Exception):
+    """
+    No model capacity within the caller's deadline (or the provider rate
+    limited us). Views turn it into a 503 with Retry-After.
+    """
+
+    def __init__(self, retry_after=1, reason='busy'):
+        super().__init__(f"LLM capacity exhausted ({reason}); retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def estimate_tokens(messages):
+    """Approximate prompt + completion tokens of a chat completion request"""
+    chars = 0
+    images = 0
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'text':
+                    chars += len(part.get('text', ''))
+                elif part.get('type') == 'image_url':
+                    images += 1
+    return chars // CHARS_PER_TOKEN + images * IMAGE_TOKEN_ESTIMATE + COMPLETION_TOKEN_ESTIMATE
+
+
+class TokenBucket:
+    """rate units per second, holding at most capacity (not thread-safe; the limiter locks)"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available (amounts above capacity wait for a full bucket)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative when actual usage exceeds the estimate; later callers wait it out
+        self.level -= amount
+
+
+class _Slot:
+    def __init__(self, limiter, tokens):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def settle(self, actual_tokens):
+        """Correct the token budget with the usage the provider reported"""
+        if actual_tokens is not None:
+            self.limiter.settle(self.tokens, actual_tokens)
+            self.tokens = actual_tokens
+
+
+class LLMLimiter:
+    """
+    Process-wide limit on model calls: at most max_concurrency in flight, a
+    requests/second and a tokens/minute token bucket (0 disables either).
+    Callers queue until capacity frees up or their deadline passes, and are
+    turned away immediately once max_queue callers are already waiting.
+    Limits apply per process; divide the provider's limits by the process count.
+    """
+
+    def __init__(self, max_concurrency=16, requests_per_second=0, tokens_per_minute=0,
+                 max_queue=64, queue_timeout=10.0):
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._requests = TokenBucket(requests_per_second, max(1.0, requests_per_second)) if requests_per_second else None
+        self._tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self._paused_until = 0.0
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.rate_limited = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._wait_total = 0.0
+
+    # Capacity checks (callers hold self._cond)
+
+    def _wait_time(self, tokens, now):
+        """0 when a call with this many tokens may start now, else seconds to wait"""
+        waits = [self._paused_until - now]
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            # Freed by a release, which notifies sync waiters
+            waits.append(self.queue_timeout)
+        if self._requests:
+            waits.append(self._requests.wait_time(1, now))
+        if self._tokens:
+            waits.append(self._tokens.wait_time(tokens, now))
+        return max(0.0, *waits)
+
+    def _take(self, tokens):
+        self.in_flight += 1
+        self.acquired += 1
+        if self._requests:
+            self._requests.take(1)
+        if self._tokens:
+            self._tokens.take(tokens)
+
+    def _retry_after(self):
+        now = time.monotonic()
+        if self._paused_until > now:
+            return max(1, math.ceil(self._paused_until - now))
+        if self.requests_per_second:
+            return max(1, math.ceil((self.waiting + 1) / self.requests_per_second))
+        return 1
+
+    def _take_now(self, tokens):
+        """Start right away when nobody is queued and there is capacity (no queue slot needed)"""
+        if self.waiting or self._wait_time(tokens, time.monotonic()) > 0:
+            return False
+        self._take(tokens)
+        self._record_wait(0.0)
+        return True
+
+    def _enqueue(self):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise LLMBusyError(self._retry_after(), 'queue full')
+        self.waiting += 1
+
+    def _record_wait(self, waited):
+        self._waits.append(waited)
+        self._wait_total += waited
+        record('llm_queue', waited)
+
+    # Acquire / release
+
+    def acquire(self, tokens, timeout=None):
+        """Block until a call may start. Raises LLMBusyError at the deadline"""
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        started = time.monotonic()
+        with self._cond:
+            if self._take_now(tokens):
+                return
+            self._enqueue()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(tokens, now)
+                    if wait <= 0:
+                        self._take(tokens)
+                        break
+                    if now >= deadline:
+                        self.timed_out += 1
+                        raise LLMBusyError(self._retry_after(), 'queue timeout')
+                    self._cond.wait(min(wait, deadline - now))
+            finally:
+                self.waiting -= 1
+            self._record_wait(time.monotonic() - started)
+
+    async def aacquire(self, tokens, timeout=None):
+        """acquire() for the event loop: waits by sleeping, never blocks the loop"""
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        started = time.monotonic()
+        with self._cond:
+            if self._take_now(tokens):
+                return
+            self._enqueue()
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    wait = self._wait_time(tokens, now)
+                    if wait <= 0:
+                        self._take(tokens)
+                        self._record_wait(now - started)
+                        return
+                    if now >= deadline:
+                        self.timed_out += 1
+                        raise LLMBusyError(self._retry_after(), 'queue timeout')
+                await asyncio.sleep(min(wait, deadline - now, POLL_INTERVAL))
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def settle(self, estimated_tokens, actual_tokens):
+        if self._tokens:
+            with self._cond:
+                self._tokens.take(actual_tokens - estimated_tokens)
+
+    def backoff(self, seconds):
+        """The provider rate limited us: hold new calls for seconds"""
+        with self._cond:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @contextmanager
+    def slot(self, tokens, timeout=None):
+        self.acquire(tokens, timeout)
+        try:
+            yield _Slot(self, tokens)
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, tokens, timeout=None):
+        await self.aacquire(tokens, timeout)
+        try:
+            yield _Slot(self, tokens)
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            waits = sorted(self._waits)
+            if self._requests:
+                self._requests._refill(now)
+            if self._tokens:
+                self._tokens._refill(now)
+            return {
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'max_concurrency': self.max_concurrency,
+                'requests_per_second': self.requests_per_second,
+                'tokens_per_minute': self.tokens_per_minute,
+                'tokens_available': round(self._tokens.level) if self._tokens else None,
+                'paused_for': round(max(0.0, self._paused_until - now), 3),
+                'acquired': self.acquired,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'rate_limited': self.rate_limited,
+                'wait_seconds': {
+                    'mean': round(self._wait_total / self.acquired, 4) if self.acquired else 0.0,
+                    'p50': round(waits[len(waits) // 2], 4) if waits else 0.0,
+                    'p95': round(waits[int(len(waits) * 0.95)], 4) if waits else 0.0,
+                    'max': round(waits[-1], 4) if waits else 0.0,
+                },
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """The process-wide limiter, configured from the LLM_* settings on first use"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = LLMLimiter(
+                    max_concurrency=int(getattr(settings, 'LLM_MAX_CONCURRENCY', 16)),
+                    requests_per_second=float(getattr(settings, 'LLM_REQUESTS_PER_SECOND', 0)),
+                    tokens_per_minute=int(getattr(settings, 'LLM_TOKENS_PER_MINUTE', 0)),
+                    max_queue=int(getattr(settings, 'LLM_MAX_QUEUE', 64)),
+                    queue_timeout=float(getattr(settings, 'LLM_QUEUE_TIMEOUT', 10.0)),
+                )
+    return _limiter
@@ -0,0 +1,546 @@
+# management/commands/loadtest.py
+# Open-loop load test of the full chat workflow against a running server (stdlib HTTP client)
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from collections import Counter, defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+import http.client
+import json
+import mimetypes
+import random
+import re
+import string
+import threading
+import time
+import uuid
+
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+HISTOGRAM_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+FIXTURE_FILES = {
+    'pan_card': 'pan_card.jpg',
+    'selfie': 'selfie.jpg',
+    'salary_slip': 'salary_slip.pdf',
+}
+
+# What the virtual users type; stub_llm_server extracts the same values back.
+# The amount is above the instant approval limit for this profile, so every
+# session goes through the salary slip upload before the letter download
+NAME_MESSAGE = 'My name is {name} and I was born on 15/06/1995'
+PAN_MESSAGE = 'My PAN number is {pan}'
+LOAN_MESSAGE = (
+    'I need a loan of 1200000 for home renovation over 36 months. I am salaried, working at '
+    'Tata Consultancy Services as a Senior Software Engineer for 30 months, earning 85000 a month.'
+)
+
+# Endpoints with an /async/ variant (--async-views)
+ASYNC_ENDPOINTS = ('start_chat', 'chat', 'upload_pan_card', 'upload_selfie')
+
+# Seconds between polls of a queued verification job
+JOB_POLL_INTERVAL = 0.5
+
+SERVER_TIMING_TOTAL_RE = re.compile(r'(?:^|,)\s*total;dur=([0-9.]+)')
+
+
+def make_fixtures(directory):
+    """
+    Write the upload fixtures that are missing: noisy images that pass the
+    upload quality checks and a text salary slip the local PDF parser reads
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    created = []
+    for kind, size in (('pan_card', (1000, 630)), ('selfie', (640, 800))):
+        path = directory / FIXTURE_FILES[kind]
+        if not path.exists():
+            from PIL import Image
+            Image.effect_noise(size, 60).convert('RGB').save(path, 'JPEG', quality=90)
+            created.append(path.name)
+    path = directory / FIXTURE_FILES['salary_slip']
+    if not path.exists():
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+        pdf = canvas.Canvas(str(path), pagesize=A4)
+        lines = (
+            'SALARY SLIP',
+            'Company Name: Tata Consultancy Services Ltd',
+            'Employee: Load Test User',
+            'Designation: Senior Software Engineer',
+            'Basic Salary: 60,000.00',
+            'House Rent Allowance: 25,000.00',
+            'Special Allowance: 15,000.00',
+            'Gross Earnings: 1,00,000.00',
+            'Total Deductions: 15,000.00',
+            'Net Pay: 85,000.00',
+        )
+        for i, line in enumerate(lines):
+            pdf.drawString(72, 770 - i * 22, line)
+        pdf.save()
+        created.append(path.name)
+    return created
+
+
+def encode_multipart(fields, files):
+    """
+    fields: {name: value}; files: {name: (filename, bytes)}
+    Returns: (body bytes, Content-Type header)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    for name, (filename, data) in files.items():
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Stats:
+    """Per-endpoint latencies, status codes and errors, shared by the virtual user threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.server_ms = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.sessions = Counter()
+        self.failed_steps = Counter()
+        self.start_lag = []
+
+    def record(self, endpoint, seconds, status, server_ms=None):
+        with self.lock:
+            self.latencies[endpoint].append(seconds * 1000)
+            self.statuses[endpoint][status] += 1
+            if server_ms is not None:
+                self.server_ms[endpoint].append(server_ms)
+
+    def finish_session(self, outcome, failed_step=None, lag=None):
+        with self.lock:
+            self.sessions[outcome] += 1
+            if failed_step:
+                self.failed_steps[failed_step] += 1
+            if lag is not None:
+                self.start_lag.append(lag * 1000)
+
+
+class StepFailed(Exception):
+    def __init__(self, step, detail):
+        super().__init__(f'{step}: {detail}')
+        self.step = step
+
+
+class VirtualUser:
+    """One customer going through the chat workflow over its own keep-alive connection"""
+
+    def __init__(self, base_url, number, run_id, fixtures, stats, timeout, think_time, prefix):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.base_path = parts.path.rstrip('/')
+        self.number = number
+        self.fixtures = fixtures
+        self.stats = stats
+        self.timeout = timeout
+        self.think_time = think_time
+        self.prefix = prefix
+        self.connection = None
+        # Unique per user so every run creates new customers
+        self.pan = f'{run_id}{string.ascii_uppercase[number // 10000 % 26]}{number % 10000:04d}Z'
+        self.name = f'Load User {self.pan}'
+        self.session_id = None
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(self.netloc, timeout=self.timeout)
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        """
+        Returns: (status, headers, body bytes); status 0 on a connection error or timeout
+        """
+        headers = dict(headers or {})
+        started = time.perf_counter()
+        for attempt in (1, 2):
+            if self.connection is None:
+                self._connect()
+            try:
+                self.connection.request(method, self.base_path + path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                # The server closed an idle keep-alive connection: retry once on a new one
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    self.stats.record(endpoint, time.perf_counter() - started, type(e).__name__)
+                    return 0, {}, b''
+            except OSError as e:
+                self.connection.close()
+                self.connection = None
+                self.stats.record(endpoint, time.perf_counter() - started, type(e).__name__)
+                return 0, {}, b''
+        elapsed = time.perf_counter() - started
+        server_timing = SERVER_TIMING_TOTAL_RE.search(response.getheader('Server-Timing') or '')
+        self.stats.record(
+            endpoint, elapsed, response.status, float(server_timing.group(1)) if server_timing else None
+        )
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+            self.connection = None
+        return response.status, dict(response.getheaders()), data
+
+    def path(self, endpoint):
+        return f'/{self.prefix}{endpoint}/' if endpoint in ASYNC_ENDPOINTS else f'/{endpoint}/'
+
+    def post_json(self, endpoint, data):
+        status, _, body = self.request(endpoint, 'POST', self.path(endpoint), json.dumps(data), {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': uuid.uuid4().hex,
+        })
+        return self._json(endpoint, status, body)
+
+    def upload(self, endpoint, field, kind):
+        filename, data = self.fixtures[kind]
+        body, content_type = encode_multipart({'session_id': self.session_id}, {field: (filename, data)})
+        status, _, response_body = self.request(endpoint, 'POST', self.path(endpoint), body, {
+            'Content-Type': content_type,
+            'Idempotency-Key': uuid.uuid4().hex,
+        })
+        result = self._json(endpoint, status, response_body, allowed=(200, 202))
+        if status == 202 and result.get('queued'):
+            result = self.wait_for_job(result['status_url'])
+        return result
+
+    def wait_for_job(self, status_url):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            status, _, body = self.request('verification_job', 'GET', status_url)
+            if status == 200:
+                return json.loads(body)
+            if status != 202:
+                raise StepFailed('verification_job', f'HTTP {status}')
+            time.sleep(JOB_POLL_INTERVAL)
+        raise StepFailed('verification_job', 'not finished before the timeout')
+
+    def _json(self, endpoint, status, body, allowed=(200,)):
+        if status not in allowed:
+            raise StepFailed(endpoint, f'HTTP {status}' if status else 'connection error')
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise StepFailed(endpoint, 'response is not JSON')
+
+    def think(self):
+        if self.think_time:
+            time.sleep(random.expovariate(1 / self.think_time))
+
+    def expect(self, step, result, stage):
+        if result.get('workflow_stage') != stage:
+            raise StepFailed(step, f"at stage {result.get('workflow_stage')!r}, expected {stage!r}")
+
+    def run(self):
+        """The session script. Returns the loan id when a sanction letter was downloaded"""
+        try:
+            result = self.post_json('start_chat', {})
+            self.session_id = result['session_id']
+            self.think()
+            result = self.post_json('chat', {
+                'session_id': self.session_id, 'message': NAME_MESSAGE.format(name=self.name)
+            })
+            self.expect('chat', result, 'pan_collection')
+            self.think()
+            result = self.post_json('chat', {'session_id': self.session_id, 'message': PAN_MESSAGE.format(pan=self.pan)})
+            self.expect('chat', result, 'pan_verification')
+            self.think()
+            result = self.upload('upload_pan_card', 'pan_card_image', 'pan_card')
+            self.expect('upload_pan_card', result, 'selfie_verification')
+            self.think()
+            result = self.upload('upload_selfie', 'selfie_image', 'selfie')
+            self.expect('upload_selfie', result, 'loan_details')
+            self.think()
+            result = self.post_json('chat', {'session_id': self.session_id, 'message': LOAN_MESSAGE})
+            loan_id = result.get('loan_id')
+            if result.get('upload_type') == 'salary_slip':
+                self.think()
+                result = self.upload('upload_salary_slip', 'salary_slip', 'salary_slip')
+                if not result.get('success'):
+                    raise StepFailed('upload_salary_slip', result.get('message', 'not verified'))
+                loan_id = result.get('loan_id')
+            if loan_id:
+                self.think()
+                status, _, _ = self.request(
+                    'download_sanction_letter', 'GET',
+                    f'/download_sanction_letter/{loan_id}/?session_id={self.session_id}'
+                )
+                if status != 200:
+                    raise StepFailed('download_sanction_letter', f'HTTP {status}')
+            return loan_id
+        finally:
+            if self.connection is not None:
+                self.connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Open-loop load test of a running server: virtual users arrive at a Poisson rate and each '
+        'runs the whole workflow (start_chat, chat turns, PAN / selfie / salary slip uploads, '
+        'sanction letter download). Reports throughput, per-endpoint latency histograms and error '
+        'rates. Point the server at stub_llm_server (OPENAI_BASE_URL) to measure the app alone.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000',
+            help='Base URL of the running server'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=2.0,
+            help='New sessions per second (mean of the Poisson arrivals)'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=60.0,
+            help='Seconds during which sessions arrive; running sessions are then allowed to finish'
+        )
+        parser.add_argument(
+            '--max-users',
+            type=int,
+            default=500,
+            help='Concurrent virtual users; arrivals beyond this are dropped and reported'
+        )
+        parser.add_argument(
+            '--think-time',
+            type=float,
+            default=0.0,
+            help='Mean seconds a user waits between steps (exponentially distributed)'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=60.0,
+            help='Seconds before a request (or a queued verification) counts as failed'
+        )
+        parser.add_argument(
+            '--fixtures',
+            default=str(Path(settings.BASE_DIR) / 'loadtest_fixtures'),
+            help=f"Directory with {', '.join(FIXTURE_FILES.values())} (missing files are generated)"
+        )
+        parser.add_argument(
+            '--async-views',
+            action='store_true',
+            help='Use the /async/ chat and image upload endpoints'
+        )
+        parser.add_argument(
+            '--server-cores',
+            type=int,
+            help='CPU cores the server uses, to report sessions per second per core'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Random seed for repeatable arrival times'
+        )
+        parser.add_argument(
+            '--json',
+            dest='json_path',
+            help='Also write the results to this JSON file'
+        )
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0 or options['duration'] <= 0:
+            raise CommandError('--rate and --duration must be positive')
+        if urlsplit(options['url']).scheme not in ('http', 'https'):
+            raise CommandError('--url must be an http:// or https:// URL')
+        rng = random.Random(options['seed'])
+
+        fixtures_dir = Path(options['fixtures'])
+        created = make_fixtures(fixtures_dir)
+        if created:
+            self.stdout.write(f"Generated fixtures in {fixtures_dir}: {', '.join(created)}")
+        fixtures = {
+            kind: (filename, (fixtures_dir / filename).read_bytes())
+            for kind, filename in FIXTURE_FILES.items()
+        }
+
+        stats = Stats()
+        run_id = ''.join(rng.choice(string.ascii_uppercase) for _ in range(4))
+        slots = threading.BoundedSemaphore(max(1, options['max_users']))
+        threads = []
+        dropped = 0
+
+        def virtual_user(number, scheduled):
+            lag = time.perf_counter() - scheduled
+            user = VirtualUser(
+                options['url'], number, run_id, fixtures, stats,
+                options['timeout'], options['think_time'],
+                'async/' if options['async_views'] else ''
+            )
+            try:
+                user.run()
+                stats.finish_session('completed', lag=lag)
+            except StepFailed as e:
+                stats.finish_session('failed', e.step, lag=lag)
+            except Exception as e:
+                stats.finish_session('failed', type(e).__name__, lag=lag)
+            finally:
+                slots.release()
+
+        self.stdout.write(
+            f"Load test of {options['url']}: {options['rate']:g} sessions/s for {options['duration']:g}s "
+            f"(up to {options['max_users']} concurrent users)"
+        )
+        started = time.perf_counter()
+        next_arrival = started
+        number = 0
+        # Open loop: arrivals follow the schedule whatever the server's response times
+        while True:
+            next_arrival += rng.expovariate(options['rate'])
+            if next_arrival - started > options['duration']:
+                break
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if not slots.acquire(blocking=False):
+                dropped += 1
+                continue
+            thread = threading.Thread(target=virtual_user, args=(number, next_arrival), daemon=True)
+            thread.start()
+            threads.append(thread)
+            number += 1
+        arrivals_done = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        report = self.build_report(stats, elapsed, arrivals_done - started, dropped, options)
+        self.print_report(report)
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def build_report(self, stats, elapsed, arrival_window, dropped, options):
+        endpoints = {}
+        total_requests = total_errors = 0
+        for endpoint, latencies in sorted(stats.latencies.items()):
+            latencies = sorted(latencies)
+            server_ms = sorted(stats.server_ms[endpoint])
+            statuses = stats.statuses[endpoint]
+            errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400)
+            histogram = Counter()
+            for value in latencies:
+                bucket = next((f'<={bound}ms' for bound in HISTOGRAM_BUCKETS_MS if value <= bound),
+                              f'>{HISTOGRAM_BUCKETS_MS[-1]}ms')
+                histogram[bucket] += 1
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'errors': errors,
+                'error_rate': round(errors / len(latencies), 4),
+                'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+                'latency_ms': {
+                    'p50': round(percentile(latencies, 50), 1),
+                    'p90': round(percentile(latencies, 90), 1),
+                    'p99': round(percentile(latencies, 99), 1),
+                    'max': round(latencies[-1], 1),
+                },
+                'server_p50_ms': round(percentile(server_ms, 50), 1) if server_ms else None,
+                'histogram': {
+                    bucket: histogram[bucket]
+                    for bucket in [f'<={bound}ms' for bound in HISTOGRAM_BUCKETS_MS] + [f'>{HISTOGRAM_BUCKETS_MS[-1]}ms']
+                },
+            }
+            total_requests += len(latencies)
+            total_errors += errors
+
+        completed = stats.sessions['completed']
+        sessions_per_second = completed / elapsed if elapsed else 0.0
+        lag = sorted(stats.start_lag)
+        return {
+            'url': options['url'],
+            'rate': options['rate'],
+            'duration': options['duration'],
+            'elapsed_seconds': round(elapsed, 2),
+            'arrival_window_seconds': round(arrival_window, 2),
+            'sessions': {
+                'started': sum(stats.sessions.values()),
+                'completed': completed,
+                'failed': stats.sessions['failed'],
+                'dropped': dropped,
+                'failed_steps': dict(stats.failed_steps),
+            },
+            'throughput': {
+                'requests_per_second': round(total_requests / elapsed, 2) if elapsed else 0.0,
+                'sessions_per_second': round(sessions_per_second, 3),
+                'sessions_per_second_per_core': (
+                    round(sessions_per_second / options['server_cores'], 3) if options['server_cores'] else None
+                ),
+            },
+            'requests': total_requests,
+            'errors': total_errors,
+            'error_rate': round(total_errors / total_requests, 4) if total_requests else 0.0,
+            'start_lag_ms': {'p50': round(percentile(lag, 50), 1), 'max': round(lag[-1], 1) if lag else 0.0},
+            'endpoints': endpoints,
+        }
+
+    def print_report(self, report):
+        sessions = report['sessions']
+        throughput = report['throughput']
+        self.stdout.write(
+            f"\nSessions: {sessions['started']} started, {sessions['completed']} completed, "
+            f"{sessions['failed']} failed, {sessions['dropped']} dropped (client at --max-users)"
+        )
+        if sessions['failed_steps']:
+            failed = ', '.join(f'{step} {count}' for step, count in Counter(sessions['failed_steps']).most_common())
+            self.stdout.write(f"  failed at: {failed}")
+        line = (
+            f"Throughput: {throughput['requests_per_second']:.1f} req/s, "
+            f"{throughput['sessions_per_second']:.2f} completed sessions/s"
+        )
+        if throughput['sessions_per_second_per_core'] is not None:
+            line += f" ({throughput['sessions_per_second_per_core']:.2f} per server core)"
+        self.stdout.write(line + f" over {report['elapsed_seconds']:.1f}s")
+        self.stdout.write(
+            f"Errors: {report['errors']}/{report['requests']} requests ({report['error_rate'] * 100:.2f}%)"
+        )
+        if report['start_lag_ms']['max'] > 100:
+            self.stdout.write(self.style.WARNING(
+                f"Generator lag up to {report['start_lag_ms']['max']:.0f}ms: the client machine is saturated"
+            ))
+
+        self.stdout.write(
+            f"\n{'endpoint':<26}{'requests':>9}{'errors':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'server p50':>12}"
+        )
+        for endpoint, data in report['endpoints'].items():
+            latency = data['latency_ms']
+            server = f"{data['server_p50_ms']:.0f}ms" if data['server_p50_ms'] is not None else '-'
+            self.stdout.write(
+                f"{endpoint:<26}{data['requests']:>9}{data['errors']:>8}"
+                f"{latency['p50']:>7.0f}ms{latency['p90']:>7.0f}ms{latency['p99']:>7.0f}ms{latency['max']:>7.0f}ms"
+                f"{server:>12}"
+            )
+        for endpoint, data in report['endpoints'].items():
+            self.stdout.write(f"\n{endpoint} latency histogram")
+            peak = max(data['histogram'].values()) or 1
+            for bucket, count in data['histogram'].items():
+                self.stdout.write(f"  {bucket:>10} {count:>7}  {'#' * round(40 * count / peak)}")
+            errors = {status: count for status, count in data['statuses'].items() if not status.isdigit() or int(status) >= 400}
+            if errors:
+                self.stdout.write(f"  errors: {', '.join(f'{status} x{count}' for status, count in errors.items())}")
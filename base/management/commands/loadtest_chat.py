@@ -0,0 +1,169 @@
+# management/commands/loadtest_chat.py
+# Compares concurrent chat sessions served by the sync (WSGI) and async (ASGI) views
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import asyncio
+import statistics
+import time
+
+from base import agents
+from base.models import ChatSession
+
+
+FAKE_REPLY = 'Thank you. Could you please share your full name and date of birth?'
+
+USER_MESSAGES = (
+    'Hi, I would like a personal loan.',
+    'My name is Rahul Sharma and I was born on 15/06/1995.',
+)
+
+
+def _percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs N concurrent chat sessions (start_chat + messages) against the sync views '
+        'through a thread pool, as a threaded WSGI worker would, and against the async '
+        'views on one event loop. The model is replaced by a fixed-latency stub.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sessions',
+            type=int,
+            default=200,
+            help='Concurrent chat sessions'
+        )
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=len(USER_MESSAGES),
+            help='User messages per session after start_chat'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.5,
+            help='Simulated model latency per call in seconds'
+        )
+        parser.add_argument(
+            '--wsgi-threads',
+            type=int,
+            default=8,
+            help='Request threads for the sync run (gunicorn --threads)'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['both', 'wsgi', 'asgi'],
+            default='both',
+            help='Which views to exercise'
+        )
+
+    def handle(self, *args, **options):
+        latency = options['latency']
+        sessions = max(1, options['sessions'])
+        messages = [USER_MESSAGES[i % len(USER_MESSAGES)] for i in range(max(0, options['messages']))]
+
+        def fake_call(messages, temperature=agents.DEFAULT_TEMPERATURE):
+            time.sleep(latency)
+            return FAKE_REPLY
+
+        async def fake_acall(messages, temperature=agents.DEFAULT_TEMPERATURE):
+            await asyncio.sleep(latency)
+            return FAKE_REPLY
+
+        self.session_ids = []
+        results = {}
+        try:
+            with mock.patch.object(agents, 'call_openai', fake_call), \
+                    mock.patch.object(agents, 'acall_openai', fake_acall):
+                if options['mode'] in ('both', 'wsgi'):
+                    results['wsgi'] = self.run_wsgi(sessions, messages, max(1, options['wsgi_threads']))
+                if options['mode'] in ('both', 'asgi'):
+                    results['asgi'] = asyncio.run(self.run_asgi(sessions, messages))
+        finally:
+            ChatSession.objects.filter(id__in=self.session_ids).delete()
+
+        self.stdout.write(
+            f"{sessions} session(s) x {1 + len(messages)} request(s), "
+            f"simulated model latency {latency * 1000:.0f}ms"
+        )
+        for mode, (elapsed, latencies, errors) in results.items():
+            label = f"{mode} ({options['wsgi_threads']} threads)" if mode == 'wsgi' else f"{mode} (1 event loop)"
+            self.stdout.write(
+                f"  {label:<22} {elapsed:7.2f}s  {len(latencies) / elapsed:8.1f} req/s  "
+                f"p50 {_percentile(latencies, 50) * 1000:7.0f}ms  "
+                f"p95 {_percentile(latencies, 95) * 1000:7.0f}ms  "
+                f"errors {errors}"
+            )
+        if len(results) == 2:
+            speedup = results['wsgi'][0] / results['asgi'][0]
+            self.stdout.write(self.style.SUCCESS(f"Async views finished {speedup:.1f}x faster"))
+
+    def run_wsgi(self, sessions, messages, threads):
+        start_url, chat_url = reverse('base:start_chat'), reverse('base:chat')
+
+        def conversation(_):
+            client = Client()
+            latencies, errors = [], 0
+            started = time.perf_counter()
+            response = client.post(start_url)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                return latencies, errors + 1, None
+            session_id = response.json()['session_id']
+            for message in messages:
+                started = time.perf_counter()
+                response = client.post(
+                    chat_url, {'session_id': session_id, 'message': message}, content_type='application/json'
+                )
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+            return latencies, errors, session_id
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            outcomes = list(executor.map(conversation, range(sessions)))
+        return self._summarize(time.perf_counter() - started, outcomes)
+
+    async def run_asgi(self, sessions, messages):
+        start_url, chat_url = reverse('base:start_chat_async'), reverse('base:chat_async')
+
+        async def conversation():
+            client = AsyncClient()
+            latencies, errors = [], 0
+            started = time.perf_counter()
+            response = await client.post(start_url)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                return latencies, errors + 1, None
+            session_id = response.json()['session_id']
+            for message in messages:
+                started = time.perf_counter()
+                response = await client.post(
+                    chat_url, {'session_id': session_id, 'message': message}, content_type='application/json'
+                )
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+            return latencies, errors, session_id
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(conversation() for _ in range(sessions)))
+        return self._summarize(time.perf_counter() - started, outcomes)
+
+    def _summarize(self, elapsed, outcomes):
+        latencies, errors = [], 0
+        for session_latencies, session_errors, session_id in outcomes:
+            latencies.extend(session_latencies)
+            errors += session_errors
+            if session_id:
+                self.session_ids.append(session_id)
+        return elapsed, latencies, errors
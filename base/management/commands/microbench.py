@@ -0,0 +1,292 @@
+# management/commands/microbench.py
+# Microbenchmarks for the pure-Python helpers on the request path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import date
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from base.agents import (
+    CreditScoreCalculator,
+    CustomerSegmentation,
+    PANVerificationAgent,
+    FaceMatchAgent,
+)
+from base.amortization import AmortizationEngine
+from base.models import ChatSession
+from base.underwriting_policy import get_underwriting_policy
+from base import views
+
+
+# Fixed inputs so runs are comparable across commits and machines
+LOAN_DETAILS = {
+    'company_name': 'Tata Consultancy Services',
+    'designation': 'Senior Software Engineer',
+    'monthly_income': 85000,
+    'employment_duration_months': 30,
+    'employment_type': 'salaried',
+    'loan_amount': 500000,
+    'tenure_months': 36,
+    'existing_obligations': 5000,
+}
+
+PAN_RESPONSE = '''```json
+{
+    "is_valid_pan_card": true,
+    "pan_number": "ABCDE1234F",
+    "name_on_card": "RAHUL SHARMA",
+    "fathers_name": "SURESH SHARMA",
+    "date_of_birth": "15/06/1995",
+    "image_quality": "good",
+    "tampering_detected": false,
+    "confidence_score": 92,
+    "verification_notes": "Clear image, all fields readable"
+}
+```'''
+
+MATCH_RESPONSE = '''```json
+{
+    "faces_match": true,
+    "confidence_score": 78,
+    "match_quality": "good",
+    "facial_features_matched": ["eyes", "nose", "face_shape"],
+    "verification_notes": "Consistent facial structure",
+    "recommendation": "approve"
+}
+```'''
+
+CONVERSATION = json.dumps([
+    {'role': 'assistant' if i % 2 else 'user', 'content': f'Message number {i} in a typical loan conversation.'}
+    for i in range(20)
+])
+
+
+def _add_message_case():
+    session = ChatSession(conversation_data=CONVERSATION)
+
+    def run():
+        # Reset so every call appends to the same 20-message history
+        session.conversation_data = CONVERSATION
+        return views.add_message(session, 'user', 'I need a loan of 5 lakhs for 36 months', 'sales')
+    return run
+
+
+def build_cases():
+    """name -> zero-argument callable"""
+    pan_agent = PANVerificationAgent()
+    face_agent = FaceMatchAgent()
+    policy = get_underwriting_policy()
+    facts = {
+        'credit_score': 712,
+        'loan_amount': 500000.0,
+        'max_eligible_amount': 650000.0,
+        'segment': 'Young Salaried Professional',
+    }
+    dob = date(1995, 6, 15)
+
+    return {
+        'credit_score.calculate': lambda: CreditScoreCalculator.calculate_credit_score(LOAN_DETAILS),
+        'credit_score.company_score': lambda: CreditScoreCalculator.calculate_company_score('Unlisted Startup Pvt Ltd'),
+        'credit_score.max_loan_amount': lambda: CreditScoreCalculator.calculate_max_loan_amount(85000, 712, 36, 'salaried'),
+        'segmentation.age_from_dob.iso': lambda: CustomerSegmentation.get_age_from_dob('1995-06-15'),
+        'segmentation.age_from_dob.dmy': lambda: CustomerSegmentation.get_age_from_dob('15/06/1995'),
+        'segmentation.age_from_dob.date': lambda: CustomerSegmentation.get_age_from_dob(dob),
+        'segmentation.determine_segment': lambda: CustomerSegmentation.determine_segment(27, 'salaried', 85000),
+        'parse.pan_verification_response': lambda: pan_agent._parse_verification_response(PAN_RESPONSE),
+        'parse.face_match_response': lambda: face_agent._parse_match_response(MATCH_RESPONSE),
+        'parse.name_match.exact': lambda: pan_agent._verify_name_match('Rahul Sharma', 'RAHUL SHARMA'),
+        'views.add_message': _add_message_case(),
+        'underwriting.policy_evaluate': lambda: policy.evaluate(facts),
+        'amortization.calculate_emi': lambda: AmortizationEngine.calculate_emi(500000, 12.0, 36),
+    }
+
+
+def _noop():
+    return None
+
+
+def _retained_blocks(func):
+    before = tracemalloc.take_snapshot()
+    func()
+    after = tracemalloc.take_snapshot()
+    return sum(max(0, stat.count_diff) for stat in after.compare_to(before, 'lineno'))
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """
+    Time func and measure its allocations
+    Returns: dict with ns_per_op (best of `repeat`), peak_bytes_per_op,
+    retained_blocks_per_op and iterations
+    """
+    # Calibrate the loop count so each repeat takes at least min_time
+    iterations = 1
+    while True:
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter_ns() - started
+        if elapsed >= min_time * 1e9 or iterations >= 10_000_000:
+            break
+        iterations *= 2 if elapsed == 0 else max(2, min(10, int(min_time * 1e9 / elapsed) + 1))
+
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            func()
+        per_op = (time.perf_counter_ns() - started) / iterations
+        best = per_op if best is None else min(best, per_op)
+
+    # Allocations: peak traced memory of a single call, averaged over a few calls,
+    # plus blocks still alive after one call (leaks / growing caches)
+    samples = 50
+    tracemalloc.start()
+    try:
+        # Snapshots allocate themselves; subtract what an empty call retains
+        retained_blocks = max(0, _retained_blocks(func) - _retained_blocks(_noop))
+
+        peak_total = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            peak_total += peak - baseline
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ns_per_op': round(best, 1),
+        'peak_bytes_per_op': round(peak_total / samples),
+        'retained_blocks_per_op': retained_blocks,
+        'iterations': iterations,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs microbenchmarks for scoring, segmentation, parsing and message helpers. '
+        'Reports ns/op and allocations; can save a JSON baseline and compare against one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filter',
+            help='Only run benchmarks whose name contains this text'
+        )
+        parser.add_argument(
+            '--save',
+            help='Write results to this JSON file (baseline)'
+        )
+        parser.add_argument(
+            '--compare',
+            help='Compare results against this JSON baseline'
+        )
+        parser.add_argument(
+            '--current',
+            help='With --compare: diff this saved JSON file instead of running the benchmarks'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=10.0,
+            help='Percent slowdown reported as a regression (default: 10)'
+        )
+        parser.add_argument(
+            '--fail-on-regression',
+            action='store_true',
+            help='Exit with an error if any benchmark regressed beyond the threshold'
+        )
+        parser.add_argument(
+            '--min-time',
+            type=float,
+            default=0.2,
+            help='Minimum seconds per timing repeat'
+        )
+
+    def handle(self, *args, **options):
+        if options['current'] and not options['compare']:
+            raise CommandError('--current requires --compare')
+
+        if options['current']:
+            current = self.load(options['current'])
+        else:
+            current = self.run(options['filter'], options['min_time'])
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(current, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['save']}"))
+
+        if options['compare']:
+            baseline = self.load(options['compare'])
+            regressions = self.compare(baseline, current, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read benchmark file {path}: {e}")
+
+    def run(self, name_filter, min_time):
+        cases = build_cases()
+        results = {}
+
+        self.stdout.write(f"{'benchmark':<38} {'ns/op':>12} {'peak B/op':>10} {'blocks/op':>10}")
+        for name, func in cases.items():
+            if name_filter and name_filter not in name:
+                continue
+            result = measure(func, min_time=min_time)
+            results[name] = result
+            self.stdout.write(
+                f"{name:<38} {result['ns_per_op']:>12,.1f} "
+                f"{result['peak_bytes_per_op']:>10,} {result['retained_blocks_per_op']:>10,}"
+            )
+
+        return {
+            'created_at': timezone.now().isoformat(),
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'results': results,
+        }
+
+    def compare(self, baseline, current, threshold):
+        """Print a per-benchmark diff. Returns: names that regressed beyond threshold"""
+        regressions = []
+        base_results = baseline.get('results', {})
+        current_results = current.get('results', {})
+
+        self.stdout.write(self.style.SUCCESS('\n=== Comparison ==='))
+        self.stdout.write(
+            f"{'benchmark':<38} {'base ns':>12} {'now ns':>12} {'delta':>8} {'peak B delta':>13}"
+        )
+        for name in sorted(set(base_results) | set(current_results)):
+            before = base_results.get(name)
+            after = current_results.get(name)
+            if not before or not after:
+                self.stdout.write(f"{name:<38} {'(only in ' + ('current' if after else 'baseline') + ')':>34}")
+                continue
+
+            delta = (after['ns_per_op'] - before['ns_per_op']) / before['ns_per_op'] * 100
+            bytes_delta = after['peak_bytes_per_op'] - before['peak_bytes_per_op']
+            line = (
+                f"{name:<38} {before['ns_per_op']:>12,.1f} {after['ns_per_op']:>12,.1f} "
+                f"{delta:>+7.1f}% {bytes_delta:>+13,}"
+            )
+            if delta > threshold:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            elif delta < -threshold:
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(line)
+
+        return regressions
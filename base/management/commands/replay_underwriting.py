@@ -0,0 +1,288 @@
+# management/commands/replay_underwriting.py
+# Replays historical loan applications through the current underwriting logic
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import json
+import multiprocessing
+import os
+import time
+
+from base.models import LoanApplication
+from base.agents import UnderwritingAgent
+from base.underwriting_policy import UNDERWRITING_POLICY, compile_policy, PolicyError
+
+
+REPLAY_FIELDS = (
+    'id',
+    'status',
+    'loan_amount',
+    'tenure_months',
+    'customer_segment_snapshot',
+    'customer__company_name',
+    'customer__designation',
+    'customer__monthly_income',
+    'customer__employment_duration_months',
+    'customer__employment_type',
+    'customer__existing_obligations',
+)
+
+# Applications only snapshot the segment; everything else is read from the
+# customer as it is now (see REPLAY_INPUTS_NOTE)
+REPLAY_INPUTS_NOTE = (
+    'Employment, income and obligations are read from the current customer record, not as '
+    'they were at application time; customers updated since applying can flip for that reason alone'
+)
+
+# Stored LoanApplication.status -> comparable bucket
+STATUS_BUCKETS = {
+    'approved': 'approved',
+    'disbursed': 'approved',
+    'rejected': 'rejected',
+    'pending': 'pending',
+    'under_review': 'pending',
+}
+
+_worker_policy = None
+
+
+def _init_worker(policy):
+    """Process pool initializer: set up Django and compile the policy once per worker"""
+    global _worker_policy
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+        django.setup()
+    _worker_policy = compile_policy(policy)
+
+
+def _replayed_bucket(approved):
+    if approved is True:
+        return 'approved'
+    if approved is False:
+        return 'rejected'
+    return 'pending'
+
+
+def replay_chunk(rows, policy=None, sample_size=0):
+    """
+    Evaluate a chunk of application rows (tuples in REPLAY_FIELDS order)
+    Returns: (Counter of (segment, old, new) -> count, Counter of rule -> count, sample flips)
+    """
+    compiled = policy or _worker_policy
+    transitions = Counter()
+    rules = Counter()
+    flips = []
+
+    for (loan_id, status, loan_amount, tenure, segment, company_name, designation,
+         monthly_income, duration_months, employment_type, existing_obligations) in rows:
+        loan_details = {
+            'company_name': company_name,
+            'designation': designation,
+            'monthly_income': monthly_income,
+            'employment_duration_months': duration_months,
+            'employment_type': employment_type,
+            'existing_obligations': existing_obligations or 0,
+            'loan_amount': loan_amount,
+            'tenure_months': tenure,
+        }
+        age_segment = {'segment': segment} if segment else None
+        result = UnderwritingAgent.evaluate_application(loan_details, age_segment, compiled)
+
+        old = STATUS_BUCKETS.get(status, 'pending')
+        new = _replayed_bucket(result['approved'])
+        transitions[(segment or 'Unknown', old, new)] += 1
+        rules[result['rule']] += 1
+        if old != new and len(flips) < sample_size:
+            flips.append({'id': loan_id, 'segment': segment, 'from': old, 'to': new, 'rule': result['rule']})
+
+    return transitions, rules, flips
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays historical loan applications through the current underwriting logic '
+        '(no database writes) and reports how many would change status, by segment'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes (1 = run in-process)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Applications per work unit'
+        )
+        parser.add_argument(
+            '--policy',
+            help='Path to a JSON decision table to replay instead of the active policy'
+        )
+        parser.add_argument(
+            '--since',
+            help='Only applications applied on or after this date (YYYY-MM-DD)'
+        )
+        parser.add_argument(
+            '--until',
+            help='Only applications applied before this date (YYYY-MM-DD)'
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=20,
+            help='Number of flipped applications to list'
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the report as JSON'
+        )
+
+    def handle(self, *args, **options):
+        policy = UNDERWRITING_POLICY
+        if options['policy']:
+            try:
+                with open(options['policy']) as f:
+                    policy = json.load(f)
+                compile_policy(policy)
+            except (OSError, ValueError, PolicyError) as e:
+                raise CommandError(f"Invalid policy file: {e}")
+
+        queryset = LoanApplication.objects.order_by('id')
+        if options['since']:
+            queryset = queryset.filter(applied_at__date__gte=options['since'])
+        if options['until']:
+            queryset = queryset.filter(applied_at__date__lt=options['until'])
+
+        chunk_size = max(1, options['chunk_size'])
+        workers = max(1, options['workers'])
+        samples = max(0, options['samples'])
+
+        started = time.perf_counter()
+        transitions = Counter()
+        rules = Counter()
+        flips = []
+
+        def merge(chunk_result):
+            chunk_transitions, chunk_rules, chunk_flips = chunk_result
+            transitions.update(chunk_transitions)
+            rules.update(chunk_rules)
+            flips.extend(chunk_flips[:samples - len(flips)])
+
+        if workers == 1:
+            compiled = compile_policy(policy)
+            for rows in self.iter_chunks(queryset, chunk_size):
+                merge(replay_chunk(rows, compiled, samples))
+        else:
+            # Children must not inherit open database connections. Forked workers
+            # start on the first submit, so start them (with a no-op) before the
+            # query below opens a connection; fork is explicit because the workers
+            # rely on the parent's Django setup and imports
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(policy,)
+            ) as executor:
+                executor.submit(os.getpid).result()
+                pending = set()
+                for rows in self.iter_chunks(queryset, chunk_size):
+                    pending.add(executor.submit(replay_chunk, rows, None, samples))
+                    # Bound in-flight chunks so memory stays flat on large tables
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            merge(future.result())
+                for future in pending:
+                    merge(future.result())
+
+        elapsed = time.perf_counter() - started
+        report = self.build_report(transitions, rules, flips, policy, elapsed)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def iter_chunks(self, queryset, chunk_size):
+        """Stream rows from the database in chunks of plain tuples"""
+        rows = []
+        for row in queryset.values_list(*REPLAY_FIELDS).iterator(chunk_size=chunk_size):
+            rows.append((
+                row[0], row[1], float(row[2]), row[3], row[4], row[5], row[6],
+                float(row[7]) if row[7] is not None else None,
+                row[8], row[9],
+                float(row[10]) if row[10] is not None else 0,
+            ))
+            if len(rows) >= chunk_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def build_report(self, transitions, rules, flips, policy, elapsed):
+        """Summarize transitions by segment and by (old -> new) status"""
+        total = sum(transitions.values())
+        changed = sum(count for (_, old, new), count in transitions.items() if old != new)
+
+        segments = {}
+        for (segment, old, new), count in sorted(transitions.items()):
+            entry = segments.setdefault(segment, {'total': 0, 'changed': 0, 'transitions': {}})
+            entry['total'] += count
+            if old != new:
+                entry['changed'] += count
+            entry['transitions'][f'{old} -> {new}'] = count
+
+        by_status = Counter()
+        for (_, old, new), count in transitions.items():
+            by_status[f'{old} -> {new}'] += count
+
+        return {
+            'policy_version': policy.get('version', 'unversioned'),
+            'inputs': REPLAY_INPUTS_NOTE,
+            'applications': total,
+            'changed': changed,
+            'elapsed_seconds': round(elapsed, 2),
+            'by_status': dict(sorted(by_status.items())),
+            'by_segment': segments,
+            'rules_fired': dict(rules.most_common()),
+            'sample_flips': flips,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(self.style.SUCCESS('\n=== Underwriting Replay ==='))
+        self.stdout.write(f"Policy version: {report['policy_version']}")
+        self.stdout.write(self.style.WARNING(f"Note: {report['inputs']}"))
+        self.stdout.write(
+            f"Applications: {report['applications']} | Changed: {report['changed']} | "
+            f"Time: {report['elapsed_seconds']}s"
+        )
+
+        self.stdout.write(self.style.SUCCESS('\nBy status:'))
+        for transition, count in report['by_status'].items():
+            self.stdout.write(f"  {transition:<25} {count:>10}")
+
+        self.stdout.write(self.style.SUCCESS('\nBy segment:'))
+        for segment, entry in report['by_segment'].items():
+            self.stdout.write(f"  {segment} ({entry['changed']}/{entry['total']} changed)")
+            for transition, count in entry['transitions'].items():
+                marker = '*' if transition.split(' -> ')[0] != transition.split(' -> ')[1] else ' '
+                self.stdout.write(f"    {marker} {transition:<23} {count:>10}")
+
+        self.stdout.write(self.style.SUCCESS('\nRules fired:'))
+        for rule, count in report['rules_fired'].items():
+            self.stdout.write(f"  {rule:<25} {count:>10}")
+
+        if report['sample_flips']:
+            self.stdout.write(self.style.SUCCESS('\nSample changed applications:'))
+            for flip in report['sample_flips']:
+                self.stdout.write(
+                    f"  LA-{flip['id']:06d} [{flip['segment'] or 'Unknown'}] "
+                    f"{flip['from']} -> {flip['to']} ({flip['rule']})"
+                )
@@ -0,0 +1,122 @@
+# management/commands/run_verification_worker.py
+# Processes queued PAN card and selfie verification jobs
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+import os
+import socket
+import threading
+import time
+
+from base.verification_jobs import claim_next_job, run_job, fail_job, requeue_stale_jobs
+from base.warmup import warm_up_on_startup
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs verification worker threads that claim queued PAN card / selfie jobs '
+        '(SELECT ... FOR UPDATE SKIP LOCKED) and run the vision calls'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=4,
+            help='Number of worker threads (jobs are I/O bound on the model API)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the queue is empty'
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=300,
+            help='Seconds after which a running job is considered abandoned and requeued'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=3,
+            help='Attempts before a job is marked failed'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the queue and exit instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        stop = threading.Event()
+        stats = {'succeeded': 0, 'failed': 0}
+        stats_lock = threading.Lock()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        requeued = requeue_stale_jobs(options['lease'], options['max_attempts'])
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"Requeued {requeued} abandoned job(s)"))
+
+        # Imports openai / Pillow and connects to the model endpoint before the first job
+        warm_up_on_startup('worker')
+
+        self.stdout.write(self.style.SUCCESS(f"Starting {threads} verification worker thread(s)"))
+
+        def work(worker_id):
+            last_sweep = time.monotonic()
+            try:
+                while not stop.is_set():
+                    close_old_connections()
+
+                    if time.monotonic() - last_sweep > options['lease']:
+                        requeue_stale_jobs(options['lease'], options['max_attempts'])
+                        last_sweep = time.monotonic()
+
+                    job = claim_next_job(worker_id)
+                    if job is None:
+                        if options['once']:
+                            return
+                        stop.wait(options['poll_interval'])
+                        continue
+
+                    started = time.perf_counter()
+                    try:
+                        _, status = run_job(job, options['max_attempts'])
+                        outcome = 'succeeded' if status < 500 else 'failed'
+                    except Exception as e:
+                        fail_job(job, str(e), options['max_attempts'])
+                        outcome = 'failed'
+                        status = 'error'
+
+                    with stats_lock:
+                        stats[outcome] += 1
+                    self.stdout.write(
+                        f"[{worker_id}] {job.kind} job {job.id}: {outcome} ({status}) "
+                        f"in {time.perf_counter() - started:.2f}s"
+                    )
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=work, args=(f"{prefix}:{index}",), daemon=True)
+            for index in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers after their current job...')
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {stats['succeeded']} succeeded, {stats['failed']} failed"
+        ))
@@ -0,0 +1,154 @@
+# management/commands/startup_benchmark.py
+# Measures cold-start import time (python -X importtime) and fails on regressions
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from collections import Counter
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+# What a fresh serverless instance does before serving its first request:
+# import the WSGI application and load the URLconf (which imports the views).
+# A warm-up started by the import is waited for, so whatever it imports counts.
+COLD_START_SCRIPT = (
+    "import threading\n"
+    "import project.wsgi\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+    "for thread in threading.enumerate():\n"
+    "    if thread.name == 'warm-up':\n"
+    "        thread.join()\n"
+)
+
+# Heavy packages that must only be imported on first use
+DEFERRED_MODULES = ('openai', 'httpx', 'PIL', 'reportlab', 'pypdf')
+
+# Total import time allowed for a cold start (sum of per-module self time)
+DEFAULT_BUDGET_MS = 500
+
+
+def parse_importtime(stderr):
+    """
+    Parse `python -X importtime` output.
+    Returns: list of (module, self_us, cumulative_us) in import completion order
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure_cold_start():
+    """
+    Import the app in a fresh interpreter.
+    Returns: (import time ms, process wall time ms, list of (module, self_us, cumulative_us))
+    """
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    # The project must be importable whatever directory the command runs from
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', COLD_START_SCRIPT],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise CommandError(f"Cold start failed:\n{result.stderr[-2000:]}")
+    modules = parse_importtime(result.stderr)
+    return sum(self_us for _, self_us, _ in modules) / 1000, wall_ms, modules
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures cold-start import time in fresh interpreters (python -X importtime) and '
+        'exits non-zero when it exceeds the budget or baseline, or when a deferred heavy '
+        'module (openai, Pillow, reportlab, ...) is imported at startup'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=5,
+            help='Fresh interpreters to measure; the median is reported'
+        )
+        parser.add_argument(
+            '--budget-ms',
+            type=float,
+            default=DEFAULT_BUDGET_MS,
+            help='Maximum total import time'
+        )
+        parser.add_argument(
+            '--baseline',
+            help='JSON file written by --save; fail when slower than it by more than --tolerance'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=20.0,
+            help='Allowed slowdown against --baseline, in percent'
+        )
+        parser.add_argument(
+            '--save',
+            help='Write the measured median to this JSON file for later --baseline runs'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Number of slowest top-level packages to list'
+        )
+
+    def handle(self, *args, **options):
+        runs = [measure_cold_start() for _ in range(max(1, options['runs']))]
+        import_ms = statistics.median(run[0] for run in runs)
+        wall_ms = statistics.median(run[1] for run in runs)
+        # The run closest to the median is representative for the breakdown
+        _, _, modules = min(runs, key=lambda run: abs(run[0] - import_ms))
+
+        packages = Counter()
+        for name, self_us, _ in modules:
+            packages[name.split('.')[0]] += self_us
+
+        self.stdout.write(
+            f"Cold start: {import_ms:.0f}ms importing {len(modules)} modules "
+            f"({wall_ms:.0f}ms process wall time, median of {len(runs)})"
+        )
+        for package, self_us in packages.most_common(max(0, options['top'])):
+            self.stdout.write(f"  {package:<28} {self_us / 1000:8.1f}ms")
+
+        failures = []
+        imported = sorted({name.split('.')[0] for name, _, _ in modules} & set(DEFERRED_MODULES))
+        if imported:
+            failures.append(f"deferred module(s) imported at startup: {', '.join(imported)}")
+        if import_ms > options['budget_ms']:
+            failures.append(f"{import_ms:.0f}ms exceeds the {options['budget_ms']:.0f}ms budget")
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline_ms = json.load(f)['import_ms']
+            limit_ms = baseline_ms * (1 + options['tolerance'] / 100)
+            if import_ms > limit_ms:
+                failures.append(
+                    f"{import_ms:.0f}ms is more than {options['tolerance']:.0f}% slower "
+                    f"than the {baseline_ms:.0f}ms baseline"
+                )
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump({'import_ms': round(import_ms, 1), 'modules': len(modules)}, f)
+
+        if failures:
+            raise CommandError('Startup regression: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Cold start within budget'))
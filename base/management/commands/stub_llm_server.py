@@ -0,0 +1,224 @@
+# management/commands/stub_llm_server.py
+# OpenAI-compatible chat completions stub for load tests (see the loadtest command)
+
+from django.core.management.base import BaseCommand
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import time
+import uuid
+
+
+NAME_DOB_RE = re.compile(r'my name is (.+?) and i was born on (\S+?)\.?$', re.IGNORECASE | re.MULTILINE)
+PAN_RE = re.compile(r'\b[A-Z]{5}[0-9]{4}[A-Z]\b')
+EXPECTED_NAME_RE = re.compile(r'Customer Name: (.+)')
+EXPECTED_PAN_RE = re.compile(r'PAN Number: ([A-Z]{5}[0-9]{4}[A-Z])')
+
+LOAN_DETAILS = {
+    'loan_amount': 1200000,
+    'purpose': 'home renovation',
+    'tenure_months': 36,
+    'employment_type': 'salaried',
+    'monthly_income': 85000,
+    'company_name': 'Tata Consultancy Services',
+    'designation': 'Senior Software Engineer',
+    'employment_duration_months': 30,
+    'existing_obligations': None,
+    'segment_specific_data': {},
+    'all_required_info_collected': True,
+}
+
+FACE_MATCH = {
+    'faces_match': True,
+    'confidence_score': 82,
+    'match_quality': 'good',
+    'facial_features_matched': ['eyes', 'nose', 'face_shape'],
+    'verification_notes': 'Stub face match',
+    'recommendation': 'approve',
+}
+
+SALARY_SLIP = {
+    'is_salary_slip': True,
+    'employer': 'Tata Consultancy Services',
+    'employee_name': None,
+    'month': None,
+    'net_pay': 85000,
+    'gross_pay': 100000,
+    'confidence_score': 90,
+}
+
+TEXT_REPLY = (
+    "Thank you! I'm here to help you with your personal loan. "
+    "Could you tell me a little more about what you need?"
+)
+
+
+def _text(content):
+    """Text of a message's content (string, or the text parts of a multimodal list)"""
+    if isinstance(content, list):
+        return '\n'.join(part.get('text', '') for part in content if part.get('type') == 'text')
+    return content or ''
+
+
+def stub_reply(messages):
+    """
+    A reply that moves the chat workflow forward: the extraction prompts get
+    the values the loadtest users sent, the verification prompts get passing
+    results, everything else a short text reply
+    """
+    system = _text(messages[0]['content']) if messages and messages[0]['role'] == 'system' else ''
+    user = '\n'.join(_text(message['content']) for message in messages if message['role'] == 'user')
+
+    if 'Extract the full name and date of birth' in system:
+        matches = NAME_DOB_RE.findall(user)
+        name, dob = matches[-1] if matches else ('NOT_FOUND', 'NOT_FOUND')
+        return json.dumps({'name': name, 'date_of_birth': dob})
+    if 'Extract the PAN number' in system:
+        pans = PAN_RE.findall(user)
+        return pans[-1] if pans else 'NOT_FOUND'
+    if 'Indian PAN cards' in system:
+        name = EXPECTED_NAME_RE.search(system)
+        pan = EXPECTED_PAN_RE.search(system)
+        return json.dumps({
+            'is_valid_pan_card': True,
+            'pan_number': pan.group(1) if pan else 'ABCDE1234F',
+            'name_on_card': name.group(1).strip().upper() if name else 'NOT_FOUND',
+            'fathers_name': None,
+            'date_of_birth': None,
+            'image_quality': 'good',
+            'tampering_detected': False,
+            'confidence_score': 92,
+            'verification_notes': 'Stub verification',
+        })
+    if 'face matching' in system:
+        return json.dumps(FACE_MATCH)
+    if 'Indian salary slips' in system:
+        return json.dumps(SALARY_SLIP)
+    if 'Extract loan details' in system:
+        return json.dumps(LOAN_DETAILS)
+    return TEXT_REPLY
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    jitter = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            request = {}
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        content = stub_reply(request.get('messages') or [])
+        prompt_tokens = len(json.dumps(request.get('messages') or [])) // 4
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(content) // 4,
+            'total_tokens': prompt_tokens + len(content) // 4,
+        }
+        completion_id = f'chatcmpl-stub-{uuid.uuid4().hex[:12]}'
+        model = request.get('model', 'stub')
+
+        if request.get('stream'):
+            self._send_stream(completion_id, model, content, usage)
+            return
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        })
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, completion_id, model, content, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+        words = content.split(' ')
+        for i, word in enumerate(words):
+            delta = word if i == len(words) - 1 else word + ' '
+            self._send_event({**chunk, 'choices': [{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}]})
+        self._send_event({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        self._send_event({**chunk, 'choices': [], 'usage': usage})
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _send_event(self, data):
+        self.wfile.write(b'data: ' + json.dumps(data).encode('utf-8') + b'\n\n')
+
+
+class Command(BaseCommand):
+    help = (
+        'Serves an OpenAI-compatible /v1/chat/completions stub with fixed latency whose replies '
+        'move the chat workflow forward. Start the app with OPENAI_BASE_URL=http://HOST:PORT/v1 '
+        'to load test it without calling the model.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--host',
+            default='127.0.0.1',
+            help='Interface to listen on'
+        )
+        parser.add_argument(
+            '--port',
+            type=int,
+            default=8001,
+            help='Port to listen on'
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.5,
+            help='Seconds each completion takes'
+        )
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=0.0,
+            help='Random +/- seconds added to the latency'
+        )
+
+    def handle(self, *args, **options):
+        handler = type('Handler', (StubHandler,), {
+            'latency': max(0.0, options['latency']),
+            'jitter': max(0.0, options['jitter']),
+        })
+        server = ThreadingHTTPServer((options['host'], options['port']), handler)
+        server.daemon_threads = True
+        self.stdout.write(
+            f"Stub LLM on http://{options['host']}:{options['port']}/v1 "
+            f"({options['latency'] * 1000:.0f}ms ± {options['jitter'] * 1000:.0f}ms per completion)"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,28 @@
+import hmac
+import os
+
+from django.conf import settings
+
+from .db_pool import pool_stats
+from .llm_limiter import get_limiter
+from .warmup import warm_up_status
+
+
+def collect_metrics():
+    """Metrics of this process, one section per subsystem. Returns: dict (JSON-serializable)"""
+    return {
+        'pid': os.getpid(),
+        'llm': get_limiter().stats(),
+        'db_pool': pool_stats(),
+        'warmup': warm_up_status(),
+    }
+
+
+def metrics_authorized(request):
+    """Staff, or a scraper presenting `Authorization: Bearer <METRICS_TOKEN>`"""
+    if request.user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    return bool(token) and hmac.compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+    )
@@ -0,0 +1,79 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from .llm_limiter import BUSY_MESSAGE, LLMBusyError
+from .timing import finish_request, server_timing_header, slow_request_entry, start_request, write_slow_log
+
+
+def busy_response(error):
+    """503 telling the client when to retry; sent instead of waiting out a model queue"""
+    response = JsonResponse({
+        'success': False,
+        'busy': True,
+        'message': BUSY_MESSAGE,
+        'retry_after': error.retry_after
+    }, status=503)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+class LLMBusyMiddleware(MiddlewareMixin):
+    """Turn LLMBusyError raised by a view (sync or async) into a fast 503 + Retry-After"""
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, LLMBusyError):
+            return busy_response(exception)
+        return None
+
+
+class RequestTimingMiddleware:
+    """
+    Per-request query count, SQL time, model call time and total time, sent as
+    a Server-Timing header; requests slower than REQUEST_SLOW_THRESHOLD_MS are
+    written to the slow log with their slowest and repeated queries.
+    Streamed bodies are produced after the view returns and are not included.
+    Async-capable, so async views stay on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'REQUEST_TIMING_ENABLED', True)
+        self.header = getattr(settings, 'SERVER_TIMING_HEADER', True)
+        self.slow_threshold = getattr(settings, 'REQUEST_SLOW_THRESHOLD_MS', 1000) / 1000
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        timing, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request(token)
+        return self.finish(request, response, timing)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        timing, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            finish_request(token)
+        return self.finish(request, response, timing)
+
+    def finish(self, request, response, timing):
+        total = timing.elapsed()
+        if self.header:
+            response['Server-Timing'] = server_timing_header(timing, total)
+        if total >= self.slow_threshold:
+            write_slow_log(slow_request_entry(request, response, timing, total))
+        return response
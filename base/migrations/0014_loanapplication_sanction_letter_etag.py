@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_verificationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loanapplication',
+            name='sanction_letter_etag',
+            field=models.CharField(blank=True, help_text='Fingerprint of the loan fields the stored sanction letter was generated from', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='loanapplication',
+            name='sanction_letter_generated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0014_loanapplication_sanction_letter_etag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotentRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('path', models.CharField(max_length=200)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('in_progress', 'In Progress'), ('completed', 'Completed')], default='in_progress', max_length=20)),
+                ('response_body', models.JSONField(blank=True, null=True)),
+                ('response_status', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotent_requests', to='base.chatsession')),
+            ],
+            options={
+                'verbose_name': 'Idempotent Request',
+                'verbose_name_plural': 'Idempotent Requests',
+                'db_table': 'idempotent_requests',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='idempotent__created_38d305_idx')],
+                'constraints': [models.UniqueConstraint(fields=('session', 'key'), name='unique_idempotency_key_per_session')],
+            },
+        ),
+    ]
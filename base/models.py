@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 import json
+import uuid
 
 
 class Customer(models.Model):
@@ -280,6 +281,13 @@ class LoanApplication(models.Model):
     sanction_letter_name = models.CharField(max_length=255, blank=True, null=True)
     sanction_letter_content = models.TextField(blank=True, null=True)  # base64 encoded
     sanction_letter_content_type = models.CharField(max_length=100, blank=True, null=True)
+    sanction_letter_etag = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="Fingerprint of the loan fields the stored sanction letter was generated from"
+    )
+    sanction_letter_generated_at = models.DateTimeField(blank=True, null=True)
     
     # Timestamps
     applied_at = models.DateTimeField(auto_now_add=True)
@@ -307,12 +315,22 @@ class LoanApplication(models.Model):
         self.rejected_at = timezone.now()
         self.save()
     
-    def calculate_monthly_emi(self):
-        """Calculate simple EMI (without interest for now)"""
+    def calculate_monthly_emi(self, annual_rate=None):
+        """Calculate reducing-balance EMI at the given (or default) annual interest rate"""
+        from .amortization import AmortizationEngine
         if self.tenure_months > 0:
-            return float(self.loan_amount) / self.tenure_months
+            if annual_rate is None:
+                annual_rate = AmortizationEngine.default_annual_rate()
+            return AmortizationEngine.calculate_emi(self.loan_amount, annual_rate, self.tenure_months)
         return 0
     
+    def get_amortization_schedule(self, annual_rate=None):
+        """Month-by-month amortization schedule for this loan"""
+        from .amortization import AmortizationEngine
+        if annual_rate is None:
+            annual_rate = AmortizationEngine.default_annual_rate()
+        return AmortizationEngine.schedule(self.loan_amount, annual_rate, self.tenure_months)
+    
     def get_emi_to_income_ratio(self):
         """Calculate EMI to income ratio"""
         if self.customer and self.customer.monthly_income:
@@ -363,4 +381,103 @@ class DocumentVerification(models.Model):
         db_table = 'document_verifications'
         verbose_name = 'Document Verification'
         verbose_name_plural = 'Document Verifications'
-        ordering = ['-verification_timestamp']
\ No newline at end of file
+        ordering = ['-verification_timestamp']
+
+
+class VerificationJob(models.Model):
+    """Queued PAN / selfie verification, processed by the run_verification_worker command"""
+    KIND_CHOICES = [
+        ('pan_card', 'PAN Card'),
+        ('selfie', 'Selfie'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='verification_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    
+    # Input
+    image_data = models.TextField(
+        null=True,
+        blank=True,
+        help_text="Base64 encoded normalized image - cleared when the job finishes"
+    )
+    payload = models.JSONField(default=dict)  # Image metadata and request context
+    
+    # Output: the JSON body and HTTP status the upload endpoint would have returned
+    result = models.JSONField(null=True, blank=True)
+    result_status = models.IntegerField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    
+    # Worker bookkeeping
+    attempts = models.IntegerField(default=0)
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+    
+    def __str__(self):
+        return f"{self.kind} job {self.id} - {self.status}"
+    
+    class Meta:
+        db_table = 'verification_jobs'
+        verbose_name = 'Verification Job'
+        verbose_name_plural = 'Verification Jobs'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+
+class IdempotentRequest(models.Model):
+    """
+    Stored response of a chat / upload request sent with an idempotency key,
+    replayed when the client retries the same request (see base.idempotency)
+    """
+    STATUS_CHOICES = [
+        ('in_progress', 'In Progress'),
+        ('completed', 'Completed'),
+    ]
+    
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='idempotent_requests')
+    key = models.CharField(max_length=100)
+    path = models.CharField(max_length=200)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the request, to reject a key reused for another request
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    
+    # The JSON body and HTTP status returned the first time
+    response_body = models.JSONField(null=True, blank=True)
+    response_status = models.IntegerField(null=True, blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.path} {self.key} - {self.status}"
+    
+    class Meta:
+        db_table = 'idempotent_requests'
+        verbose_name = 'Idempotent Request'
+        verbose_name_plural = 'Idempotent Requests'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'key'], name='unique_idempotency_key_per_session'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
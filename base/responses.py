@@ -0,0 +1,53 @@
+from string import Formatter
+
+from django.conf import settings
+
+
+# Any segment: the variant used for segments without a variant of their own
+ANY_SEGMENT = '*'
+
+
+class ResponseTemplates:
+    """
+    Fixed customer-facing replies, keyed by (message id, language, segment).
+    messages maps a message id to its variants: {segment: [text keys]}, where
+    segment None is the default and ANY_SEGMENT applies to every named segment.
+    The texts are joined per language up front, so a reply is a dict lookup
+    plus str.format for the few with placeholders (customer_name, segment).
+    """
+
+    def __init__(self, translations, messages, default_language='en'):
+        self.default_language = default_language
+        self._templates = {}
+        for language, texts in translations.items():
+            for message_id, variants in messages.items():
+                for segment, keys in variants.items():
+                    template = ' '.join(texts[key] for key in keys)
+                    has_fields = any(field for _, field, _, _ in Formatter().parse(template))
+                    self._templates[(message_id, language, segment)] = (template, has_fields)
+
+    def __contains__(self, message_id):
+        return (message_id, self.default_language, None) in self._templates
+
+    def _lookup(self, message_id, language, segment):
+        for lang in (language, self.default_language):
+            for variant in (segment, ANY_SEGMENT, None) if segment else (None,):
+                template = self._templates.get((message_id, lang, variant))
+                if template:
+                    return template
+        raise KeyError(message_id)
+
+    def render(self, message_id, language=None, segment=None, **values):
+        """
+        Reply text for message_id in language (falling back to the default
+        language) for the customer segment (falling back to the default variant)
+        """
+        template, has_fields = self._lookup(message_id, language or self.default_language, segment)
+        if has_fields:
+            return template.format(segment=segment, **values)
+        return template
+
+
+def rephrase_enabled(message_id):
+    """Whether the model rewrites this reply (message ids listed in LLM_REPHRASE_MESSAGES)"""
+    return message_id in getattr(settings, 'LLM_REPHRASE_MESSAGES', ())
@@ -0,0 +1,256 @@
+import re
+import time
+from datetime import date
+
+from django.conf import settings
+
+from .imaging import normalize_image, to_data_url
+
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+_AMOUNT = r'(?:rs\.?|inr|₹)?\s*([0-9]{1,3}(?:,[0-9]{2,3})+(?:\.[0-9]{1,2})?|[0-9]+(?:\.[0-9]{1,2})?)'
+
+NET_PAY_RE = re.compile(
+    r'(?:net\s*(?:pay(?:able)?|salary|amount(?:\s*payable)?|take\s*home|earnings)'
+    r'|take[\s-]*home(?:\s*pay)?|amount\s*credited)'
+    r'[^0-9\n]{0,30}?' + _AMOUNT,
+    re.IGNORECASE
+)
+GROSS_PAY_RE = re.compile(
+    r'(?:gross\s*(?:pay|salary|earnings|total)?|total\s*earnings)'
+    r'[^0-9\n]{0,30}?' + _AMOUNT,
+    re.IGNORECASE
+)
+MONTH_NAME_RE = re.compile(
+    r'\b(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?'
+    r'|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)[\s\-,/\'.]*((?:19|20)\d{2})\b',
+    re.IGNORECASE
+)
+MONTH_NUMBER_RE = re.compile(
+    r'(?:month|period)[^0-9\n]{0,20}?\b(0?[1-9]|1[0-2])[/\-]((?:19|20)\d{2})\b',
+    re.IGNORECASE
+)
+# Pay periods inside an amount's label ("Net Pay for June 2025", "Net Pay (06/2025)"):
+# removed before the amounts are read, so the year is not taken for the amount
+PAY_PERIOD_RE = re.compile(
+    r'\b(?:(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?'
+    r'|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)[\s\-,/\'.]*'
+    r'|(?:0?[1-9]|1[0-2])[/\-])(?:19|20)\d{2}\b',
+    re.IGNORECASE
+)
+EMPLOYER_LABEL_RE = re.compile(
+    r'(?:company|employer|organi[sz]ation)\s*(?:name)?\s*[:\-]\s*(.+)',
+    re.IGNORECASE
+)
+COMPANY_SUFFIX_RE = re.compile(
+    r'\b(?:pvt|private|ltd|limited|llp|inc|corporation|corp|technologies|solutions|services|industries)\b',
+    re.IGNORECASE
+)
+
+# Text PDFs with less extractable text than this are treated as scanned
+MIN_TEXT_CHARS = 80
+
+
+def _to_amount(value):
+    try:
+        return float(value.replace(',', ''))
+    except (AttributeError, ValueError):
+        return None
+
+
+def extract_pdf_text(upload, max_pages=2):
+    """
+    Text of the first pages of a text-based PDF, or '' for scanned PDFs.
+    Returns None when pypdf is not installed (the vision path is used instead).
+    """
+    try:
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+    except ImportError:
+        return None
+
+    try:
+        upload.seek(0)
+        reader = PdfReader(upload)
+        pages = reader.pages[:max_pages]
+        return '\n'.join(page.extract_text() or '' for page in pages)
+    except (PdfReadError, ValueError, KeyError, OSError):
+        return ''
+    finally:
+        upload.seek(0)
+
+
+def parse_salary_text(text):
+    """
+    Rule-based extraction of net pay, gross pay, employer and month from payslip text
+    Returns: dict; 'ambiguous' is True when the result should be confirmed by the vision model
+    """
+    amounts_text = PAY_PERIOD_RE.sub(' ', text)
+    net_values = [amount for amount in (_to_amount(m.group(1)) for m in NET_PAY_RE.finditer(amounts_text)) if amount]
+    gross_values = [amount for amount in (_to_amount(m.group(1)) for m in GROSS_PAY_RE.finditer(amounts_text)) if amount]
+
+    net_pay = net_values[0] if net_values else None
+    gross_pay = max(gross_values) if gross_values else None
+
+    month = None
+    match = MONTH_NAME_RE.search(text)
+    if match:
+        month = f"{match.group(2)}-{MONTHS[match.group(1)[:3].lower()]:02d}"
+    else:
+        match = MONTH_NUMBER_RE.search(text)
+        if match:
+            month = f"{match.group(2)}-{int(match.group(1)):02d}"
+
+    employer = None
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for line in lines:
+        match = EMPLOYER_LABEL_RE.search(line)
+        if match:
+            employer = match.group(1).strip()
+            break
+    if not employer:
+        employer = next((line for line in lines[:10] if COMPANY_SUFFIX_RE.search(line)), None)
+
+    reasons = []
+    if net_pay is None:
+        reasons.append('net pay not found')
+    elif len({round(value) for value in net_values}) > 1:
+        reasons.append('conflicting net pay values')
+    elif not 1000 <= net_pay <= 10000000:
+        reasons.append('net pay out of range')
+    elif net_pay.is_integer() and 1900 <= net_pay <= 2099:
+        reasons.append('net pay looks like a year')
+    if net_pay and gross_pay and net_pay > gross_pay:
+        reasons.append('net pay exceeds gross pay')
+
+    return {
+        'net_pay': net_pay,
+        'gross_pay': gross_pay,
+        'employer': employer,
+        'month': month,
+        'ambiguous': bool(reasons),
+        'ambiguity_reasons': reasons,
+    }
+
+
+def _vision_content_part(upload, upload_info, encoded_content):
+    """OpenAI content part for the upload: a data URL image, or the PDF as a file input"""
+    if upload_info.mime_type == 'application/pdf':
+        return {
+            "type": "file",
+            "file": {
+                "filename": getattr(upload, 'name', None) or 'salary_slip.pdf',
+                "file_data": f"data:application/pdf;base64,{encoded_content}"
+            }
+        }
+    normalized = normalize_image(upload, sha256=upload_info.sha256)
+    return {"type": "image_url", "image_url": {"url": to_data_url(normalized), "detail": "high"}}
+
+
+def extract_salary_slip(upload, upload_info, encoded_content=None, agent=None):
+    """
+    Read a salary slip: local text extraction for digital PDFs, vision model for
+    scanned PDFs, images and ambiguous text.
+
+    upload: the uploaded file; upload_info: uploads.UploadInfo
+    encoded_content: base64 of the file if already computed (reused for PDF vision input)
+    Returns: dict with net_pay, gross_pay, employer, month, source and timing
+    """
+    started = time.perf_counter()
+    parsed = None
+
+    if upload_info.mime_type == 'application/pdf':
+        text = extract_pdf_text(upload)
+        if text and len(text.strip()) >= MIN_TEXT_CHARS:
+            parsed = parse_salary_text(text)
+            if not parsed['ambiguous']:
+                parsed['source'] = 'pdf_text'
+                parsed['extraction_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                return parsed
+
+    if agent is None:
+        from .agents import SalarySlipAgent, get_agent
+        agent = get_agent(SalarySlipAgent)
+
+    if encoded_content is None and upload_info.mime_type == 'application/pdf':
+        from .uploads import b64encode_upload
+        encoded_content = b64encode_upload(upload)
+
+    result = agent.extract_salary_details(_vision_content_part(upload, upload_info, encoded_content))
+    result['source'] = 'vision'
+    if parsed:
+        result['local_parse'] = parsed
+    result['extraction_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def _months_between(month, today):
+    try:
+        year, month_number = (int(part) for part in month.split('-')[:2])
+    except (AttributeError, ValueError):
+        return None
+    return (today.year - year) * 12 + (today.month - month_number)
+
+
+COMPANY_STOPWORDS = {'pvt', 'private', 'ltd', 'limited', 'llp', 'inc', 'the', 'and', 'co', 'company'}
+
+
+def _company_words(name):
+    return {word for word in re.findall(r'[a-z0-9]+', name.lower()) if word not in COMPANY_STOPWORDS}
+
+
+def _employer_matches(employer, company_name):
+    """True / False when both names are known, None otherwise"""
+    if not employer or not company_name:
+        return None
+    expected, found = _company_words(company_name), _company_words(employer)
+    return bool(expected and found and expected & found)
+
+
+def verify_salary_slip(extracted, customer, today=None):
+    """
+    Compare extracted salary details with the customer's declared monthly income
+    Returns: extracted dict plus income_verified, variance and reasons
+    """
+    today = today or date.today()
+    tolerance = float(getattr(settings, 'SALARY_SLIP_INCOME_TOLERANCE', 0.15))
+    max_age = int(getattr(settings, 'SALARY_SLIP_MAX_AGE_MONTHS', 3))
+
+    declared = float(customer.monthly_income) if customer.monthly_income else None
+    net_pay = _to_amount(str(extracted.get('net_pay'))) if extracted.get('net_pay') is not None else None
+    gross_pay = _to_amount(str(extracted.get('gross_pay'))) if extracted.get('gross_pay') is not None else None
+
+    reasons = []
+    variance = None
+    if extracted.get('error') or extracted.get('is_salary_slip') is False:
+        reasons.append('document could not be read as a salary slip')
+    elif net_pay is None:
+        reasons.append('net pay could not be found on the salary slip')
+    elif declared:
+        # Declared income may be quoted gross or net; compare against the higher figure
+        reference = max(net_pay, gross_pay or 0)
+        variance = (declared - reference) / declared
+        if variance > tolerance:
+            reasons.append(
+                f"salary slip shows ₹{reference:,.0f}, below the declared ₹{declared:,.0f}"
+            )
+
+    age = _months_between(extracted.get('month'), today)
+    if age is not None and age > max_age:
+        reasons.append(f"salary slip is for {extracted['month']}, older than {max_age} months")
+
+    result = dict(extracted)
+    result.update({
+        'net_pay': net_pay,
+        'gross_pay': gross_pay,
+        'declared_monthly_income': declared,
+        'income_variance': round(variance, 4) if variance is not None else None,
+        'employer_matches': _employer_matches(extracted.get('employer'), customer.company_name),
+        'income_verified': not reasons,
+        'verification_reasons': reasons,
+    })
+    return result
@@ -0,0 +1,100 @@
+from django.core.cache import cache
+
+from .agents import CreditScoreCalculator
+from .amortization import AmortizationEngine
+
+
+class EMISimulator:
+    """
+    Eligibility and EMI grid for a customer profile, computed without any LLM call
+    """
+
+    DEFAULT_TENURES = [6, 12, 18, 24, 36, 48, 60]
+    DEFAULT_AMOUNT_STEPS = 10
+    MAX_TENURES = 24
+    MAX_AMOUNTS = 50
+    CACHE_TIMEOUT = 60 * 60  # 1 hour
+
+    @staticmethod
+    def default_amounts(max_amount, steps=DEFAULT_AMOUNT_STEPS):
+        """Evenly spaced loan amounts from ₹10,000 up to max_amount, rounded to ₹5,000"""
+        low = 10000
+        high = max(low, float(max_amount))
+        step = (high - low) / (steps - 1)
+        amounts = sorted({int(round((low + step * i) / 5000.0)) * 5000 for i in range(steps)})
+        return [max(low, amount) for amount in amounts]
+
+    @staticmethod
+    def simulate(monthly_income, credit_score, employment_type, tenures=None, amounts=None,
+                 annual_rate=None):
+        """
+        Evaluate max eligible amount and EMI across a grid of tenures and amounts
+
+        Returns: dict with one row per tenure; emi, total_interest, emi_ratio and eligible are
+        lists aligned with 'amounts'
+        """
+        tenures = sorted(set(tenures or EMISimulator.DEFAULT_TENURES))
+        if annual_rate is None:
+            annual_rate = AmortizationEngine.default_annual_rate()
+        max_amounts = CreditScoreCalculator.calculate_max_loan_amounts(
+            monthly_income, credit_score, tenures, employment_type, annual_rate
+        )
+
+        if not amounts:
+            amounts = EMISimulator.default_amounts(max(max_amounts))
+        amounts = sorted(set(float(amount) for amount in amounts))
+
+        income = float(monthly_income) if monthly_income else None
+        max_emi = income * CreditScoreCalculator.get_max_emi_ratio(credit_score) if income else None
+
+        rows = []
+        for tenure, max_amount in zip(tenures, max_amounts):
+            emis = AmortizationEngine.calculate_emis(amounts, annual_rate, tenure)
+            rows.append({
+                'tenure_months': tenure,
+                'max_eligible_amount': round(max_amount, 2),
+                'emi': [round(emi, 2) for emi in emis],
+                'total_interest': [round(emi * tenure - amount, 2) for amount, emi in zip(amounts, emis)],
+                'emi_ratio': [round(emi / income, 4) for emi in emis] if income else None,
+                'eligible': [
+                    amount <= max_amount and (max_emi is None or emi <= max_emi)
+                    for amount, emi in zip(amounts, emis)
+                ]
+            })
+
+        return {
+            'credit_score': credit_score,
+            'score_category': CreditScoreCalculator.get_score_category(credit_score),
+            'interest_rate': annual_rate,
+            'max_emi': round(max_emi, 2) if max_emi else None,
+            'amounts': amounts,
+            'grid': rows
+        }
+
+    @staticmethod
+    def cache_key(customer, tenures, amounts):
+        """Cache key tied to the customer's profile version (updated_at)"""
+        version = customer.updated_at.timestamp() if customer.updated_at else 0
+        tenures_key = ','.join(str(t) for t in sorted(set(tenures))) if tenures else 'default'
+        amounts_key = ','.join(str(a) for a in sorted(set(amounts))) if amounts else 'default'
+        rate = AmortizationEngine.default_annual_rate()
+        return f"emi_simulation:{customer.pk}:{version}:{rate}:{tenures_key}:{amounts_key}"
+
+    @staticmethod
+    def for_customer(customer, tenures=None, amounts=None):
+        """Simulation grid for a customer, cached per profile version"""
+        key = EMISimulator.cache_key(customer, tenures, amounts)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+        credit_analysis = customer.calculate_credit_score()
+        result = EMISimulator.simulate(
+            customer.monthly_income,
+            credit_analysis['credit_score'],
+            customer.employment_type,
+            tenures,
+            amounts
+        )
+        cache.set(key, result, EMISimulator.CACHE_TIMEOUT)
+        return result
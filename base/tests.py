@@ -1,3 +1,1475 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from collections import Counter
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import CommandError, call_command
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFilter
+
+from . import imaging
+from .agents import (
+    RESPONSES, CreditScoreCalculator, MasterAgent, Reply, SanctionLetterGenerator, VerificationAgent, arun_flow,
+    get_agent, run_flow
+)
+from .amortization import AmortizationEngine
+from .downloads import document_response, stored_document
+from .exports import iter_loan_archive, iter_loan_documents, iter_zip
+from .idempotency import claim, idempotent
+from .imaging import (
+    InvalidImageError, assess_image_quality, clear_cache, describe_quality_issues, normalize_image
+)
+from .llm_limiter import LLMBusyError, LLMLimiter
+from .management.commands.microbench import Command as MicrobenchCommand
+from .management.commands.replay_underwriting import Command as ReplayCommand, replay_chunk
+from .middleware import RequestTimingMiddleware
+from .models import ChatSession, Customer, IdempotentRequest, LoanApplication, VerificationJob
+from .responses import ResponseTemplates
+from .salary_slip import parse_salary_text, verify_salary_slip
+from .sanction_letters import render_letter, store_letters
+from .simulation import EMISimulator
+from .underwriting_policy import (
+    MID_CAREER_FAMILY, NEW_TO_CREDIT, SELF_EMPLOYED, UNDERWRITING_POLICY, PolicyError, compile_policy
+)
+from .uploads import UploadTooLargeError, b64encode_upload, inspect_upload
+from .verification_cache import VerificationCache
+from .verification_jobs import (
+    JobServerError, claim_next_job, enqueue_job, fail_job, finish_job, requeue_stale_jobs, run_job
+)
+from .websocket import CHAT_SOCKET_PATH, result_watcher, websocket_application
+
+
+def _noise_jpeg(width=2400, height=1800):
+    """Hard to compress photo-like JPEG (several MB)"""
+    image = Image.effect_noise((width, height), 80).convert('RGB')
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=95)
+    return output.getvalue()
+
+
+def _temporary_upload(data, name='upload.jpg', content_type='image/jpeg'):
+    """Uploaded file spooled to disk, as Django does for uploads above 2.5MB"""
+    upload = TemporaryUploadedFile(name, content_type, len(data), None)
+    upload.write(data)
+    upload.seek(0)
+    return upload
+
+
+class StreamingUploadTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.data = _noise_jpeg()
+
+    def setUp(self):
+        clear_cache()
+        self.upload = _temporary_upload(self.data)
+
+    def tearDown(self):
+        self.upload.close()
+
+    def test_inspect_upload_hashes_and_sniffs(self):
+        info = inspect_upload(self.upload)
+        self.assertEqual(info.size, len(self.data))
+        self.assertEqual(info.mime_type, 'image/jpeg')
+        self.assertEqual(self.upload.tell(), 0)
+
+    def test_inspect_upload_enforces_max_size(self):
+        with self.assertRaises(UploadTooLargeError):
+            inspect_upload(self.upload, max_size=len(self.data) // 2)
+
+    def test_b64encode_upload_matches_stdlib(self):
+        self.assertEqual(b64encode_upload(self.upload), base64.b64encode(self.data).decode('ascii'))
+
+    def test_image_upload_peak_memory_below_file_size(self):
+        tracemalloc.start()
+        try:
+            info = inspect_upload(self.upload, max_size=len(self.data))
+            normalized = normalize_image(self.upload, sha256=info.sha256)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(normalized.mime_type, 'image/jpeg')
+        # Hashing, sniffing and decoding stream from the spooled file: no full copy
+        self.assertLess(peak, len(self.data))
+
+    def test_b64_persistence_peak_memory(self):
+        tracemalloc.start()
+        try:
+            encoded = b64encode_upload(self.upload)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # Only the encoded text (4/3 of the file) and its str copy; the raw bytes are never loaded
+        self.assertLess(peak, len(self.data) * 2.75)
+        self.assertEqual(encoded, base64.b64encode(self.data).decode('ascii'))
+
+
+# Text as pypdf extracts it from common payslip layouts
+PAYSLIP_TABLE = """Tata Consultancy Services Limited
+Payslip for the month of June 2025
+Employee Name: Asha Rao Employee ID: 123456
+Earnings Amount Deductions Amount
+Basic Salary 40,000.00 Provident Fund 4,800.00
+HRA 20,000.00 Professional Tax 200.00
+Special Allowance 25,000.00 Income Tax 5,000.00
+Gross Earnings 85,000.00 Total Deductions 10,000.00
+Net Pay for June 2025 : 75,000.00
+(Rupees Seventy Five Thousand Only)
+"""
+
+PAYSLIP_PERIOD_LABELS = """Company Name: Infosys Limited
+Pay Period: 06/2025
+Gross Salary (Rs.) 1,20,000
+Net Salary Payable (06/2025) Rs. 1,02,500
+"""
+
+PAYSLIP_NO_NET = """Acme Technologies Pvt Ltd
+Salary Statement - May 2025
+Basic 30,000
+Gross Pay 45,000
+Deductions 4,000
+"""
+
+
+class SalarySlipParsingTests(SimpleTestCase):
+
+    def test_table_layout(self):
+        parsed = parse_salary_text(PAYSLIP_TABLE)
+        self.assertEqual(parsed['net_pay'], 75000.0)
+        self.assertEqual(parsed['gross_pay'], 85000.0)
+        self.assertEqual(parsed['month'], '2025-06')
+        self.assertEqual(parsed['employer'], 'Tata Consultancy Services Limited')
+        self.assertFalse(parsed['ambiguous'])
+
+    def test_pay_period_in_label_is_not_the_amount(self):
+        self.assertEqual(parse_salary_text('Net Pay for June 2025 : 55,000')['net_pay'], 55000.0)
+        parsed = parse_salary_text(PAYSLIP_PERIOD_LABELS)
+        self.assertEqual(parsed['net_pay'], 102500.0)
+        self.assertEqual(parsed['gross_pay'], 120000.0)
+        self.assertEqual(parsed['month'], '2025-06')
+        self.assertEqual(parsed['employer'], 'Infosys Limited')
+        self.assertFalse(parsed['ambiguous'])
+
+    def test_year_like_net_pay_is_ambiguous(self):
+        parsed = parse_salary_text('Net Pay: 2025')
+        self.assertTrue(parsed['ambiguous'])
+        self.assertIn('net pay looks like a year', parsed['ambiguity_reasons'])
+
+    def test_missing_net_pay_is_ambiguous(self):
+        parsed = parse_salary_text(PAYSLIP_NO_NET)
+        self.assertIsNone(parsed['net_pay'])
+        self.assertEqual(parsed['gross_pay'], 45000.0)
+        self.assertTrue(parsed['ambiguous'])
+
+
+@override_settings(SALARY_SLIP_INCOME_TOLERANCE=0.15, SALARY_SLIP_MAX_AGE_MONTHS=3)
+class SalarySlipVerificationTests(SimpleTestCase):
+
+    def customer(self, monthly_income, company_name='Tata Consultancy Services'):
+        return SimpleNamespace(monthly_income=monthly_income, company_name=company_name)
+
+    def test_declared_income_within_tolerance_of_gross(self):
+        result = verify_salary_slip(parse_salary_text(PAYSLIP_TABLE), self.customer(90000), today=date(2025, 7, 5))
+        self.assertTrue(result['income_verified'])
+        self.assertTrue(result['employer_matches'])
+        self.assertAlmostEqual(result['income_variance'], (90000 - 85000) / 90000, places=4)
+
+    def test_declared_income_above_slip_is_rejected(self):
+        result = verify_salary_slip(parse_salary_text(PAYSLIP_TABLE), self.customer(120000), today=date(2025, 7, 5))
+        self.assertFalse(result['income_verified'])
+        self.assertIn('below the declared', result['verification_reasons'][0])
+
+    def test_old_slip_is_rejected(self):
+        result = verify_salary_slip(parse_salary_text(PAYSLIP_TABLE), self.customer(80000), today=date(2025, 12, 1))
+        self.assertFalse(result['income_verified'])
+        self.assertIn('older than 3 months', result['verification_reasons'][0])
+
+    def test_missing_net_pay_is_rejected(self):
+        result = verify_salary_slip(parse_salary_text(PAYSLIP_NO_NET), self.customer(45000), today=date(2025, 6, 10))
+        self.assertFalse(result['income_verified'])
+        self.assertEqual(result['verification_reasons'], ['net pay could not be found on the salary slip'])
+        self.assertFalse(result['employer_matches'])
+
+
+def _two_step_flow(events):
+    """A flow with a plain request and a Reply; model errors on the first call are recovered from"""
+    try:
+        try:
+            first = yield [{'role': 'user', 'content': 'one'}], 0.3
+        except ValueError as e:
+            first = f'recovered {e}'
+        second = yield Reply([{'role': 'user', 'content': 'two'}], 0.7)
+        return first, second
+    finally:
+        events.append('closed')
+
+
+class FlowRunnerTests(SimpleTestCase):
+
+    def stub(self, fail=None):
+        calls = []
+
+        def call(messages, temperature):
+            calls.append((messages[0]['content'], temperature))
+            if fail and len(calls) == 1:
+                raise fail
+            return f"reply to {messages[0]['content']}"
+        return call, calls
+
+    def test_run_flow_sends_replies(self):
+        call, calls = self.stub()
+        events = []
+        self.assertEqual(run_flow(_two_step_flow(events), call), ('reply to one', 'reply to two'))
+        self.assertEqual(calls, [('one', 0.3), ('two', 0.7)])
+        self.assertEqual(events, ['closed'])
+
+    def test_run_flow_throws_call_errors_into_the_flow(self):
+        call, _ = self.stub(fail=ValueError('timeout'))
+        self.assertEqual(run_flow(_two_step_flow([]), call), ('recovered timeout', 'reply to two'))
+
+    def test_run_flow_busy_closes_the_flow(self):
+        call, calls = self.stub(fail=LLMBusyError(3))
+        events = []
+        with self.assertRaises(LLMBusyError):
+            run_flow(_two_step_flow(events), call)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(events, ['closed'])
+
+    async def test_arun_flow_matches_run_flow(self):
+        sync_call, calls = self.stub(fail=ValueError('timeout'))
+
+        async def call(messages, temperature):
+            return sync_call(messages, temperature)
+
+        result = await arun_flow(_two_step_flow([]), call)
+        self.assertEqual(result, ('recovered timeout', 'reply to two'))
+        self.assertEqual(calls, [('one', 0.3), ('two', 0.7)])
+
+    async def test_arun_flow_busy_closes_the_flow(self):
+        async def call(messages, temperature):
+            raise LLMBusyError(3)
+
+        events = []
+        with self.assertRaises(LLMBusyError):
+            await arun_flow(_two_step_flow(events), call)
+        self.assertEqual(events, ['closed'])
+
+    def test_flow_that_returns_without_a_request(self):
+        def fixed():
+            return 'fixed'
+            yield
+
+        call, calls = self.stub()
+        self.assertEqual(run_flow(fixed(), call), 'fixed')
+        self.assertEqual(calls, [])
+
+
+class AmortizationTests(SimpleTestCase):
+
+    def test_emi_and_schedule(self):
+        schedule = AmortizationEngine.schedule(100000, 12, 12)
+        self.assertAlmostEqual(schedule.emi, 8884.88, places=2)
+        self.assertEqual(len(schedule.balance), 12)
+        self.assertEqual(schedule.balance[-1], 0.0)
+        self.assertAlmostEqual(sum(schedule.principal), 100000, places=6)
+        self.assertAlmostEqual(schedule.interest[0], 1000.0, places=6)
+        self.assertAlmostEqual(schedule.total_interest, 8884.88 * 12 - 100000, delta=0.1)
+
+    def test_zero_rate(self):
+        self.assertEqual(AmortizationEngine.calculate_emi(120000, 0, 12), 10000)
+
+    def test_principal_for_emi_inverts_calculate_emi(self):
+        principal = AmortizationEngine.principal_for_emi(8884.88, 12, 12)
+        self.assertAlmostEqual(principal, 100000, delta=0.1)
+
+    @override_settings(LOAN_INTEREST_RATE=12.0)
+    def test_max_loan_amount_is_repaid_by_the_max_emi(self):
+        # 750+ score: EMI up to 50% of income; salaried multiplier 1.0
+        amount = CreditScoreCalculator.calculate_max_loan_amount(100000, 780, 24, 'salaried')
+        emi = AmortizationEngine.calculate_emi(amount, 12, 24)
+        self.assertAlmostEqual(emi, 50000, places=4)
+        self.assertLess(amount, 50000 * 24)
+
+
+class EMISimulationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(
+            name='Ravi Menon',
+            pan='FGHIJ5678K',
+            date_of_birth=date(1990, 5, 1),
+            pan_verified=True,
+            employment_type='salaried',
+            monthly_income=80000,
+        )
+        cls.session = ChatSession.objects.create(customer=cls.customer, stage='loan_discussion')
+
+    def setUp(self):
+        cache.clear()
+
+    def simulate(self, **data):
+        return self.client.post(
+            reverse('base:emi_simulation'),
+            json.dumps({'session_id': self.session.id, **data}),
+            content_type='application/json'
+        )
+
+    def test_rejects_invalid_grids(self):
+        for data in (
+            {'tenures': []},
+            {'tenures': [0]},
+            {'tenures': [121]},
+            {'tenures': ['twelve']},
+            {'amounts': [0]},
+            {'amounts': [-50000]},
+            {'amounts': [float('inf')]},
+            {'amounts': ['nan']},
+            {'amounts': list(range(1000, 1000 * (EMISimulator.MAX_AMOUNTS + 2), 1000))},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.simulate(**data).status_code, 400)
+
+    def test_grid_matches_amortization(self):
+        response = self.simulate(tenures=[24, 12], amounts=[200000, 100000])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        rate = AmortizationEngine.default_annual_rate()
+        self.assertEqual(data['interest_rate'], rate)
+        self.assertEqual(data['amounts'], [100000.0, 200000.0])
+        self.assertEqual([row['tenure_months'] for row in data['grid']], [12, 24])
+        for row in data['grid']:
+            emis = AmortizationEngine.calculate_emis(data['amounts'], rate, row['tenure_months'])
+            self.assertEqual(row['emi'], [round(emi, 2) for emi in emis])
+            self.assertEqual(
+                row['total_interest'],
+                [round(emi * row['tenure_months'] - amount, 2) for amount, emi in zip(data['amounts'], emis)]
+            )
+
+    def test_cached_per_profile_version_and_rate(self):
+        with mock.patch.object(EMISimulator, 'simulate', wraps=EMISimulator.simulate) as simulate:
+            self.simulate(tenures=[12])
+            self.simulate(tenures=[12])
+            self.assertEqual(simulate.call_count, 1)
+
+            # Profile changes bump updated_at
+            self.customer.monthly_income = 90000
+            self.customer.save()
+            self.simulate(tenures=[12])
+            self.assertEqual(simulate.call_count, 2)
+
+            with override_settings(LOAN_INTEREST_RATE=15.0):
+                response = self.simulate(tenures=[12])
+            self.assertEqual(simulate.call_count, 3)
+            self.assertEqual(response.json()['data']['interest_rate'], 15.0)
+
+
+class UnderwritingPolicyTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.policy = compile_policy(UNDERWRITING_POLICY)
+
+    def decide(self, credit_score, loan_amount, segment=None, max_eligible_amount=100000):
+        return self.policy.evaluate({
+            'credit_score': credit_score,
+            'loan_amount': loan_amount,
+            'max_eligible_amount': max_eligible_amount,
+            'segment': segment,
+        })
+
+    def assertRule(self, decision, rule_id, outcome):
+        self.assertEqual((decision.rule_id, decision.outcome), (rule_id, outcome))
+
+    def test_min_credit_score_boundary(self):
+        self.assertRule(self.decide(649, 50000), 'below_min_credit_score', 'rejected')
+        self.assertRule(self.decide(650, 50000), 'salary_slip_required', 'pending_salary_slip')
+
+    def test_max_eligible_boundary(self):
+        self.assertRule(self.decide(720, 100001), 'exceeds_max_eligible', 'rejected')
+        self.assertRule(self.decide(720, 100000), 'salary_slip_required', 'pending_salary_slip')
+
+    def test_instant_approval_boundaries(self):
+        decision = self.decide(700, 80000)
+        self.assertRule(decision, 'instant_approval', 'approved')
+        self.assertTrue(decision.instant)
+        self.assertRule(self.decide(699, 80000), 'salary_slip_required', 'pending_salary_slip')
+        self.assertRule(self.decide(700, 80001), 'salary_slip_required', 'pending_salary_slip')
+
+    def test_segment_thresholds(self):
+        self.assertRule(self.decide(599, 50000, NEW_TO_CREDIT), 'below_min_credit_score', 'rejected')
+        self.assertRule(self.decide(679, 50000, MID_CAREER_FAMILY), 'below_min_credit_score', 'rejected')
+        self.assertEqual(self.decide(680, 50000, MID_CAREER_FAMILY).thresholds['max_emi_ratio'], 0.40)
+
+    def test_guarantor_boundary(self):
+        self.assertRule(self.decide(600, 50000, NEW_TO_CREDIT), 'guarantor_required', 'pending_guarantor')
+        self.assertRule(self.decide(649, 50000, NEW_TO_CREDIT), 'guarantor_required', 'pending_guarantor')
+        self.assertRule(self.decide(650, 50000, NEW_TO_CREDIT), 'salary_slip_required', 'pending_salary_slip')
+
+    def test_business_documents_boundaries(self):
+        self.assertRule(self.decide(699, 50000, SELF_EMPLOYED), 'business_documents', 'pending_business_docs')
+        self.assertRule(self.decide(700, 80001, SELF_EMPLOYED), 'business_documents', 'pending_business_docs')
+        # Instant approval is checked first
+        self.assertRule(self.decide(700, 80000, SELF_EMPLOYED), 'instant_approval', 'approved')
+
+    def test_batch_matches_single_evaluation(self):
+        facts = [
+            {'credit_score': score, 'loan_amount': 70000, 'max_eligible_amount': 100000, 'segment': SELF_EMPLOYED}
+            for score in (600, 690, 720)
+        ]
+        self.assertEqual(self.policy.evaluate_batch(facts), [self.policy.evaluate(f) for f in facts])
+
+    def test_invalid_policies(self):
+        with self.assertRaises(PolicyError):
+            compile_policy({'defaults': {'min_credit_score': 650}, 'rules': [{'id': 'r', 'outcome': 'approved'}]})
+        with self.assertRaises(PolicyError):
+            compile_policy({
+                'defaults': {'min_credit_score': 650, 'max_emi_ratio': 0.5},
+                'rules': [{'id': 'r', 'outcome': 'approved', 'all': [['credit_score', '~', 1]]}],
+            })
+
+
+class UnderwritingReplayTests(SimpleTestCase):
+
+    YOUNG = 'Young Salaried Professional'
+
+    # REPLAY_FIELDS order, as produced by Command.iter_chunks
+    ROWS = [
+        # Approved at the time, now far above the eligible amount
+        (1, 'approved', 5000000.0, 12, YOUNG, 'Acme', 'Engineer', 80000.0, 36, 'salaried', 0.0),
+        (2, 'disbursed', 50000.0, 12, YOUNG, 'Acme', 'Engineer', 150000.0, 60, 'salaried', 0.0),
+        (3, 'rejected', 5000000.0, 24, None, None, None, None, None, None, 0.0),
+    ]
+
+    def replay(self, sample_size=10):
+        return replay_chunk(self.ROWS, compile_policy(UNDERWRITING_POLICY), sample_size)
+
+    def test_replay_chunk_finds_the_flip(self):
+        transitions, rules, flips = self.replay()
+        self.assertEqual(transitions, Counter({
+            (self.YOUNG, 'approved', 'rejected'): 1,
+            (self.YOUNG, 'approved', 'approved'): 1,
+            ('Unknown', 'rejected', 'rejected'): 1,
+        }))
+        self.assertEqual(rules['exceeds_max_eligible'], 1)
+        self.assertEqual(flips, [{
+            'id': 1, 'segment': self.YOUNG, 'from': 'approved', 'to': 'rejected', 'rule': 'exceeds_max_eligible'
+        }])
+        self.assertEqual(self.replay(sample_size=0)[2], [])
+
+    def test_report_aggregates_per_segment(self):
+        transitions, rules, flips = self.replay()
+        # A second chunk merged into the first
+        transitions.update({(self.YOUNG, 'pending', 'approved'): 2})
+        report = ReplayCommand().build_report(transitions, rules, flips, UNDERWRITING_POLICY, 1.234)
+
+        self.assertEqual((report['applications'], report['changed']), (5, 3))
+        self.assertEqual(report['by_segment'][self.YOUNG], {
+            'total': 4,
+            'changed': 3,
+            'transitions': {'approved -> approved': 1, 'approved -> rejected': 1, 'pending -> approved': 2},
+        })
+        self.assertEqual(report['by_segment']['Unknown'], {
+            'total': 1, 'changed': 0, 'transitions': {'rejected -> rejected': 1}
+        })
+        self.assertEqual(report['by_status']['pending -> approved'], 2)
+        self.assertEqual(report['elapsed_seconds'], 1.23)
+        self.assertIn('current customer record', report['inputs'])
+
+
+class MicrobenchTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.baseline = os.path.join(directory.name, 'baseline.json')
+        self.current = os.path.join(directory.name, 'current.json')
+
+    def microbench(self, *args):
+        output = io.StringIO()
+        call_command('microbench', *args, stdout=output)
+        return output.getvalue()
+
+    def save_run(self, path):
+        self.microbench('--filter', 'amortization', '--min-time', '0.001', '--save', path)
+        with open(path) as f:
+            return json.load(f)
+
+    def slow_down(self, run, factor):
+        for result in run['results'].values():
+            result['ns_per_op'] *= factor
+        with open(self.current, 'w') as f:
+            json.dump(run, f)
+
+    def test_saved_baseline(self):
+        run = self.save_run(self.baseline)
+        self.assertEqual(list(run['results']), ['amortization.calculate_emi'])
+        self.assertGreater(run['results']['amortization.calculate_emi']['ns_per_op'], 0)
+
+    def test_compare_within_threshold(self):
+        run = self.save_run(self.baseline)
+        self.slow_down(run, 1.05)
+        output = self.microbench(
+            '--compare', self.baseline, '--current', self.current, '--fail-on-regression'
+        )
+        self.assertIn('+5.0%', output)
+
+    def test_regression_is_flagged(self):
+        run = self.save_run(self.baseline)
+        self.slow_down(run, 1.5)
+
+        # Reported, but only fails when asked to
+        self.assertIn('+50.0%', self.microbench('--compare', self.baseline, '--current', self.current))
+        with self.assertRaisesMessage(CommandError, '1 benchmark(s) regressed: amortization.calculate_emi'):
+            self.microbench('--compare', self.baseline, '--current', self.current, '--fail-on-regression')
+
+        # manage.py exits non-zero
+        argv = ['manage.py', 'microbench', '--compare', self.baseline, '--current', self.current,
+                '--fail-on-regression']
+        with self.assertRaises(SystemExit) as exit_status, \
+                mock.patch('sys.stdout', io.StringIO()), mock.patch('sys.stderr', io.StringIO()):
+            MicrobenchCommand().run_from_argv(argv)
+        self.assertEqual(exit_status.exception.code, 1)
+
+    def test_current_requires_compare(self):
+        with self.assertRaises(CommandError):
+            self.microbench('--current', self.current)
+
+
+class DocumentRangeTests(TestCase):
+
+    # 100 bytes: base64 with '==' padding, so the size comes from the padding too
+    CONTENT = bytes(range(100))
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name='Asha Rao', pan='ABCDE1234F')
+        cls.loan = LoanApplication.objects.create(
+            customer=customer,
+            loan_amount=100000,
+            purpose='test',
+            tenure_months=12,
+            salary_slip_name='salary_slips/slip.pdf',
+            salary_slip_content=base64.b64encode(cls.CONTENT).decode('ascii'),
+            salary_slip_content_type='application/pdf',
+        )
+
+    def download(self, **headers):
+        request = RequestFactory().get('/download/', **headers)
+        return document_response(request, stored_document(self.loan.id, 'salary_slip'))
+
+    def test_stored_size(self):
+        self.assertEqual(stored_document(self.loan.id, 'salary_slip').size, 100)
+
+    def test_full_download(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['Content-Length'], '100')
+
+    def test_single_range(self):
+        response = self.download(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-9/100')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[:10])
+
+    def test_suffix_range(self):
+        response = self.download(HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.download(HTTP_RANGE='bytes=100000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_multi_range_serves_whole_document(self):
+        response = self.download(HTTP_RANGE='bytes=0-9,20-29')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+
+    def test_stale_if_range_serves_whole_document(self):
+        response = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+
+class LLMLimiterTests(SimpleTestCase):
+
+    def test_full_queue_rejects_immediately(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=0, queue_timeout=5)
+        limiter.acquire(100)
+        started = time.monotonic()
+        with self.assertRaises(LLMBusyError) as raised:
+            limiter.acquire(100)
+        self.assertEqual(raised.exception.reason, 'queue full')
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+    def test_queue_timeout(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=4)
+        limiter.acquire(100)
+        with self.assertRaises(LLMBusyError) as raised:
+            limiter.acquire(100, timeout=0.05)
+        self.assertEqual(raised.exception.reason, 'queue timeout')
+        self.assertEqual(limiter.stats()['queue_depth'], 0)
+
+    async def test_async_queue_timeout(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=4)
+        limiter.acquire(100)
+        with self.assertRaises(LLMBusyError):
+            await limiter.aacquire(100, timeout=0.05)
+        self.assertEqual(limiter.stats()['timed_out'], 1)
+
+    def test_release_wakes_a_waiter(self):
+        limiter = LLMLimiter(max_concurrency=1, max_queue=4, queue_timeout=5)
+        limiter.acquire(100)
+        acquired = threading.Event()
+
+        def waiter():
+            with limiter.slot(100):
+                acquired.set()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        self.assertFalse(acquired.is_set())
+        started = time.monotonic()
+        limiter.release()
+        self.assertTrue(acquired.wait(1))
+        self.assertLess(time.monotonic() - started, 1)
+        thread.join()
+        self.assertEqual(limiter.stats()['in_flight'], 0)
+
+    def test_requests_per_second(self):
+        limiter = LLMLimiter(max_concurrency=0, requests_per_second=1, max_queue=4)
+        limiter.acquire(100)
+        limiter.release()
+        with self.assertRaises(LLMBusyError):
+            limiter.acquire(100, timeout=0.05)
+
+
+class IdempotencyTests(TestCase):
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(stage='greeting')
+        self.calls = 0
+        self.status = 200
+
+        @idempotent
+        def view(request):
+            self.calls += 1
+            return JsonResponse({'success': self.status < 400, 'call': self.calls}, status=self.status)
+        self.view = view
+
+    def post(self, message='hello', key='key-1'):
+        body = {'session_id': str(self.session.id), 'message': message}
+        return RequestFactory().post(
+            '/chat/', body, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.view(self.post())
+        second = self.view(self.post())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+    def test_client_errors_are_replayed(self):
+        self.status = 400
+        self.view(self.post())
+        self.assertEqual(self.view(self.post()).status_code, 400)
+        self.assertEqual(self.calls, 1)
+
+    def test_key_reused_for_a_different_request(self):
+        self.view(self.post())
+        response = self.view(self.post(message='something else'))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_retry_while_in_progress(self):
+        record, response = claim(self.post())
+        self.assertIsNotNone(record)
+        self.assertIsNone(response)
+        response = self.view(self.post())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.calls, 0)
+
+    def test_server_errors_are_not_stored(self):
+        self.status = 500
+        self.assertEqual(self.view(self.post()).status_code, 500)
+        self.assertFalse(IdempotentRequest.objects.exists())
+        self.status = 200
+        response = self.view(self.post())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+
+    def test_requests_without_a_key_always_run(self):
+        request = RequestFactory().post(
+            '/chat/', {'session_id': str(self.session.id)}, content_type='application/json'
+        )
+        self.view(request)
+        self.view(request)
+        self.assertEqual(self.calls, 2)
+
+
+class ResponseTemplateTests(SimpleTestCase):
+
+    def test_segment_variant(self):
+        text = RESPONSES.render('request_pan_number', 'en', 'Young Salaried Professional', customer_name='Asha')
+        self.assertTrue(text.startswith('Great, Asha! I found your record'))
+        self.assertTrue(text.endswith('just like you prefer!'))
+
+    def test_unknown_segment_uses_the_default_variant(self):
+        self.assertEqual(
+            RESPONSES.render('request_kyc_details', 'en', 'Some Other Segment'),
+            RESPONSES.render('request_kyc_details', 'en')
+        )
+
+    def test_any_segment_variant(self):
+        text = RESPONSES.render('inform_new_customer', 'en', 'Self-Employed Professional/Small Business Owner')
+        self.assertIn('Based on your profile (Self-Employed Professional/Small Business Owner)', text)
+        self.assertNotIn('Based on your profile', RESPONSES.render('inform_new_customer', 'en'))
+
+    def test_language_fallback(self):
+        self.assertIn('नमस्ते', RESPONSES.render('greeting', 'hi'))
+        self.assertEqual(RESPONSES.render('greeting', 'fr'), RESPONSES.render('greeting', 'en'))
+
+    def test_values_are_not_formatted_again(self):
+        templates = ResponseTemplates(
+            {'en': {'a': 'Hello {customer_name}!', 'b': 'Bye.'}},
+            {'m': {None: ['a', 'b']}}
+        )
+        self.assertEqual(templates.render('m', customer_name='{x}'), 'Hello {x}! Bye.')
+        with self.assertRaises(KeyError):
+            templates.render('missing')
+
+    def test_agent_replies_without_a_model_call(self):
+        def call(messages, temperature):
+            raise AssertionError('model called')
+
+        master = get_agent(MasterAgent)
+        self.assertEqual(run_flow(master.greet_user.flow(None), call), RESPONSES.render('greeting'))
+        segment = {'segment': 'Low-Income or New-to-Credit Applicant'}
+        self.assertEqual(
+            run_flow(get_agent(VerificationAgent).request_kyc_details.flow(None, segment), call),
+            RESPONSES.render('request_kyc_details', 'en', segment['segment'])
+        )
+
+    @override_settings(LLM_REPHRASE_MESSAGES=['greeting'])
+    def test_rephrasing_is_opt_in_per_message(self):
+        calls = []
+
+        def call(messages, temperature):
+            calls.append(messages)
+            return 'Rephrased greeting'
+
+        master = get_agent(MasterAgent)
+        self.assertEqual(run_flow(master.greet_user.flow(None), call), 'Rephrased greeting')
+        self.assertEqual(calls[0][1]['content'], RESPONSES.render('greeting'))
+        run_flow(master.thank_and_close.flow(None), call)
+        self.assertEqual(len(calls), 1)
+
+
+LETTER_FIELDS = {
+    'loan_id': 42,
+    'date': 'June 01, 2025',
+    'name': 'Asha Rao',
+    'pan': 'ABCDE1234F',
+    'segment': 'Young Salaried Professional',
+    'age_group': '21-30',
+    'loan_amount': '₹100,000.00',
+    'tenure_months': 12,
+    'purpose': 'Home renovation',
+    'annual_rate': '12.00%',
+    'emi': '₹8,884.88',
+    'total_interest': '₹6,618.55',
+}
+
+
+class SanctionLetterTests(SimpleTestCase):
+
+    def letter_text(self, pdf):
+        from pypdf import PdfReader
+        reader = PdfReader(io.BytesIO(pdf))
+        self.assertEqual(len(reader.pages), 1)
+        return reader.pages[0].extract_text()
+
+    def test_letter_text(self):
+        text = self.letter_text(render_letter(LETTER_FIELDS))
+        for expected in (
+            # Static layer (pre-rendered operators in a form XObject)
+            'LOAN SANCTION LETTER',
+            'Customer Details:',
+            'Terms & Conditions:',
+            '7. Loan terms customized based on customer profile and creditworthiness.',
+            'This is a system generated document. No signature required.',
+            # Per-letter fields
+            'Name: Asha Rao',
+            'Application ID: LA-000042',
+            'PAN: ABCDE1234F',
+            'Customer Profile: Young Salaried Professional (Age: 21-30)',
+            'Tenure: 12 months',
+        ):
+            self.assertIn(expected, text)
+
+    def test_letter_without_captured_layer_matches(self):
+        cached = self.letter_text(render_letter(LETTER_FIELDS))
+        with mock.patch.dict('base.sanction_letters._static_layers', {True: None, False: None}):
+            drawn = self.letter_text(render_letter(LETTER_FIELDS))
+        self.assertEqual(drawn, cached)
+
+
+class StoreLettersTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(
+            name='Asha Rao', pan='ABCDE1234F', date_of_birth=date(1998, 3, 14), employment_type='salaried'
+        )
+        cls.loan = LoanApplication.objects.create(
+            customer=customer, loan_amount=150000, purpose='Home renovation', tenure_months=12, status='approved'
+        )
+
+    def test_stores_letter_and_bumps_updated_at(self):
+        before = LoanApplication.objects.get(id=self.loan.id).updated_at
+        self.assertEqual(store_letters(LoanApplication.objects.all()), {'generated': 1, 'skipped': 0})
+
+        loan = LoanApplication.objects.get(id=self.loan.id)
+        self.assertGreater(loan.updated_at, before)
+        self.assertGreaterEqual(loan.updated_at, loan.sanction_letter_generated_at)
+        self.assertTrue(base64.b64decode(loan.sanction_letter_content).startswith(b'%PDF'))
+
+        # The stored fingerprint is current
+        self.assertEqual(store_letters(LoanApplication.objects.all()), {'generated': 0, 'skipped': 1})
+
+    def test_small_batches_render_in_process(self):
+        with mock.patch('base.sanction_letters.generate_letters', return_value=iter(())) as generate:
+            store_letters(LoanApplication.objects.all(), workers=8)
+        self.assertEqual(generate.call_args.args[1], 1)
+
+
+def _png(width=600, height=400, color=(200, 180, 160)):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(output, 'PNG')
+    return output.getvalue()
+
+
+@override_settings(VERIFICATION_JOBS_ENABLED=True)
+class VerificationJobTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name='Asha Rao', pan='ABCDE1234F', pan_verified=True)
+        cls.session = ChatSession.objects.create(
+            stage='pan_verification', customer_name='Asha Rao', customer=cls.customer
+        )
+        cls.other_session = ChatSession.objects.create(stage='greeting')
+
+    def enqueue(self, kind='pan_card'):
+        return enqueue_job(self.session, kind, normalize_image(_png()))
+
+    def server_error(self, session, normalized):
+        return {'success': False, 'message': 'Error verifying PAN card'}, 500
+
+    def test_claim_takes_the_oldest_queued_job(self):
+        first, second = self.enqueue(), self.enqueue('selfie')
+
+        job = claim_next_job('worker-1')
+        self.assertEqual(job.id, first.id)
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('running', 'worker-1', 1))
+        self.assertIsNotNone(job.locked_at)
+
+        self.assertEqual(claim_next_job('worker-2').id, second.id)
+        self.assertIsNone(claim_next_job('worker-3'))
+
+    def test_server_error_is_retried_until_the_last_attempt(self):
+        self.enqueue()
+        with mock.patch('base.views.process_pan_card_upload', self.server_error):
+            job = claim_next_job('worker-1')
+            with self.assertRaises(JobServerError):
+                run_job(job, max_attempts=2)
+            fail_job(job, 'Error verifying PAN card', max_attempts=2)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.locked_by), ('queued', None))
+
+            job = claim_next_job('worker-1')
+            self.assertEqual(job.attempts, 2)
+            body, status = run_job(job, max_attempts=2)
+
+        self.assertEqual(status, 500)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result_status), ('failed', 500))
+        self.assertEqual(job.result, body)
+        self.assertIsNone(job.image_data)
+
+    def test_fail_job_after_the_last_attempt(self):
+        self.enqueue()
+        job = claim_next_job('worker-1')
+        fail_job(job, 'timeout', max_attempts=1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error, job.result_status), ('failed', 'timeout', 500))
+        self.assertTrue(job.result['retry'])
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(job.image_data)
+
+    def test_requeue_stale_jobs(self):
+        stale, exhausted, fresh = self.enqueue(), self.enqueue(), self.enqueue()
+        expired = timezone.now() - timedelta(minutes=10)
+        VerificationJob.objects.filter(id=stale.id).update(status='running', locked_at=expired, attempts=1)
+        VerificationJob.objects.filter(id=exhausted.id).update(status='running', locked_at=expired, attempts=3)
+        VerificationJob.objects.filter(id=fresh.id).update(status='running', locked_at=timezone.now(), attempts=1)
+
+        self.assertEqual(requeue_stale_jobs(lease_seconds=300, max_attempts=3), 1)
+        statuses = dict(VerificationJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {stale.id: 'queued', exhausted.id: 'failed', fresh.id: 'running'})
+        self.assertEqual(VerificationJob.objects.get(id=exhausted.id).error, 'Lease expired')
+
+    def upload(self, url_name, field, session=None):
+        upload = SimpleUploadedFile('photo.png', _png(), content_type='image/png')
+        return self.client.post(reverse(url_name), {
+            'session_id': (session or self.session).id,
+            field: upload,
+        })
+
+    def test_uploads_are_queued(self):
+        ChatSession.objects.filter(id=self.session.id).update(temp_pan_image_data='cGFu')
+        for url_name, field, kind in (
+            ('base:upload_pan_card', 'pan_card_image', 'pan_card'),
+            ('base:upload_pan_card_async', 'pan_card_image', 'pan_card'),
+            ('base:upload_selfie', 'selfie_image', 'selfie'),
+            ('base:upload_selfie_async', 'selfie_image', 'selfie'),
+        ):
+            with self.subTest(url_name=url_name):
+                response = self.upload(url_name, field)
+                self.assertEqual(response.status_code, 202)
+                body = response.json()
+                self.assertTrue(body['queued'])
+                job = VerificationJob.objects.get(id=body['job_id'])
+                self.assertEqual((job.kind, job.status, job.session_id), (kind, 'queued', self.session.id))
+                self.assertTrue(job.image_data)
+
+    def test_job_status_only_for_the_owning_session(self):
+        job = self.enqueue()
+        url = reverse('base:verification_job_status', args=[job.id])
+
+        response = self.client.get(url, {'session_id': self.session.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'success': True, 'job_id': str(job.id), 'status': 'queued', 'pending': True
+        })
+        self.assertEqual(self.client.get(url, {'session_id': self.other_session.id}).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        finish_job(job, {'success': False, 'message': 'Name mismatch'}, 400)
+        response = self.client.get(url, {'session_id': self.session.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['message'], 'Name mismatch')
+        self.assertFalse(response.json()['pending'])
+
+
+def _mandelbrot(size=(600, 400), extent=(-2, -1.5, 1, 1.5), image_format='PNG'):
+    """Structured test photo; a resized JPEG copy stays within a few dHash bits"""
+    output = io.BytesIO()
+    Image.effect_mandelbrot(size, extent, 100).convert('RGB').save(output, image_format)
+    return normalize_image(output.getvalue())
+
+
+class VerificationCacheTests(SimpleTestCase):
+
+    VERIFIED = ({'is_valid': True, 'name_match': True}, 'PAN verified')
+    REJECTED = ({'is_valid': False, 'name_match': False}, 'Name does not match')
+
+    def setUp(self):
+        cache.clear()
+        self.photo = _mandelbrot()
+        self.retake = _mandelbrot((560, 372), image_format='JPEG')
+        self.other_photo = _mandelbrot(extent=(-0.8, -0.2, -0.6, 0.0))
+
+    def pan_cache(self, scope='session:1', context='Asha Rao|ABCDE1234F'):
+        return VerificationCache('pan', scope, context=context)
+
+    def test_exact_match(self):
+        self.pan_cache().store(self.photo, *self.VERIFIED, passed=True)
+        self.assertEqual(self.pan_cache().lookup(self.photo), self.VERIFIED)
+        self.assertIsNone(self.pan_cache().lookup(self.other_photo))
+
+    def test_near_match_reuses_passed_verdicts(self):
+        self.assertNotEqual(self.retake.sha256, self.photo.sha256)
+        self.pan_cache().store(self.photo, *self.VERIFIED, passed=True)
+        self.assertEqual(self.pan_cache().lookup(self.retake), self.VERIFIED)
+
+    def test_failed_verdict_reused_for_identical_image_only(self):
+        self.pan_cache().store(self.photo, *self.REJECTED, passed=False)
+        self.assertEqual(self.pan_cache().lookup(self.photo), self.REJECTED)
+        self.assertIsNone(self.pan_cache().lookup(self.retake))
+
+    def test_errors_are_not_cached(self):
+        self.pan_cache().store(self.photo, {'error': 'timeout'}, 'Try again', passed=False)
+        self.assertIsNone(self.pan_cache().lookup(self.photo))
+
+    def test_entries_expire(self):
+        self.pan_cache().store(self.photo, *self.VERIFIED, passed=True)
+        expired = time.time() + VerificationCache('pan', 'session:1').ttl + 1
+        with mock.patch('base.verification_cache.time.time', return_value=expired):
+            self.assertIsNone(self.pan_cache().lookup(self.photo))
+
+    def test_other_context_or_scope_never_matches(self):
+        self.pan_cache().store(self.photo, *self.VERIFIED, passed=True)
+        self.assertIsNone(self.pan_cache(context='Asha Rao|ABCDE1234G').lookup(self.photo))
+        self.assertIsNone(self.pan_cache(scope='session:2').lookup(self.photo))
+
+    @override_settings(VERIFICATION_CACHE_TTL=0)
+    def test_disabled(self):
+        self.pan_cache().store(self.photo, *self.VERIFIED, passed=True)
+        self.assertIsNone(self.pan_cache().lookup(self.photo))
+
+
+def _document_photo(size=(900, 600)):
+    """Light card with dark text lines: passes the document quality check"""
+    image = Image.new('RGB', size, (205, 200, 190))
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    left = width // 12
+    for i, y in enumerate(range(height // 10, height - height // 10, max(8, height // 15))):
+        line_width = width * 2 // 3 if i % 2 else width // 2
+        draw.rectangle((left, y, left + line_width, y + 4), fill=(30, 30, 30))
+        draw.text((left, y + 6), 'PERMANENT ACCOUNT NUMBER ABCDE1234F', fill=(20, 20, 20))
+    return image
+
+
+def _jpeg(image):
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+class ImageQualityTests(SimpleTestCase):
+
+    def test_sharp_document_passes(self):
+        report = assess_image_quality(_jpeg(_document_photo()))
+        self.assertTrue(report.passed)
+        self.assertEqual(report.issues, [])
+
+    def test_blurred(self):
+        report = assess_image_quality(_jpeg(_document_photo().filter(ImageFilter.GaussianBlur(6))))
+        self.assertFalse(report.passed)
+        self.assertEqual(report.issues, ['blurry'])
+
+    def test_dark(self):
+        report = assess_image_quality(_jpeg(_document_photo().point(lambda value: value // 6)))
+        self.assertFalse(report.passed)
+        self.assertIn('too_dark', report.issues)
+
+    def test_undersized(self):
+        photo = _jpeg(_document_photo((330, 260)))
+        self.assertEqual(assess_image_quality(photo).issues, ['too_small'])
+        # Selfies may be smaller than documents
+        self.assertTrue(assess_image_quality(photo, 'selfie').passed)
+
+    def test_settings_override_one_kind(self):
+        photo = _jpeg(_document_photo((330, 260)))
+        with override_settings(IMAGE_QUALITY_THRESHOLDS={'document': {'min_short_edge': 250}}):
+            self.assertTrue(assess_image_quality(photo).passed)
+        with override_settings(IMAGE_QUALITY_THRESHOLDS={'selfie': {'min_short_edge': 300}}):
+            self.assertEqual(assess_image_quality(photo, 'selfie').issues, ['too_small'])
+            self.assertEqual(assess_image_quality(photo).issues, ['too_small'])
+
+    def test_retry_message_names_each_issue(self):
+        message = describe_quality_issues(['blurry', 'too_dark'], subject='PAN card')
+        self.assertIn('the image looks blurry and the image is too dark', message)
+
+    def test_unreadable(self):
+        with self.assertRaises(InvalidImageError):
+            assess_image_quality(b'not an image')
+
+
+class NormalizeImageTests(SimpleTestCase):
+
+    def setUp(self):
+        clear_cache()
+
+    def photo(self, size=(600, 400), orientation=None):
+        """JPEG with EXIF (camera make, orientation) and an ICC profile"""
+        exif = Image.Exif()
+        exif[0x010F] = 'Test Camera'
+        if orientation:
+            exif[0x0112] = orientation
+        output = io.BytesIO()
+        _document_photo(size).save(output, 'JPEG', exif=exif, icc_profile=b'\0' * 128)
+        return output.getvalue()
+
+    def decoded(self, normalized):
+        return Image.open(io.BytesIO(normalized.data))
+
+    def test_exif_rotation_is_applied(self):
+        # Orientation 6: stored landscape, displayed rotated 90 degrees clockwise
+        normalized = normalize_image(self.photo(orientation=6))
+        self.assertEqual((normalized.width, normalized.height), (400, 600))
+        self.assertEqual(self.decoded(normalized).size, (400, 600))
+
+    def test_metadata_is_stripped(self):
+        image = self.decoded(normalize_image(self.photo(orientation=1)))
+        self.assertEqual(dict(image.getexif()), {})
+        self.assertNotIn('icc_profile', image.info)
+        self.assertNotIn('exif', image.info)
+
+    @override_settings(IMAGE_MAX_EDGE=500)
+    def test_long_edge_is_bounded(self):
+        normalized = normalize_image(self.photo((2000, 1000)))
+        self.assertEqual((normalized.width, normalized.height), (500, 250))
+        self.assertEqual(normalized.mime_type, 'image/jpeg')
+
+    def test_small_images_are_not_upscaled(self):
+        normalized = normalize_image(self.photo((300, 200)))
+        self.assertEqual((normalized.width, normalized.height), (300, 200))
+
+    def test_identical_bytes_are_normalized_once(self):
+        data = self.photo()
+        with mock.patch('base.imaging._encode', wraps=imaging._encode) as encode:
+            first = normalize_image(data)
+            self.assertIs(normalize_image(io.BytesIO(data)), first)
+            # Normalizing the output again is a cache hit too
+            self.assertIs(normalize_image(first.data), first)
+        self.assertEqual(encode.call_count, 1)
+
+    def test_unreadable(self):
+        with self.assertRaises(InvalidImageError):
+            normalize_image(b'not an image')
+
+
+class DocumentExportTests(TestCase):
+
+    LETTER = b'%PDF-1.4 sanction letter' * 1000
+    SLIP = bytes(range(256)) * 50
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name='Asha Rao', pan='ABCDE1234F')
+        loan = {'customer': customer, 'loan_amount': 100000, 'purpose': 'test', 'tenure_months': 12}
+        cls.both = LoanApplication.objects.create(
+            **loan,
+            sanction_letter_name='sanction_letters/letter.pdf',
+            sanction_letter_content=base64.b64encode(cls.LETTER).decode('ascii'),
+            salary_slip_name='../slips/Slip.PNG',
+            salary_slip_content=base64.b64encode(cls.SLIP).decode('ascii'),
+        )
+        cls.letter_only = LoanApplication.objects.create(
+            **loan,
+            sanction_letter_content=base64.b64encode(cls.LETTER).decode('ascii'),
+        )
+        cls.without_documents = LoanApplication.objects.create(**loan)
+
+    def archive(self):
+        data = b''.join(iter_loan_archive(LoanApplication.objects.all()))
+        return zipfile.ZipFile(io.BytesIO(data))
+
+    def test_archive_contents(self):
+        archive = self.archive()
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), [
+            f'LA-{self.both.id:06d}/sanction_letter.pdf',
+            f'LA-{self.both.id:06d}/salary_slip.png',
+            f'LA-{self.letter_only.id:06d}/sanction_letter.pdf',
+        ])
+        self.assertEqual(archive.read(f'LA-{self.both.id:06d}/sanction_letter.pdf'), self.LETTER)
+        self.assertEqual(archive.read(f'LA-{self.both.id:06d}/salary_slip.png'), self.SLIP)
+        self.assertEqual(archive.read(f'LA-{self.letter_only.id:06d}/sanction_letter.pdf'), self.LETTER)
+
+    def test_loans_without_documents_are_skipped(self):
+        entries = list(iter_loan_documents(LoanApplication.objects.filter(id=self.without_documents.id)))
+        self.assertEqual(entries, [])
+
+    def test_deflated_archive(self):
+        data = b''.join(iter_zip(
+            iter_loan_documents(LoanApplication.objects.filter(id=self.both.id)),
+            compression=zipfile.ZIP_DEFLATED
+        ))
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertEqual(archive.read(f'LA-{self.both.id:06d}/salary_slip.png'), self.SLIP)
+        self.assertLess(len(data), len(self.LETTER) + len(self.SLIP))
+
+
+class SanctionLetterDownloadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(
+            name='Asha Rao', pan='ABCDE1234F', date_of_birth=date(1998, 3, 14), employment_type='salaried'
+        )
+        loan = {'customer': customer, 'purpose': 'Home renovation', 'tenure_months': 12}
+        cls.loan = LoanApplication.objects.create(**loan, loan_amount=150000, status='approved')
+        cls.pending_loan = LoanApplication.objects.create(**loan, loan_amount=90000, status='pending')
+        cls.session = ChatSession.objects.create(customer=customer, stage='completed')
+        cls.other_session = ChatSession.objects.create(
+            customer=Customer.objects.create(name='Ravi Menon', pan='FGHIJ5678K'), stage='completed'
+        )
+
+    def download(self, loan=None, session=None, **headers):
+        params = {'session_id': (session or self.session).id}
+        return self.client.get(
+            reverse('base:download_sanction_letter', args=[(loan or self.loan).id]), params, **headers
+        )
+
+    def generated(self):
+        return mock.patch.object(
+            SanctionLetterGenerator, 'generate_letter', wraps=SanctionLetterGenerator.generate_letter
+        )
+
+    def test_download_and_conditional_request(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertIn('Sanction_Letter_LA', response['Content-Disposition'])
+
+        response = self.download(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_unchanged_letter_is_reused(self):
+        first = self.download()
+        with self.generated() as generate:
+            second = self.download()
+        self.assertEqual(generate.call_count, 0)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(b''.join(second.streaming_content), b''.join(first.streaming_content))
+
+    def test_changed_letter_is_regenerated(self):
+        first = self.download()
+        LoanApplication.objects.filter(id=self.loan.id).update(loan_amount=175000)
+        with self.generated() as generate:
+            second = self.download(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertIn(LoanApplication.objects.get(id=self.loan.id).sanction_letter_etag, second['ETag'])
+
+    def test_only_sanctioned_loans_of_the_session(self):
+        self.assertEqual(self.download(session=self.other_session).status_code, 404)
+        self.assertEqual(self.download(loan=self.pending_loan).status_code, 404)
+        url = reverse('base:download_sanction_letter', args=[self.loan.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, {'session_id': 'not-a-session'}).status_code, 404)
+        self.assertFalse(LoanApplication.objects.get(id=self.loan.id).sanction_letter_content)
+
+
+class FakeSocket:
+    """ASGI receive/send pair of a WebSocket connection driven by a test"""
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send(self, message):
+        await self.sent.put(message)
+
+    def send_text(self, text):
+        self.incoming.put_nowait({'type': 'websocket.receive', 'text': text})
+
+    def send_json(self, data):
+        self.send_text(json.dumps(data))
+
+    async def next_message(self):
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+    async def next_json(self):
+        return json.loads((await self.next_message())['text'])
+
+
+async def _fake_stream(messages, temperature=None, on_delta=None):
+    for delta in ('Hello', ' there'):
+        await on_delta(delta)
+    return 'Hello there'
+
+
+async def _fake_call(messages, temperature=None):
+    return '{"name": "Meera Iyer", "date_of_birth": "NOT_FOUND"}'
+
+
+@mock.patch('base.agents.astream_openai', _fake_stream)
+@mock.patch('base.agents.acall_openai', _fake_call)
+@override_settings(LLM_REPHRASE_MESSAGES=['greeting', 'request_new_customer_pan'])
+class ChatSocketTests(TestCase):
+
+    async def connect(self):
+        socket = FakeSocket()
+        scope = {'type': 'websocket', 'path': CHAT_SOCKET_PATH, 'headers': []}
+        socket.incoming.put_nowait({'type': 'websocket.connect'})
+        task = asyncio.create_task(websocket_application(scope, socket.receive, socket.send))
+        self.assertEqual(await socket.next_message(), {'type': 'websocket.accept'})
+        return socket, task
+
+    async def disconnect(self, socket, task):
+        socket.incoming.put_nowait({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(task, 5)
+
+    async def start(self, socket):
+        socket.send_json({'type': 'start'})
+        tokens = [await socket.next_json(), await socket.next_json()]
+        self.assertEqual([token['delta'] for token in tokens], ['Hello', ' there'])
+        session = await socket.next_json()
+        self.assertEqual(session['type'], 'session')
+        self.assertEqual(session['message'], 'Hello there')
+        return session
+
+    async def assert_nothing_pending(self, socket):
+        # Client messages are answered in order, so a pong means every event
+        # queued before it has already been sent
+        socket.send_json({'type': 'ping'})
+        self.assertEqual(await socket.next_json(), {'type': 'pong'})
+
+    async def test_start_and_resume(self):
+        socket, task = await self.connect()
+        session = await self.start(socket)
+        self.assertTrue(await ChatSession.objects.filter(id=session['session_id']).aexists())
+
+        socket.send_json({'type': 'resume', 'session_id': session['session_id']})
+        resumed = await socket.next_json()
+        self.assertEqual(resumed['session_id'], session['session_id'])
+        self.assertTrue(resumed['resumed'])
+
+        socket.send_json({'type': 'resume', 'session_id': 'not-a-session'})
+        self.assertEqual(await socket.next_json(), {'type': 'error', 'message': 'Invalid session'})
+        await self.disconnect(socket, task)
+
+    async def test_message_reply_is_streamed(self):
+        socket, task = await self.connect()
+        await self.start(socket)
+
+        socket.send_json({'type': 'message', 'message': 'hi'})
+        received = []
+        while not received or received[-1]['type'] == 'token':
+            received.append(await socket.next_json())
+        reply = received.pop()
+        self.assertEqual(reply['type'], 'message')
+        self.assertEqual(''.join(token['delta'] for token in received), reply['message'])
+        self.assertEqual(reply['workflow_stage'], 'pan_collection')
+        await self.disconnect(socket, task)
+
+    async def test_message_needs_a_session(self):
+        socket, task = await self.connect()
+        socket.send_json({'type': 'message', 'message': 'hi'})
+        self.assertEqual(await socket.next_json(), {'type': 'error', 'message': 'Invalid session'})
+        await self.disconnect(socket, task)
+
+    async def test_bad_frames(self):
+        socket, task = await self.connect()
+        socket.send_text('not json')
+        self.assertEqual(await socket.next_json(), {'type': 'error', 'message': 'Messages must be JSON'})
+        socket.send_json(['start'])
+        self.assertEqual(await socket.next_json(), {'type': 'error', 'message': 'Unknown message type'})
+        socket.send_json({'type': 'subscribe'})
+        self.assertEqual(await socket.next_json(), {'type': 'error', 'message': 'Unknown message type'})
+        # The connection is still usable
+        await self.assert_nothing_pending(socket)
+        await self.disconnect(socket, task)
+
+    @override_settings(VERIFICATION_JOBS_ENABLED=True)
+    async def test_results_from_both_sources_are_pushed_once(self):
+        socket, task = await self.connect()
+        session = await self.start(socket)
+        job = await VerificationJob.objects.acreate(
+            session_id=session['session_id'], kind='pan_card', status='running'
+        )
+        since = timezone.now() - timedelta(minutes=1)
+
+        # Finished in this process and found again by the result watcher
+        await sync_to_async(finish_job)(job, {'success': True}, 200)
+        await result_watcher.poll(since)
+        event = await socket.next_json()
+        self.assertEqual(event['event'], 'verification_result')
+        self.assertEqual(event['job_id'], str(job.id))
+        self.assertEqual(event['result']['status'], 'succeeded')
+        await self.assert_nothing_pending(socket)
+
+        # Later polls overlap the earlier window
+        await result_watcher.poll(since)
+        await self.assert_nothing_pending(socket)
+        await self.disconnect(socket, task)
+
+    async def test_watcher_stops_with_the_last_connection(self):
+        socket, task = await self.connect()
+        session = await self.start(socket)
+        self.assertEqual(list(result_watcher.sessions), [int(session['session_id'])])
+        await self.disconnect(socket, task)
+        self.assertFalse(result_watcher.sessions)
+
+
+def _customer_lookup_view(request):
+    """Two queries, one of them with a customer's PAN as a parameter"""
+    Customer.objects.filter(pan=request.GET.get('pan')).exists()
+    Customer.objects.count()
+    return JsonResponse({'success': True})
+
+
+@override_settings(REQUEST_TIMING_ENABLED=True, SERVER_TIMING_HEADER=True)
+class RequestTimingTests(TestCase):
+
+    def run_request(self, path='/lookup/?pan=ZYXWV9876A'):
+        middleware = RequestTimingMiddleware(_customer_lookup_view)
+        return middleware(RequestFactory().get(path))
+
+    def server_timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    @override_settings(REQUEST_SLOW_THRESHOLD_MS=60000)
+    def test_server_timing_counts_queries(self):
+        with self.assertNoLogs('base.timing'):
+            metrics = self.server_timing(self.run_request())
+        self.assertEqual(metrics['db']['desc'], '"2"')
+        self.assertGreaterEqual(float(metrics['db']['dur']), 0)
+        self.assertLessEqual(float(metrics['db']['dur']), float(metrics['total']['dur']))
+
+    @override_settings(REQUEST_SLOW_THRESHOLD_MS=0)
+    def test_slow_request_written_to_the_log_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'slow.jsonl')
+            with override_settings(REQUEST_SLOW_LOG=path):
+                self.run_request()
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+
+        entry = json.loads(text)
+        self.assertEqual(entry['path'], '/lookup/')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['sections']['db']['count'], 2)
+        self.assertEqual(len(entry['top_queries']), 2)
+        # Neither the query string nor the SQL parameters are logged
+        self.assertNotIn('ZYXWV9876A', text)
+
+    @override_settings(REQUEST_SLOW_THRESHOLD_MS=0, REQUEST_SLOW_LOG='')
+    def test_slow_request_logged_without_a_file(self):
+        with self.assertLogs('base.timing', 'WARNING') as logs:
+            self.run_request()
+        self.assertIn('"path": "/lookup/"', logs.output[0])
+        self.assertNotIn('ZYXWV9876A', logs.output[0])
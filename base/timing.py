@@ -0,0 +1,165 @@
+import heapq
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# Slowest statements kept per request for the slow log
+TOP_QUERIES = 5
+
+# SQL longer than this is cut in the slow log
+MAX_SQL_CHARS = 500
+
+_current = ContextVar('request_timing', default=None)
+_slow_log_lock = threading.Lock()
+
+
+class RequestTiming:
+    """
+    Where one request's time went: database, model calls, PDF rendering.
+    Filled from whatever thread serves the request (sync_to_async copies the
+    context), so updates take a lock.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        # section -> [count, seconds]
+        self.sections = {}
+        self.query_counts = {}
+        self._top_queries = []
+
+    def add(self, section, seconds):
+        with self.lock:
+            entry = self.sections.setdefault(section, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_query(self, sql, seconds):
+        with self.lock:
+            entry = self.sections.setdefault('db', [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            self.query_counts[sql] = self.query_counts.get(sql, 0) + 1
+            item = (seconds, entry[0], sql)
+            if len(self._top_queries) < TOP_QUERIES:
+                heapq.heappush(self._top_queries, item)
+            elif item > self._top_queries[0]:
+                heapq.heapreplace(self._top_queries, item)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def top_queries(self):
+        return [
+            {'ms': round(seconds * 1000, 2), 'sql': sql[:MAX_SQL_CHARS]}
+            for seconds, _, sql in sorted(self._top_queries, reverse=True)
+        ]
+
+    def repeated_queries(self):
+        """Statements run more than once (same SQL, any parameters): the usual N+1 suspects"""
+        repeated = [(count, sql) for sql, count in self.query_counts.items() if count > 1]
+        return [
+            {'count': count, 'sql': sql[:MAX_SQL_CHARS]}
+            for count, sql in sorted(repeated, reverse=True)[:TOP_QUERIES]
+        ]
+
+
+def start_request():
+    """Begin timing the current request. Returns: (RequestTiming, token for finish_request)"""
+    timing = RequestTiming()
+    return timing, _current.set(timing)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def record(section, seconds):
+    """Add time to a section of the current request (no-op outside a timed request)"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(section, seconds)
+
+
+@contextmanager
+def timed(section):
+    """Time a block into a section of the current request"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(section, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper, installed on every connection when it is created
+    (see BaseConfig.ready). Outside a timed request it only does a context lookup.
+    """
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_timing(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def server_timing_header(timing, total):
+    """Server-Timing value: total plus one metric per section (dur in ms)"""
+    metrics = [f'total;dur={total * 1000:.1f}']
+    for section, (count, seconds) in timing.sections.items():
+        metrics.append(f'{section};dur={seconds * 1000:.1f};desc="{count}"')
+    return ', '.join(metrics)
+
+
+def slow_request_entry(request, response, timing, total):
+    """One slow log line; SQL is logged without parameters (they can hold customer data)"""
+    return {
+        'ts': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.path,
+        'view': getattr(getattr(request, 'resolver_match', None), 'view_name', None),
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 1),
+        'sections': {
+            section: {'count': count, 'ms': round(seconds * 1000, 1)}
+            for section, (count, seconds) in timing.sections.items()
+        },
+        'top_queries': timing.top_queries(),
+        'repeated_queries': timing.repeated_queries(),
+    }
+
+
+def write_slow_log(entry):
+    """Append to REQUEST_SLOW_LOG (JSONL); falls back to the logger where the file can't be written"""
+    line = json.dumps(entry, default=str)
+    path = getattr(settings, 'REQUEST_SLOW_LOG', '')
+    if path:
+        try:
+            with _slow_log_lock, open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+            return
+        except OSError:
+            pass
+    logger.warning('slow request %s', line)
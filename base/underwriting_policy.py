@@ -0,0 +1,214 @@
+import operator
+from collections import namedtuple
+from functools import lru_cache
+
+
+# Segment names as produced by CustomerSegmentation.determine_segment
+YOUNG_SALARIED = 'Young Salaried Professional'
+MID_CAREER_FAMILY = 'Mid-Career Salaried with Family'
+SELF_EMPLOYED = 'Self-Employed Professional/Small Business Owner'
+NEW_TO_CREDIT = 'Low-Income or New-to-Credit Applicant'
+EXISTING_CUSTOMER = 'Existing Kite Capital Customer'
+
+
+# Underwriting decision table. Rules are evaluated top to bottom and the first
+# match wins. A condition is [left, op, right] where an operand is a fact name,
+# a number, or [fact, factor] meaning fact * factor. Rules may be restricted to
+# a list of segments and match on 'all' (every condition) or 'any' (at least one).
+UNDERWRITING_POLICY = {
+    'version': '2025.12.1',
+    'defaults': {
+        'min_credit_score': 650,
+        'max_emi_ratio': 0.50,
+    },
+    'segments': {
+        NEW_TO_CREDIT: {'min_credit_score': 600, 'max_emi_ratio': 0.35},  # Lenient score, conservative EMI
+        YOUNG_SALARIED: {'min_credit_score': 650, 'max_emi_ratio': 0.50},
+        MID_CAREER_FAMILY: {'min_credit_score': 680, 'max_emi_ratio': 0.40},  # Family obligations
+        SELF_EMPLOYED: {'min_credit_score': 670},
+        EXISTING_CUSTOMER: {'min_credit_score': 620},  # Lenient for existing customers
+    },
+    'rules': [
+        {
+            'id': 'below_min_credit_score',
+            'outcome': 'rejected',
+            'all': [['credit_score', '<', 'min_credit_score']],
+        },
+        {
+            'id': 'exceeds_max_eligible',
+            'outcome': 'rejected',
+            'all': [['loan_amount', '>', 'max_eligible_amount']],
+        },
+        {
+            'id': 'instant_approval',
+            'outcome': 'approved',
+            'instant': True,
+            'all': [
+                ['loan_amount', '<=', ['max_eligible_amount', 0.8]],
+                ['credit_score', '>=', 700],
+            ],
+        },
+        {
+            'id': 'business_documents',
+            'outcome': 'pending_business_docs',
+            'segments': [SELF_EMPLOYED],
+            'any': [
+                ['credit_score', '<', 700],
+                ['loan_amount', '>', ['max_eligible_amount', 0.6]],
+            ],
+        },
+        {
+            'id': 'guarantor_required',
+            'outcome': 'pending_guarantor',
+            'segments': [NEW_TO_CREDIT],
+            'all': [['credit_score', '<', 650]],
+        },
+        {
+            'id': 'salary_slip_required',
+            'outcome': 'pending_salary_slip',
+            'any': [
+                ['credit_score', '<', 700],
+                ['loan_amount', '>', ['max_eligible_amount', 0.6]],
+            ],
+        },
+        {
+            'id': 'standard_approval',
+            'outcome': 'approved',
+            'all': [['credit_score', '>=', 650]],
+        },
+        {
+            'id': 'default_reject',
+            'outcome': 'rejected',
+            'all': [],
+        },
+    ],
+}
+
+
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+Decision = namedtuple('Decision', ['rule_id', 'outcome', 'instant', 'thresholds'])
+
+
+class PolicyError(ValueError):
+    """Raised when a decision table cannot be compiled"""
+
+
+class CompiledPolicy:
+    """
+    Decision table compiled into plain Python predicates.
+    Compile once with compile_policy() and reuse for single or batch evaluation.
+    """
+
+    def __init__(self, version, defaults, segments, rules):
+        self.version = version
+        self.defaults = defaults
+        self.segments = segments
+        self.rules = rules
+
+    def thresholds(self, segment=None):
+        """Merged default + segment thresholds"""
+        return self.segments.get(segment, self.defaults)
+
+    def evaluate(self, facts):
+        """
+        Evaluate one application.
+
+        facts: dict with credit_score, loan_amount, max_eligible_amount and
+        optionally segment (segment name)
+        Returns: Decision for the first rule that fires
+        """
+        segment = facts.get('segment')
+        thresholds = self.thresholds(segment)
+        values = dict(thresholds)
+        values.update(facts)
+
+        for rule_id, outcome, instant, rule_segments, predicate in self.rules:
+            if rule_segments is not None and segment not in rule_segments:
+                continue
+            if predicate(values):
+                return Decision(rule_id, outcome, instant, thresholds)
+
+        raise PolicyError(f"No underwriting rule matched (policy {self.version})")
+
+    def evaluate_batch(self, facts_list):
+        """Evaluate many applications. Returns: list of Decision in input order"""
+        evaluate = self.evaluate
+        return [evaluate(facts) for facts in facts_list]
+
+
+def _compile_operand(operand):
+    """Turn an operand into a function of the facts dict"""
+    if isinstance(operand, bool):
+        raise PolicyError(f"Invalid operand: {operand!r}")
+    if isinstance(operand, (int, float)):
+        value = float(operand)
+        return lambda facts: value
+    if isinstance(operand, str):
+        return lambda facts: float(facts[operand])
+    if isinstance(operand, (list, tuple)) and len(operand) == 2 and isinstance(operand[0], str):
+        name, factor = operand[0], float(operand[1])
+        return lambda facts: float(facts[name]) * factor
+    raise PolicyError(f"Invalid operand: {operand!r}")
+
+
+def _compile_condition(condition):
+    try:
+        left, op, right = condition
+        compare = OPERATORS[op]
+    except (TypeError, ValueError, KeyError):
+        raise PolicyError(f"Invalid condition: {condition!r}")
+    left_value = _compile_operand(left)
+    right_value = _compile_operand(right)
+    return lambda facts: compare(left_value(facts), right_value(facts))
+
+
+def _compile_rule(rule):
+    if 'id' not in rule or 'outcome' not in rule:
+        raise PolicyError(f"Rule is missing 'id' or 'outcome': {rule!r}")
+    if 'all' in rule and 'any' in rule:
+        raise PolicyError(f"Rule {rule['id']} must use either 'all' or 'any', not both")
+
+    if 'any' in rule:
+        checks = tuple(_compile_condition(c) for c in rule['any'])
+        predicate = lambda facts: any(check(facts) for check in checks)
+    else:
+        checks = tuple(_compile_condition(c) for c in rule.get('all', []))
+        predicate = lambda facts: all(check(facts) for check in checks)
+
+    segments = frozenset(rule['segments']) if rule.get('segments') else None
+    return (rule['id'], rule['outcome'], bool(rule.get('instant', False)), segments, predicate)
+
+
+def compile_policy(policy):
+    """Validate a decision table (dict) and compile it into a CompiledPolicy"""
+    defaults = dict(policy.get('defaults', {}))
+    for key in ('min_credit_score', 'max_emi_ratio'):
+        if key not in defaults:
+            raise PolicyError(f"Policy defaults must define '{key}'")
+
+    segments = {}
+    for name, overrides in policy.get('segments', {}).items():
+        merged = dict(defaults)
+        merged.update(overrides)
+        segments[name] = merged
+
+    rules = tuple(_compile_rule(rule) for rule in policy.get('rules', []))
+    if not rules:
+        raise PolicyError("Policy must define at least one rule")
+
+    return CompiledPolicy(policy.get('version', 'unversioned'), defaults, segments, rules)
+
+
+@lru_cache(maxsize=1)
+def get_underwriting_policy():
+    """The active underwriting policy, compiled once per process"""
+    return compile_policy(UNDERWRITING_POLICY)
@@ -0,0 +1,100 @@
+import base64
+import hashlib
+from collections import namedtuple
+
+
+# Large enough to keep per-chunk overhead low, a multiple of 3 so base64 chunks concatenate cleanly
+UPLOAD_CHUNK_SIZE = 3 * 64 * 1024
+
+# Result of a single streaming pass over an upload
+UploadInfo = namedtuple('UploadInfo', ['sha256', 'size', 'mime_type'])
+
+# Leading bytes -> MIME type. WebP is RIFF....WEBP and handled separately.
+FILE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+)
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the allowed size while it is being read"""
+
+
+def sniff_mime_type(header):
+    """MIME type from a file's leading bytes (not the client supplied content type)"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime_type in FILE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return 'application/octet-stream'
+
+
+def iter_chunks(upload, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Yield an uploaded file (Django UploadedFile or file-like) chunk by chunk from the start"""
+    upload.seek(0)
+    if hasattr(upload, 'chunks'):
+        yield from upload.chunks(chunk_size)
+    else:
+        while True:
+            chunk = upload.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    upload.seek(0)
+
+
+def inspect_upload(upload, max_size=None):
+    """
+    Hash, measure and sniff an upload in one streaming pass. Only one chunk
+    is held at a time; large uploads stay in Django's temporary file.
+    Raises UploadTooLargeError as soon as max_size is exceeded.
+    Returns: UploadInfo
+    """
+    digest = hashlib.sha256()
+    size = 0
+    header = b''
+
+    for chunk in iter_chunks(upload):
+        if len(header) < 16:
+            header += chunk[:16 - len(header)]
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            upload.seek(0)
+            raise UploadTooLargeError(f"Upload exceeds {max_size} bytes")
+        digest.update(chunk)
+
+    return UploadInfo(digest.hexdigest(), size, sniff_mime_type(header))
+
+
+def b64encode_upload(upload):
+    """
+    Base64 text of an upload, encoded chunk by chunk into a buffer of the exact
+    output size so the raw bytes are never held in memory alongside it.
+    """
+    size = upload.size if getattr(upload, 'size', None) is not None else inspect_upload(upload).size
+    encoded = bytearray(4 * ((size + 2) // 3))
+    position = 0
+    remainder = b''
+
+    for chunk in iter_chunks(upload):
+        if remainder:
+            chunk = remainder + chunk
+        cut = len(chunk) - len(chunk) % 3
+        piece = base64.b64encode(memoryview(chunk)[:cut])
+        encoded[position:position + len(piece)] = piece
+        position += len(piece)
+        remainder = bytes(chunk[cut:])
+
+    if remainder:
+        piece = base64.b64encode(remainder)
+        encoded[position:position + len(piece)] = piece
+        position += len(piece)
+
+    if position != len(encoded):
+        # The file changed size while being read; keep what was actually read
+        del encoded[position:]
+    return encoded.decode('ascii')
@@ -18,6 +18,25 @@ urlpatterns = [
     path('upload_selfie/', views.upload_selfie, name='upload_selfie'),
     path('upload_salary_slip/', views.upload_salary_slip, name='upload_salary_slip'),
     
+    # Async (ASGI) variants of the chat and upload endpoints
+    path('async/start_chat/', views.start_chat_async, name='start_chat_async'),
+    path('async/chat/', views.chat_async, name='chat_async'),
+    path('async/upload_pan_card/', views.upload_pan_card_async, name='upload_pan_card_async'),
+    path('async/upload_selfie/', views.upload_selfie_async, name='upload_selfie_async'),
+    
+    # Queued verification status (GET, used when VERIFICATION_JOBS_ENABLED)
+    path('verification_job/<uuid:job_id>/', views.verification_job_status, name='verification_job_status'),
+    
+    # EMI / eligibility simulation (POST, no LLM call)
+    path('emi_simulation/', views.emi_simulation, name='emi_simulation'),
+    
     # Document download (GET)
     path('download_sanction_letter/<int:loan_id>/', views.download_sanction_letter, name='download_sanction_letter'),
+    path('documents/<int:loan_id>/<str:document>/', views.download_document, name='download_document'),
+    
+    # Process metrics (GET, staff or METRICS_TOKEN)
+    path('metrics/', views.metrics, name='metrics'),
+    
+    # Readiness probe (200 once warmed up, 503 before)
+    path('ready/', views.ready, name='ready'),
 ]
\ No newline at end of file
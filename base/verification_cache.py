@@ -0,0 +1,102 @@
+import io
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .imaging import InvalidImageError, read_image_bytes
+
+
+def perceptual_hash(image_file):
+    """
+    64-bit difference hash (dHash): compare horizontally adjacent pixels of a
+    9x8 grayscale thumbnail. Re-encoded, resized or slightly re-cropped copies of
+    the same photo land within a few bits of each other.
+    """
+    from PIL import Image
+    
+    data = read_image_bytes(image_file)
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format == 'JPEG':
+            image.draft('L', (64, 64))
+        pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    except (OSError, Image.DecompressionBombError) as e:
+        raise InvalidImageError(f"Unreadable image: {e}")
+
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class VerificationCache:
+    """
+    Recent verification verdicts for one scope (session or customer) and kind
+    ('pan' or 'face'), matched by exact SHA-256 or, for passing verdicts only,
+    by perceptual hash: a retake after a failure is usually a similar photo and
+    must get a fresh verification.
+
+    context: anything else the verdict depends on (expected name/PAN, the
+    other image's hash); entries with a different context never match.
+    """
+
+    MAX_ENTRIES = 10
+
+    def __init__(self, kind, scope, context=''):
+        self.key = f"verification_cache:{kind}:{scope}"
+        self.context = str(context)
+        self.ttl = int(getattr(settings, 'VERIFICATION_CACHE_TTL', 15 * 60))
+        self.max_distance = int(getattr(settings, 'VERIFICATION_CACHE_MAX_DISTANCE', 6))
+
+    def _entries(self):
+        now = time.time()
+        return [entry for entry in cache.get(self.key, []) if entry['expires_at'] > now]
+
+    def lookup(self, normalized):
+        """
+        normalized: NormalizedImage of the upload
+        Returns: (result, message) of a matching earlier verification, or None
+        """
+        if self.ttl <= 0:
+            return None
+        entries = [entry for entry in self._entries() if entry['context'] == self.context]
+        if not entries:
+            return None
+
+        for entry in entries:
+            if entry['sha256'] == normalized.sha256:
+                return entry['result'], entry['message']
+
+        entries = [entry for entry in entries if entry['dhash'] is not None]
+        if not entries:
+            return None
+        dhash = perceptual_hash(normalized.data)
+        best = min(entries, key=lambda entry: hamming_distance(entry['dhash'], dhash))
+        if hamming_distance(best['dhash'], dhash) <= self.max_distance:
+            return best['result'], best['message']
+        return None
+
+    def store(self, normalized, result, message, passed):
+        """
+        Remember a verdict. Errors are not cached so the next upload retries;
+        failed verdicts (passed False) are only reused for the identical image.
+        """
+        if self.ttl <= 0 or result.get('error') or result.get('quality_check_failed'):
+            return
+        entries = [entry for entry in self._entries() if entry['sha256'] != normalized.sha256]
+        entries.append({
+            'sha256': normalized.sha256,
+            'dhash': perceptual_hash(normalized.data) if passed else None,
+            'context': self.context,
+            'result': result,
+            'message': message,
+            'expires_at': time.time() + self.ttl,
+        })
+        cache.set(self.key, entries[-self.MAX_ENTRIES:], self.ttl)
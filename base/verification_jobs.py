@@ -0,0 +1,169 @@
+import base64
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import publish, session_channel
+from .imaging import NormalizedImage
+from .models import VerificationJob
+
+
+def jobs_enabled():
+    """Uploads are queued only when a worker is running (off on serverless deployments)"""
+    return bool(getattr(settings, 'VERIFICATION_JOBS_ENABLED', False))
+
+
+def enqueue_job(session, kind, normalized):
+    """
+    Queue a verification for the worker
+    normalized: NormalizedImage of the upload
+    Returns: VerificationJob
+    """
+    return VerificationJob.objects.create(
+        session=session,
+        kind=kind,
+        image_data=base64.b64encode(normalized.data).decode('utf-8'),
+        payload={
+            'mime_type': normalized.mime_type,
+            'width': normalized.width,
+            'height': normalized.height,
+        }
+    )
+
+
+def job_image(job):
+    """Rebuild the NormalizedImage stored on a job without recompressing it"""
+    data = base64.b64decode(job.image_data)
+    return NormalizedImage(
+        data,
+        job.payload.get('mime_type', 'image/jpeg'),
+        job.payload.get('width'),
+        job.payload.get('height'),
+        hashlib.sha256(data).hexdigest()
+    )
+
+
+def claim_next_job(worker_id):
+    """
+    Atomically claim the oldest queued job.
+
+    SELECT ... FOR UPDATE SKIP LOCKED lets concurrent workers pass over rows
+    another worker is claiming; the conditional UPDATE makes the claim safe on
+    backends without row locks (SQLite).
+    Returns: VerificationJob or None
+    """
+    while True:
+        with transaction.atomic():
+            job_id = (
+                VerificationJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='queued')
+                .order_by('created_at')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if job_id is None:
+                return None
+
+            now = timezone.now()
+            claimed = VerificationJob.objects.filter(id=job_id, status='queued').update(
+                status='running',
+                locked_by=worker_id,
+                locked_at=now,
+                attempts=F('attempts') + 1,
+                updated_at=now
+            )
+        if claimed:
+            return VerificationJob.objects.select_related('session').get(id=job_id)
+        # Another worker won the race for this row; try the next one
+
+
+class JobServerError(Exception):
+    """The flow answered with a server error (it catches its own exceptions); retried like one"""
+
+
+def run_job(job, max_attempts=1):
+    """
+    Process a claimed job and store the response body it produced. A server
+    error response raises JobServerError while attempts remain, so the worker
+    requeues the job (fail_job); the last attempt's response is stored as is.
+    """
+    from . import views
+
+    handlers = {
+        'pan_card': views.process_pan_card_upload,
+        'selfie': views.process_selfie_upload,
+    }
+    body, status = handlers[job.kind](job.session, job_image(job))
+    if status >= 500 and job.attempts < max_attempts:
+        raise JobServerError(body.get('error_details') or body.get('message') or f'HTTP {status}')
+    finish_job(job, body, status)
+    return body, status
+
+
+def finish_job(job, body, status, error=None):
+    job.status = 'succeeded' if status < 500 and not error else 'failed'
+    job.result = body
+    job.result_status = status
+    job.error = error
+    job.image_data = None
+    job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'status', 'result', 'result_status', 'error', 'image_data', 'finished_at', 'updated_at'
+    ])
+    publish(
+        session_channel(job.session_id),
+        'verification_result',
+        job_id=str(job.id),
+        kind=job.kind,
+        result=job_status_body(job)[0]
+    )
+
+
+def fail_job(job, error, max_attempts):
+    """Requeue a job that raised, or mark it failed once attempts are exhausted"""
+    if job.attempts < max_attempts:
+        VerificationJob.objects.filter(id=job.id, status='running').update(
+            status='queued', locked_by=None, locked_at=None, error=error, updated_at=timezone.now()
+        )
+        return
+    finish_job(job, {
+        'success': False,
+        'message': 'Verification could not be completed. Please upload the image again.',
+        'retry': True
+    }, 500, error=error)
+
+
+def requeue_stale_jobs(lease_seconds, max_attempts):
+    """Return jobs whose worker died mid-run to the queue (or fail them after max_attempts)"""
+    cutoff = timezone.now() - timedelta(seconds=lease_seconds)
+    stale = VerificationJob.objects.filter(status='running', locked_at__lt=cutoff)
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status='queued', locked_by=None, locked_at=None, updated_at=timezone.now()
+    )
+    for job in stale.filter(attempts__gte=max_attempts):
+        finish_job(job, {
+            'success': False,
+            'message': 'Verification timed out. Please upload the image again.',
+            'retry': True
+        }, 500, error='Lease expired')
+    return requeued
+
+
+def job_status_body(job):
+    """JSON body for the job status endpoint. Returns: (body, http_status)"""
+    if not job.is_finished:
+        return {
+            'success': True,
+            'job_id': str(job.id),
+            'status': job.status,
+            'pending': True
+        }, 200
+
+    body = dict(job.result or {})
+    body.update({'job_id': str(job.id), 'status': job.status, 'pending': False})
+    return body, job.result_status or 200
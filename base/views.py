@@ -3,6 +3,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import get_object_or_404, render
 from django.core.files.storage import default_storage
+from django.core.exceptions import ValidationError
 import json
 from .models import ChatSession, Customer, LoanApplication
 from .agents import (
@@ -14,7 +15,24 @@ from .agents import (
     UnderwritingAgent, 
     SanctionLetterGenerator,
     CustomerSegmentation)
+from .simulation import EMISimulator
+from .imaging import normalize_image, InvalidImageError
+from .verification_cache import VerificationCache
+from .uploads import inspect_upload, b64encode_upload, UploadTooLargeError
+from .salary_slip import extract_salary_slip, verify_salary_slip
+from .verification_jobs import jobs_enabled, enqueue_job, job_status_body
+from .downloads import STORED_DOCUMENTS, stored_document, document_response, not_modified_response
+from .models import VerificationJob
+from .agents import get_agent, run_flow, arun_flow
+from .llm_limiter import LLMBusyError
+from .metrics import collect_metrics, metrics_authorized
+from .idempotency import idempotent
+from .warmup import start_warm_up, warm_up_status
+from asgiref.sync import sync_to_async
+import hashlib
 import base64
+import math
+import re
 
 
 def index(request):
@@ -56,8 +74,95 @@ def get_age_segment(session):
     return CustomerSegmentation.determine_segment(age, employment_type, monthly_income)
 
 
+IMAGE_UPLOAD_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+SALARY_SLIP_UPLOAD_TYPES = IMAGE_UPLOAD_TYPES + ('application/pdf',)
+
+SELFIE_UNREADABLE_MESSAGE = 'We could not read this image. Please take your selfie again (JPEG, PNG, or WebP).'
+PAN_CARD_UNREADABLE_MESSAGE = (
+    'We could not read this image. Please upload a clear photo of your PAN card (JPEG, PNG, or WebP).'
+)
+
+# Loan statuses that have a sanction letter
+SANCTIONED_STATUSES = ('approved', 'disbursed')
+
+
+def validate_upload(upload, allowed_types, max_size, type_message, size_message):
+    """
+    Stream an upload once to enforce the size limit, sniff its real type and hash it
+    Returns: (UploadInfo, None) or (None, error JsonResponse)
+    """
+    if upload.size is not None and upload.size > max_size:
+        return None, JsonResponse({'success': False, 'message': size_message}, status=400)
+    try:
+        upload_info = inspect_upload(upload, max_size=max_size)
+    except UploadTooLargeError:
+        return None, JsonResponse({'success': False, 'message': size_message}, status=400)
+    if upload_info.mime_type not in allowed_types:
+        return None, JsonResponse({'success': False, 'message': type_message}, status=400)
+    return upload_info, None
+
+
+def queued_job_response(job):
+    """202 response for an upload handed to the verification worker"""
+    return JsonResponse({
+        'success': True,
+        'queued': True,
+        'job_id': str(job.id),
+        'status': job.status,
+        'status_url': f'/verification_job/{job.id}/?session_id={job.session_id}'
+    }, status=202)
+
+
+def selfie_session_error(session):
+    """Error response when the session is not ready for a selfie, else None"""
+    # Check if customer exists and PAN is verified
+    if not session.customer or not session.customer.pan_verified:
+        return JsonResponse({
+            'success': False,
+            'message': 'PAN card verification not completed. Please complete previous steps.'
+        }, status=400)
+    
+    # Check if we have temporary PAN image data for face matching
+    if not session.temp_pan_image_data:
+        return JsonResponse({
+            'success': False,
+            'message': 'PAN card image data not found. Please upload your PAN card again.',
+            'requires_pan_reupload': True,
+            'workflow_stage': 'pan_verification'
+        }, status=400)
+    return None
+
+
+def pan_card_session_error(session):
+    """Error response when the session is not ready for a PAN card, else None"""
+    # Get expected name from session
+    if not session.customer_name:
+        return JsonResponse({
+            'success': False,
+            'message': 'Customer name not found. Please restart the process.'
+        }, status=400)
+    return None
+
+
+def normalize_upload(upload, sha256, message):
+    """
+    Fix rotation, downsize and strip metadata before anything is stored or sent
+    Returns: (NormalizedImage, None) or (None, error JsonResponse)
+    """
+    try:
+        return normalize_image(upload, sha256=sha256), None
+    except InvalidImageError:
+        return None, JsonResponse({
+            'success': False,
+            'message': message,
+            'retry': True
+        }, status=400)
+
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
+@idempotent
 def upload_selfie(request):
     """Handle selfie upload and face matching with PAN card"""
     session_id = request.POST.get('session_id')
@@ -69,20 +174,16 @@ def upload_selfie(request):
             'message': 'Please upload a selfie image'
         }, status=400)
     
-    # Validate file type
-    allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/webp']
-    if selfie_image.content_type not in allowed_types:
-        return JsonResponse({
-            'success': False,
-            'message': 'Please upload a valid image file (JPEG, PNG, or WebP)'
-        }, status=400)
-    
-    # Validate file size (max 5MB)
-    if selfie_image.size > 5 * 1024 * 1024:
-        return JsonResponse({
-            'success': False,
-            'message': 'Image size should be less than 5MB'
-        }, status=400)
+    # Size and actual file type (magic bytes) are checked in one streaming pass
+    upload_info, error_response = validate_upload(
+        selfie_image,
+        IMAGE_UPLOAD_TYPES,
+        5 * 1024 * 1024,
+        'Please upload a valid image file (JPEG, PNG, or WebP)',
+        'Image size should be less than 5MB'
+    )
+    if error_response:
+        return error_response
     
     try:
         session = ChatSession.objects.get(id=session_id)
@@ -92,22 +193,39 @@ def upload_selfie(request):
             'message': 'Invalid session. Please refresh and try again.'
         }, status=404)
     
-    # Check if customer exists and PAN is verified
-    if not session.customer or not session.customer.pan_verified:
-        return JsonResponse({
-            'success': False,
-            'message': 'PAN card verification not completed. Please complete previous steps.'
-        }, status=400)
+    error_response = selfie_session_error(session)
+    if error_response:
+        return error_response
     
-    # Check if we have temporary PAN image data for face matching
-    if not session.temp_pan_image_data:
-        return JsonResponse({
-            'success': False,
-            'message': 'PAN card image data not found. Please upload your PAN card again.',
-            'requires_pan_reupload': True,
-            'workflow_stage': 'pan_verification'
-        }, status=400)
+    normalized_selfie, error_response = normalize_upload(
+        selfie_image, upload_info.sha256, SELFIE_UNREADABLE_MESSAGE
+    )
+    if error_response:
+        return error_response
     
+    if jobs_enabled():
+        job = enqueue_job(session, 'selfie', normalized_selfie)
+        return queued_job_response(job)
+    
+    body, status = process_selfie_upload(session, normalized_selfie)
+    return JsonResponse(body, status=status)
+
+
+def process_selfie_upload(session, normalized_selfie):
+    """
+    Face match a normalized selfie against the session's PAN image and advance the workflow
+    Returns: (response body, HTTP status)
+    """
+    return run_flow(selfie_upload_flow(session, normalized_selfie))
+
+
+def faces_matched(match_result):
+    """Face match passes at 20% confidence"""
+    return match_result.get('faces_match', False) and match_result.get('confidence_score', 0) >= 20
+
+
+def selfie_upload_flow(session, normalized_selfie):
+    """process_selfie_upload as an LLM flow (see agents.run_flow), shared with upload_selfie_async"""
     try:
         customer = session.customer
         
@@ -115,26 +233,44 @@ def upload_selfie(request):
         age_segment = get_age_segment(session)
         
         # Initialize face match agent
-        face_agent = FaceMatchAgent()
+        face_agent = get_agent(FaceMatchAgent)
         
-        # Read selfie image data directly from memory
-        selfie_image.seek(0)
-        selfie_data = selfie_image.read()
+        # Normalized selfie bytes (rotation fixed, downsized, metadata stripped)
+        selfie_data = normalized_selfie.data
         
         # Decode PAN card image from base64
         pan_card_data = base64.b64decode(session.temp_pan_image_data)
         
-        # Perform face matching using raw bytes
-        match_result = face_agent.match_faces(selfie_data, pan_card_data)
+        # Re-uploads of the same (or a near-identical) selfie reuse the earlier verdict
+        scope = f"customer:{customer.id}"
+        face_cache = VerificationCache('face', scope, context=hashlib.sha256(pan_card_data).hexdigest())
+        cached = face_cache.lookup(normalized_selfie)
         
-        # Generate human-readable report
-        match_message = face_agent.generate_match_report(match_result)
+        if cached:
+            match_result, match_message = cached
+        else:
+            # Perform face matching using raw bytes
+            match_result = yield from face_agent.match_faces.flow(selfie_data, pan_card_data)
+            
+            # Failed the local quality check: keep temp PAN data and ask for a retake
+            if match_result.get('quality_check_failed'):
+                return {
+                    'success': True,
+                    'verified': False,
+                    'message': match_result['verification_notes'],
+                    'quality_issues': match_result.get('quality_issues', []),
+                    'retry': True,
+                    'workflow_stage': session.stage
+                }, 200
+            
+            # Generate human-readable report
+            match_message = yield from face_agent.generate_match_report.flow(match_result)
+            face_cache.store(normalized_selfie, match_result, match_message, passed=faces_matched(match_result))
         
         # Check if faces match (20% threshold)
         confidence = match_result.get('confidence_score', 0)
-        faces_match = match_result.get('faces_match', False)
         
-        if faces_match and confidence >= 20:
+        if faces_matched(match_result):
             # Face match successful
             customer.selfie_verified = True
             customer.face_match_verified = True
@@ -152,12 +288,12 @@ def upload_selfie(request):
             conversation = add_message(session, 'assistant', match_message, 'verification')
             
             # Get sales agent to start loan discussion with age-aware messaging
-            sales_agent = SalesAgent()
-            loan_message = sales_agent.engage_customer(session, conversation, age_segment)
+            sales_agent = get_agent(SalesAgent)
+            loan_message = yield from sales_agent.engage_customer.flow(session, conversation, age_segment)
             
             add_message(session, 'assistant', loan_message, 'sales')
             
-            return JsonResponse({
+            return {
                 'success': True,
                 'verified': True,
                 'message': match_message,
@@ -170,13 +306,13 @@ def upload_selfie(request):
                 },
                 'workflow_stage': 'loan_details',
                 'requires_upload': False
-            })
+            }, 200
             
         else:
             # Face match failed - keep temp PAN data for retry
             reason = match_result.get('verification_notes', 'Faces do not match sufficiently')
             
-            return JsonResponse({
+            return {
                 'success': True,
                 'verified': False,
                 'message': f"Face verification failed: {reason}. Confidence: {confidence}%. Please try again with a clearer selfie.",
@@ -186,18 +322,16 @@ def upload_selfie(request):
                 },
                 'retry': True,
                 'workflow_stage': session.stage
-            })
+            }, 200
             
     except Exception as e:
-        # On error, clear temp data
-        session.temp_pan_image_data = None
-        session.save()
-        
-        return JsonResponse({
+        # Keep the temp PAN data: the selfie can be retried (by the customer or
+        # the verification worker) without uploading the PAN card again
+        return {
             'success': False,
             'message': f'Face verification error: {str(e)}',
             'error_details': str(e)
-        }, status=500)
+        }, 500
 
 
 @csrf_exempt
@@ -209,7 +343,7 @@ def start_chat(request):
         stage='greeting'
     )
     
-    master_agent = MasterAgent()
+    master_agent = get_agent(MasterAgent)
     greeting = master_agent.greet_user(session)
     
     # Initialize conversation with greeting
@@ -226,6 +360,7 @@ def start_chat(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@idempotent
 def chat(request):
     """Handle chat messages and workflow progression"""
     data = json.loads(request.body)
@@ -237,6 +372,14 @@ def chat(request):
     except ChatSession.DoesNotExist:
         return JsonResponse({'error': 'Invalid session'}, status=400)
     
+    return JsonResponse(run_flow(chat_flow(session, user_message)))
+
+
+def chat_flow(session, user_message):
+    """
+    Advance the workflow with one user message as an LLM flow (see agents.run_flow)
+    Returns: response body
+    """
     # Get current workflow stage
     workflow_stage = session.stage
     
@@ -244,10 +387,10 @@ def chat(request):
     conversation = add_message(session, 'user', user_message)
     
     # Initialize agents
-    master_agent = MasterAgent()
-    sales_agent = SalesAgent()
-    verification_agent = VerificationAgent()
-    underwriting_agent = UnderwritingAgent()
+    master_agent = get_agent(MasterAgent)
+    sales_agent = get_agent(SalesAgent)
+    verification_agent = get_agent(VerificationAgent)
+    underwriting_agent = get_agent(UnderwritingAgent)
     
     # Get age segment if customer exists
     age_segment = get_age_segment(session)
@@ -260,7 +403,7 @@ def chat(request):
     # Process based on workflow stage
     if workflow_stage == 'greeting' or workflow_stage == 'name_collection':
         # Extract name and DOB from conversation
-        extracted_data = master_agent.extract_name_and_dob(conversation)
+        extracted_data = yield from master_agent.extract_name_and_dob.flow(conversation)
         
         if extracted_data:
             name = extracted_data.get('name')
@@ -295,12 +438,12 @@ def chat(request):
                     
                     session.stage = 'pan_collection'
                     workflow_stage = 'pan_collection'
-                    response = master_agent.request_pan_number(customer.name, age_segment)
+                    response = yield from master_agent.request_pan_number.flow(customer.name, age_segment)
                 else:
                     # New customer - request PAN number
                     session.stage = 'pan_collection'
                     workflow_stage = 'pan_collection'
-                    response = master_agent.request_new_customer_pan(age_segment)
+                    response = yield from master_agent.request_new_customer_pan.flow(age_segment)
             else:
                 # Couldn't extract name, ask again
                 response = "I didn't catch your name and date of birth. Could you please provide your full name and date of birth (DD/MM/YYYY or YYYY-MM-DD)?"
@@ -314,7 +457,7 @@ def chat(request):
     
     elif workflow_stage == 'pan_collection':
         # Extract PAN number from conversation
-        pan_number = master_agent.extract_pan_number(conversation)
+        pan_number = yield from master_agent.extract_pan_number.flow(conversation)
         
         if pan_number and pan_number != 'NOT_FOUND':
             # PAN number extracted successfully
@@ -329,7 +472,7 @@ def chat(request):
                 
                 session.stage = 'pan_verification'
                 workflow_stage = 'pan_verification'
-                response = master_agent.request_pan_upload(customer.name, age_segment)
+                response = yield from master_agent.request_pan_upload.flow(customer.name, age_segment)
                 requires_upload = True
                 upload_type = 'pan_card'
             except Customer.DoesNotExist:
@@ -365,7 +508,7 @@ def chat(request):
     elif workflow_stage == 'loan_details':
         # Collect loan requirements with age-aware extraction
         current_agent = 'sales'
-        loan_details = sales_agent.extract_loan_details(conversation, age_segment)
+        loan_details = yield from sales_agent.extract_loan_details.flow(conversation, age_segment)
         
         # Check if all required information is collected
         all_info_collected = loan_details.get('all_required_info_collected', False)
@@ -381,7 +524,7 @@ def chat(request):
             if loan_details.get('employment_type') == 'salaried':
                 if not loan_details.get('company_name') or not loan_details.get('designation'):
                     # Continue collecting mandatory salaried info
-                    response = sales_agent.engage_customer(session, conversation, age_segment)
+                    response = yield from sales_agent.engage_customer.flow(session, conversation, age_segment)
                     current_agent = 'sales'
                 else:
                     # All information collected - proceed to assessment
@@ -537,11 +680,11 @@ def chat(request):
                                 workflow_stage = 'rejected'
             else:
                 # Non-salaried or missing info - continue collecting
-                response = sales_agent.engage_customer(session, conversation, age_segment)
+                response = yield from sales_agent.engage_customer.flow(session, conversation, age_segment)
                 current_agent = 'sales'
         else:
             # Continue collecting loan details with age-aware engagement
-            response = sales_agent.engage_customer(session, conversation, age_segment)
+            response = yield from sales_agent.engage_customer.flow(session, conversation, age_segment)
     
     elif workflow_stage == 'salary_verification':
         # Waiting for salary slip upload
@@ -551,7 +694,7 @@ def chat(request):
         current_agent = 'underwriting'
     
     elif workflow_stage == 'completed' or workflow_stage == 'rejected':
-        response = master_agent.thank_and_close(session)
+        response = yield from master_agent.thank_and_close.flow(session)
     
     else:
         # Unknown stage - reset to greeting
@@ -584,11 +727,12 @@ def chat(request):
             'age_group': age_segment['age_group']
         }
     
-    return JsonResponse(response_data)
+    return response_data
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@idempotent
 def upload_pan_card(request):
     """Handle PAN card image upload and AI-powered verification"""
     session_id = request.POST.get('session_id')
@@ -600,20 +744,16 @@ def upload_pan_card(request):
             'message': 'Please upload a PAN card image'
         }, status=400)
     
-    # Validate file type
-    allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/webp']
-    if pan_image.content_type not in allowed_types:
-        return JsonResponse({
-            'success': False,
-            'message': 'Please upload a valid image file (JPEG, PNG, or WebP)'
-        }, status=400)
-    
-    # Validate file size (max 5MB)
-    if pan_image.size > 5 * 1024 * 1024:
-        return JsonResponse({
-            'success': False,
-            'message': 'Image size should be less than 5MB'
-        }, status=400)
+    # Size and actual file type (magic bytes) are checked in one streaming pass
+    upload_info, error_response = validate_upload(
+        pan_image,
+        IMAGE_UPLOAD_TYPES,
+        5 * 1024 * 1024,
+        'Please upload a valid image file (JPEG, PNG, or WebP)',
+        'Image size should be less than 5MB'
+    )
+    if error_response:
+        return error_response
     
     try:
         session = ChatSession.objects.get(id=session_id)
@@ -623,65 +763,117 @@ def upload_pan_card(request):
             'message': 'Invalid session. Please refresh and try again.'
         }, status=404)
     
-    # Get expected name from session
-    expected_name = session.customer_name
-    if not expected_name:
-        return JsonResponse({
-            'success': False,
-            'message': 'Customer name not found. Please restart the process.'
-        }, status=400)
+    error_response = pan_card_session_error(session)
+    if error_response:
+        return error_response
+    
+    normalized_pan, error_response = normalize_upload(
+        pan_image, upload_info.sha256, PAN_CARD_UNREADABLE_MESSAGE
+    )
+    if error_response:
+        return error_response
     
-    # Try to extract PAN from conversation
+    if jobs_enabled():
+        job = enqueue_job(session, 'pan_card', normalized_pan)
+        return queued_job_response(job)
+    
+    body, status = process_pan_card_upload(session, normalized_pan)
+    return JsonResponse(body, status=status)
+
+
+def process_pan_card_upload(session, normalized_pan):
+    """
+    Verify a normalized PAN card image, create or update the customer and advance the workflow
+    Returns: (response body, HTTP status)
+    """
+    return run_flow(pan_card_upload_flow(session, normalized_pan))
+
+
+def stated_pan_numbers(conversation):
+    """PAN-shaped tokens in the customer's messages, in order"""
+    text = ' '.join(str(msg.get('content', '')) for msg in conversation if msg.get('role') == 'user')
+    return re.findall(r'\b[A-Z]{5}[0-9]{4}[A-Z]\b', text.upper())
+
+
+def pan_card_upload_flow(session, normalized_pan):
+    """process_pan_card_upload as an LLM flow (see agents.run_flow), shared with upload_pan_card_async"""
+    expected_name = session.customer_name
     conversation = get_conversation(session)
-    master_agent = MasterAgent()
-    expected_pan = master_agent.extract_pan_number(conversation)
-    if expected_pan == 'NOT_FOUND':
-        expected_pan = None
     
     try:
         # Initialize PAN verification agent
-        pan_agent = PANVerificationAgent()
-        
-        # Read image data directly (no file storage needed)
-        pan_image.seek(0)
-        pan_image_data = pan_image.read()
+        pan_agent = get_agent(PANVerificationAgent)
         
-        # Store PAN image as base64 in session for later face matching
+        # Store the normalized PAN image as base64 in session for later face matching
+        pan_image_data = normalized_pan.data
         pan_base64 = base64.b64encode(pan_image_data).decode('utf-8')
         session.temp_pan_image_data = pan_base64
         
-        # Verify PAN card using AI
-        verification_result = pan_agent.verify_pan_card(
-            pan_image_data,  # Pass bytes directly
-            expected_name,
-            expected_pan
+        # Re-uploads of the same (or a near-identical) card reuse the earlier verdict. The
+        # context is what the customer typed, checked before any model call
+        stated_pans = stated_pan_numbers(conversation)
+        pan_cache = VerificationCache(
+            'pan', f"session:{session.id}", context=f"{expected_name}|{','.join(stated_pans)}"
         )
+        cached = pan_cache.lookup(normalized_pan)
         
-        # Generate human-readable report
-        verification_message = pan_agent.generate_verification_report(verification_result)
+        if cached:
+            verification_result, verification_message = cached
+            expected_pan = stated_pans[-1] if stated_pans else None
+        else:
+            # Try to extract PAN from conversation
+            master_agent = get_agent(MasterAgent)
+            expected_pan = yield from master_agent.extract_pan_number.flow(conversation)
+            if expected_pan == 'NOT_FOUND':
+                expected_pan = None
+            
+            # Verify PAN card using AI
+            verification_result = yield from pan_agent.verify_pan_card.flow(
+                pan_image_data,  # Pass bytes directly
+                expected_name,
+                expected_pan
+            )
+            
+            # Failed the local quality check: ask for a retake without another LLM call
+            if verification_result.get('quality_check_failed'):
+                return {
+                    'success': True,
+                    'verified': False,
+                    'message': verification_result['verification_notes'],
+                    'quality_issues': verification_result.get('quality_issues', []),
+                    'retry': True,
+                    'workflow_stage': session.stage
+                }, 200
+            
+            # Generate human-readable report
+            verification_message = yield from pan_agent.generate_verification_report.flow(verification_result)
+            pan_cache.store(
+                normalized_pan, verification_result, verification_message,
+                passed=bool(verification_result.get('is_valid_pan_card'))
+            )
         
         # Check if verification was successful
         if verification_result.get('is_valid_pan_card'):
             # Additional check for PAN match if expected
             if expected_pan and not verification_result.get('pan_match', True):
-                return JsonResponse({
+                return {
                     'success': True,
                     'verified': False,
                     'message': f"PAN number mismatch. The PAN on your card doesn't match the one you provided ({expected_pan}). Please check and try again.",
                     'retry': True,
                     'workflow_stage': session.stage
-                })
+                }, 200
             
             # Check name match
             if not verification_result.get('name_match', {}).get('matches'):
                 name_match_reason = verification_result.get('name_match', {}).get('reason', 'Names do not match')
-                return JsonResponse({
+                return {
                     'success': True,
                     'verified': False,
                     'message': f"Name verification failed: {name_match_reason}. Please ensure the PAN card belongs to you.",
                     'retry': True,
                     'workflow_stage': session.stage
-                })
+                }, 200
             
             # Verification successful
             pan_number = verification_result.get('pan_number')
@@ -789,7 +981,7 @@ def upload_pan_card(request):
             
             add_message(session, 'assistant', selfie_message, 'verification')
             
-            return JsonResponse({
+            return {
                 'success': True,
                 'verified': True,
                 'message': verification_message,
@@ -805,7 +997,7 @@ def upload_pan_card(request):
                 'workflow_stage': 'selfie_verification',
                 'requires_upload': True,
                 'upload_type': 'selfie'
-            })
+            }, 200
             
         else:
             # Verification failed - clear temp data
@@ -818,29 +1010,30 @@ def upload_pan_card(request):
                     verification_result.get('verification_notes', 'Invalid PAN card detected')
                 )
             
-            return JsonResponse({
+            return {
                 'success': True,
                 'verified': False,
                 'message': verification_message,
                 'reasons': reasons,
                 'retry': True,
                 'workflow_stage': session.stage
-            })
+            }, 200
             
     except Exception as e:
         # Clear temp data on error
         session.temp_pan_image_data = None
         session.save()
         
-        return JsonResponse({
+        return {
             'success': False,
             'message': f'Verification error: {str(e)}',
             'error_details': str(e)
-        }, status=500)
+        }, 500
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@idempotent
 def upload_salary_slip(request):
     """Handle salary slip upload for loan verification"""
     session_id = request.POST.get('session_id')
@@ -852,23 +1045,16 @@ def upload_salary_slip(request):
             'message': 'Please upload a salary slip'
         }, status=400)
     
-    # Validate file type
-    allowed_types = [
-        'image/jpeg', 'image/jpg', 'image/png', 'image/webp',
-        'application/pdf'
-    ]
-    if salary_slip.content_type not in allowed_types:
-        return JsonResponse({
-            'success': False,
-            'message': 'Please upload a valid file (JPEG, PNG, WebP, or PDF)'
-        }, status=400)
-    
-    # Validate file size (max 10MB for salary slips)
-    if salary_slip.size > 10 * 1024 * 1024:
-        return JsonResponse({
-            'success': False,
-            'message': 'File size should be less than 10MB'
-        }, status=400)
+    # Size and actual file type (magic bytes) are checked in one streaming pass
+    upload_info, error_response = validate_upload(
+        salary_slip,
+        SALARY_SLIP_UPLOAD_TYPES,
+        10 * 1024 * 1024,
+        'Please upload a valid file (JPEG, PNG, WebP, or PDF)',
+        'File size should be less than 10MB'
+    )
+    if error_response:
+        return error_response
     
     try:
         session = ChatSession.objects.get(id=session_id)
@@ -893,34 +1079,51 @@ def upload_salary_slip(request):
                 'message': 'No loan application found'
             }, status=400)
         
-        # Read and encode file content to base64 for storage in database
-        file_content = salary_slip.read()
-        encoded_content = base64.b64encode(file_content).decode('utf-8')
+        # Encode file content to base64 chunk by chunk for storage in database
+        encoded_content = b64encode_upload(salary_slip)
         
         # Store in memory (database fields)
         loan_app.salary_slip_name = salary_slip.name
         loan_app.salary_slip_content = encoded_content
-        loan_app.salary_slip_content_type = salary_slip.content_type
-        loan_app.salary_slip_size = salary_slip.size
+        loan_app.salary_slip_content_type = upload_info.mime_type
+        loan_app.salary_slip_size = upload_info.size
         
-        # TODO: Add AI-powered salary slip verification here
-        # For now, assume verification passes and approve loan
+        # Read the slip (local PDF text first, vision model only when needed)
+        # and compare it with the declared monthly income
+        extracted = extract_salary_slip(salary_slip, upload_info, encoded_content)
+        salary_check = verify_salary_slip(extracted, session.customer)
+        loan_app.salary_slip_data = salary_check
+        
+        if not salary_check['income_verified']:
+            loan_app.save()
+            
+            reasons = '; '.join(salary_check['verification_reasons'])
+            message = (
+                f"We couldn't verify your income from this salary slip: {reasons}. "
+                f"Please upload your latest salary slip (PDF or a clear photo)."
+            )
+            add_message(session, 'assistant', message, 'underwriting')
+            session.save()
+            
+            return JsonResponse({
+                'success': False,
+                'verified': False,
+                'message': message,
+                'data': {
+                    'net_pay': salary_check['net_pay'],
+                    'declared_monthly_income': salary_check['declared_monthly_income'],
+                    'source': salary_check['source']
+                },
+                'retry': True,
+                'workflow_stage': session.stage
+            })
         
         loan_app.status = 'approved'
         loan_app.save()
         
-        # Generate sanction letter with segment info
+        # Generate sanction letter with segment info and store it for downloads
         try:
-            sanction_letter = SanctionLetterGenerator.generate_letter(loan_app, age_segment)
-            
-            # Store sanction letter in memory as well
-            sanction_letter_content = sanction_letter.read()
-            encoded_sanction = base64.b64encode(sanction_letter_content).decode('utf-8')
-            
-            loan_app.sanction_letter_name = f'sanction_{loan_app.id}.pdf'
-            loan_app.sanction_letter_content = encoded_sanction
-            loan_app.sanction_letter_content_type = 'application/pdf'
-            loan_app.save()
+            SanctionLetterGenerator.get_letter(loan_app, age_segment)
             
             # Age-aware approval message
             if age_segment:
@@ -974,6 +1177,9 @@ def upload_salary_slip(request):
             'success': False,
             'message': 'Invalid session'
         }, status=404)
+    except LLMBusyError:
+        # Answered with 503 + Retry-After by LLMBusyMiddleware
+        raise
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -981,6 +1187,83 @@ def upload_salary_slip(request):
         }, status=500)
 
 
+@require_http_methods(["GET"])
+def verification_job_status(request, job_id):
+    """Poll a queued PAN / selfie verification; returns the upload response once finished"""
+    session_id = request.GET.get('session_id')
+    try:
+        job = VerificationJob.objects.get(id=job_id, session_id=session_id)
+    except (VerificationJob.DoesNotExist, ValueError):
+        return JsonResponse({
+            'success': False,
+            'message': 'Verification job not found.'
+        }, status=404)
+    
+    body, status = job_status_body(job)
+    return JsonResponse(body, status=status)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def emi_simulation(request):
+    """Return the EMI / eligibility grid for a verified customer (no LLM call)"""
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'message': 'Invalid JSON body'}, status=400)
+    
+    session_id = data.get('session_id')
+    tenures = data.get('tenures')
+    amounts = data.get('amounts')
+    
+    try:
+        if tenures is not None:
+            tenures = [int(t) for t in tenures]
+            if not tenures or len(tenures) > EMISimulator.MAX_TENURES or not all(1 <= t <= 120 for t in tenures):
+                raise ValueError
+        if amounts is not None:
+            amounts = [float(a) for a in amounts]
+            if (not amounts or len(amounts) > EMISimulator.MAX_AMOUNTS
+                    or not all(math.isfinite(a) and a > 0 for a in amounts)):
+                raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({
+            'success': False,
+            'message': (
+                f'tenures must be 1-{EMISimulator.MAX_TENURES} values between 1 and 120 months; '
+                f'amounts must be 1-{EMISimulator.MAX_AMOUNTS} positive values'
+            )
+        }, status=400)
+    
+    try:
+        session = ChatSession.objects.select_related('customer').get(id=session_id)
+    except (ChatSession.DoesNotExist, ValueError):
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid session. Please refresh and try again.'
+        }, status=404)
+    
+    customer = session.customer
+    if not customer or not customer.pan_verified:
+        return JsonResponse({
+            'success': False,
+            'message': 'EMI simulation is available after PAN verification.'
+        }, status=403)
+    
+    if not customer.monthly_income:
+        return JsonResponse({
+            'success': False,
+            'message': 'Monthly income is required for EMI simulation.'
+        }, status=400)
+    
+    simulation = EMISimulator.for_customer(customer, tenures, amounts)
+    
+    return JsonResponse({
+        'success': True,
+        'data': simulation
+    })
+
+
 @csrf_exempt
 def set_language(request):
     """Set language preference for the session"""
@@ -1002,22 +1285,264 @@ def set_language(request):
 
 @csrf_exempt
 def download_sanction_letter(request, loan_id):
-    """Download sanction letter PDF"""
+    """
+    Download sanction letter PDF (stored copy, streamed with ETag / Range support).
+    Only sanctioned applications, for staff or the chat session of the application's customer.
+    """
     try:
-        # Get loan application
-        loan_application = get_object_or_404(LoanApplication, id=loan_id)
+        # Get loan application without its document blobs
+        loan_application = get_object_or_404(
+            LoanApplication.objects.select_related('customer').defer('salary_slip_content', 'sanction_letter_content'),
+            id=loan_id,
+            status__in=SANCTIONED_STATUSES
+        )
+        if not document_access_allowed(request, loan_application.customer_id):
+            raise Http404("Sanction letter not found")
         
-        # Generate PDF
-        pdf_file = SanctionLetterGenerator.generate_letter(loan_application)
+        # Regenerate only if the letter's inputs changed since it was stored
+        age_segment = loan_application.customer.get_segment()
+        fingerprint = SanctionLetterGenerator.letter_fingerprint(loan_application, age_segment)
+        if fingerprint == loan_application.sanction_letter_etag:
+            # Client's copy is current: answer without touching the stored PDF
+            not_modified = not_modified_response(
+                request, fingerprint, loan_application.sanction_letter_generated_at
+            )
+            if not_modified is not None:
+                return not_modified
+        else:
+            SanctionLetterGenerator.get_letter(loan_application, age_segment)
         
-        # Return as downloadable response
-        response = HttpResponse(pdf_file.read(), content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="Sanction_Letter_LA{loan_id:06d}.pdf"'
+        stored = stored_document(loan_id, 'sanction_letter')
+        if stored is None:
+            raise Http404("Sanction letter not found")
         
-        return response
+        return document_response(
+            request,
+            stored,
+            filename=f'Sanction_Letter_LA{loan_id:06d}.pdf',
+            attachment=True
+        )
         
-    except LoanApplication.DoesNotExist:
-        raise Http404("Loan application not found")
+    except Http404:
+        raise
     except Exception as e:
         print(f"Error generating sanction letter: {str(e)}")
-        return HttpResponse("Error generating sanction letter", status=500)
\ No newline at end of file
+        return HttpResponse("Error generating sanction letter", status=500)
+
+
+def document_access_allowed(request, customer_id):
+    """Staff, or a request carrying the session_id of a chat session of the customer"""
+    if request.user.is_staff:
+        return True
+    session_id = request.GET.get('session_id')
+    try:
+        return bool(session_id) and ChatSession.objects.filter(
+            id=session_id, customer_id=customer_id
+        ).exists()
+    except (ValueError, ValidationError):
+        return False
+
+
+@require_http_methods(["GET", "HEAD"])
+def download_document(request, loan_id, document):
+    """
+    Stream a document stored on a loan application (sanction letter, salary slip).
+    Available to staff, or to the chat session of the application's customer.
+    """
+    if document not in STORED_DOCUMENTS:
+        raise Http404("Unknown document")
+    
+    stored = stored_document(loan_id, document)
+    if stored is None:
+        raise Http404("Document not found")
+    
+    if not document_access_allowed(request, stored.customer_id):
+        raise Http404("Document not found")
+    
+    return document_response(request, stored, attachment=request.GET.get('download') == '1')
+
+
+@require_http_methods(["GET", "HEAD"])
+def ready(request):
+    """
+    Readiness probe for the load balancer: 200 once this process has warmed up
+    (database, heavy imports, model client), 503 until then. The first probe
+    starts the warm-up when it did not run at startup.
+    """
+    status = warm_up_status()
+    if not status['ready'] and status['status'] != 'running':
+        start_warm_up()
+        status = warm_up_status()
+    response = JsonResponse(status, status=200 if status['ready'] else 503)
+    if not status['ready']:
+        response['Retry-After'] = '1'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Process metrics (LLM limiter queue depth and wait times) as JSON"""
+    if not metrics_authorized(request):
+        raise Http404()
+    
+    response = JsonResponse(collect_metrics())
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+# Async (ASGI) counterparts of the chat and upload views. Model calls are
+# awaited on the async OpenAI client, so a worker keeps serving other sessions
+# while one waits on the model; the workflow code between calls is shared with
+# the sync views through the LLM flows and runs via sync_to_async like the
+# async ORM itself.
+
+async def astart_session(stream=None):
+    """
+    Create a chat session and greet the customer
+    stream: optional async callback receiving the greeting as it is generated
+    Returns: (session, greeting)
+    """
+    session = await ChatSession.objects.acreate(
+        stage='greeting'
+    )
+    
+    master_agent = get_agent(MasterAgent)
+    greeting = await arun_flow(master_agent.greet_user.flow(session), stream=stream)
+    
+    add_message(session, 'assistant', greeting, 'master')
+    await session.asave()
+    return session, greeting
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def start_chat_async(request):
+    """Initialize a new chat session (async)"""
+    session, greeting = await astart_session()
+    
+    return JsonResponse({
+        'session_id': str(session.id),
+        'message': greeting,
+        'agent': 'master',
+        'workflow_stage': 'greeting'
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@idempotent
+async def chat_async(request):
+    """Handle chat messages and workflow progression (async)"""
+    data = json.loads(request.body)
+    session_id = data.get('session_id')
+    user_message = data.get('message')
+    
+    try:
+        session = await ChatSession.objects.select_related('customer').aget(id=session_id)
+    except ChatSession.DoesNotExist:
+        return JsonResponse({'error': 'Invalid session'}, status=400)
+    
+    response_data = await arun_flow(chat_flow(session, user_message), step=sync_to_async)
+    return JsonResponse(response_data)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@idempotent
+async def upload_pan_card_async(request):
+    """Handle PAN card image upload and AI-powered verification (async)"""
+    session_id = request.POST.get('session_id')
+    pan_image = request.FILES.get('pan_card_image')
+    
+    if not pan_image:
+        return JsonResponse({
+            'success': False,
+            'message': 'Please upload a PAN card image'
+        }, status=400)
+    
+    # Hashing and image normalization are CPU work; keep them off the event loop
+    upload_info, error_response = await sync_to_async(validate_upload, thread_sensitive=False)(
+        pan_image,
+        IMAGE_UPLOAD_TYPES,
+        5 * 1024 * 1024,
+        'Please upload a valid image file (JPEG, PNG, or WebP)',
+        'Image size should be less than 5MB'
+    )
+    if error_response:
+        return error_response
+    
+    try:
+        session = await ChatSession.objects.select_related('customer').aget(id=session_id)
+    except ChatSession.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid session. Please refresh and try again.'
+        }, status=404)
+    
+    error_response = pan_card_session_error(session)
+    if error_response:
+        return error_response
+    
+    normalized_pan, error_response = await sync_to_async(normalize_upload, thread_sensitive=False)(
+        pan_image, upload_info.sha256, PAN_CARD_UNREADABLE_MESSAGE
+    )
+    if error_response:
+        return error_response
+    
+    if jobs_enabled():
+        job = await sync_to_async(enqueue_job)(session, 'pan_card', normalized_pan)
+        return queued_job_response(job)
+    
+    body, status = await arun_flow(pan_card_upload_flow(session, normalized_pan), step=sync_to_async)
+    return JsonResponse(body, status=status)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@idempotent
+async def upload_selfie_async(request):
+    """Handle selfie upload and face matching with PAN card (async)"""
+    session_id = request.POST.get('session_id')
+    selfie_image = request.FILES.get('selfie_image')
+    
+    if not selfie_image:
+        return JsonResponse({
+            'success': False,
+            'message': 'Please upload a selfie image'
+        }, status=400)
+    
+    upload_info, error_response = await sync_to_async(validate_upload, thread_sensitive=False)(
+        selfie_image,
+        IMAGE_UPLOAD_TYPES,
+        5 * 1024 * 1024,
+        'Please upload a valid image file (JPEG, PNG, or WebP)',
+        'Image size should be less than 5MB'
+    )
+    if error_response:
+        return error_response
+    
+    try:
+        session = await ChatSession.objects.select_related('customer').aget(id=session_id)
+    except ChatSession.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'message': 'Invalid session. Please refresh and try again.'
+        }, status=404)
+    
+    error_response = selfie_session_error(session)
+    if error_response:
+        return error_response
+    
+    normalized_selfie, error_response = await sync_to_async(normalize_upload, thread_sensitive=False)(
+        selfie_image, upload_info.sha256, SELFIE_UNREADABLE_MESSAGE
+    )
+    if error_response:
+        return error_response
+    
+    if jobs_enabled():
+        job = await sync_to_async(enqueue_job)(session, 'selfie', normalized_selfie)
+        return queued_job_response(job)
+    
+    body, status = await arun_flow(selfie_upload_flow(session, normalized_selfie), step=sync_to_async)
+    return JsonResponse(body, status=status)
@@ -0,0 +1,176 @@
+import importlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# Imported on first use by the request path (see the user-facing modules);
+# importing them here moves that cost off the first requests
+HEAVY_MODULES = (
+    'openai',
+    'PIL.Image',
+    'PIL.ImageFilter',
+    'PIL.ImageOps',
+    'reportlab.pdfgen.canvas',
+    'pypdf',
+)
+
+# Seconds the model endpoint gets to answer the connection check
+LLM_CONNECT_TIMEOUT = 5.0
+
+_lock = threading.Lock()
+_state = {
+    'status': 'pending',  # pending -> running -> ready | failed
+    'started_at': None,
+    'finished_at': None,
+    'steps': {},
+    'error': None,
+}
+
+
+def _warm_database():
+    """Open the default connection (or the pool) and run a trivial query"""
+    connection = connections['default']
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    finally:
+        # Hand the connection back (to the pool when pooling) instead of keeping
+        # it on the warm-up thread
+        connection.close()
+
+
+def _warm_modules():
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            # Optional dependency (pypdf): its feature falls back at request time
+            pass
+
+
+def _warm_llm_client():
+    """
+    Create the shared OpenAI client and open its HTTP connection pool to the
+    model endpoint (or OPENAI_BASE_URL) with a model listing, which costs no tokens
+    """
+    from openai import APIStatusError
+    from .agents import get_client
+
+    client = get_client().with_options(max_retries=0, timeout=LLM_CONNECT_TIMEOUT)
+    try:
+        client.models.list()
+    except APIStatusError:
+        # An error status still means the connection is up (e.g. a stand-in without /models)
+        pass
+
+
+def _warm_app():
+    """URL patterns, the chat template, the underwriting rules and the letter layers"""
+    from django.template.loader import get_template
+    from django.urls import get_resolver
+    from .sanction_letters import warm_up_layers
+    from .underwriting_policy import get_underwriting_policy
+
+    get_resolver().url_patterns
+    get_template('chat.html')
+    get_underwriting_policy()
+    warm_up_layers()
+
+
+# (name, function, required): a failed required step leaves the instance unready;
+# the model endpoint is not required, so a provider outage does not take every
+# instance out of the load balancer
+STEPS = (
+    ('database', _warm_database, True),
+    ('modules', _warm_modules, True),
+    ('app', _warm_app, True),
+    ('llm_client', _warm_llm_client, False),
+)
+
+
+def warm_up():
+    """
+    Run the warm-up steps once per process (again after a failure), timing each.
+    Returns: warm-up status (see warm_up_status)
+    """
+    with _lock:
+        busy = _state['status'] in ('running', 'ready')
+        if not busy:
+            _state.update(status='running', started_at=timezone.now(), finished_at=None, steps={}, error=None)
+    if busy:
+        return warm_up_status()
+
+    failed = None
+    for name, step, required in STEPS:
+        started = time.perf_counter()
+        try:
+            step()
+            result = {'ok': True}
+        except Exception as e:
+            result = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+            if required and failed is None:
+                failed = f'{name}: {result["error"]}'
+        result['ms'] = round((time.perf_counter() - started) * 1000, 1)
+        with _lock:
+            _state['steps'][name] = result
+
+    with _lock:
+        _state.update(
+            status='failed' if failed else 'ready',
+            finished_at=timezone.now(),
+            error=failed
+        )
+    status = warm_up_status()
+    steps = ', '.join(
+        f"{name} {step['ms']:.0f}ms{'' if step['ok'] else ' (failed)'}"
+        for name, step in status['steps'].items()
+    )
+    if failed:
+        logger.warning('Warm-up failed (%s): %s', failed, steps)
+    else:
+        logger.info('Warm-up finished in %.0fms: %s', status['total_ms'], steps)
+    return status
+
+
+def start_warm_up():
+    """Warm up on a background thread so the server accepts connections meanwhile"""
+    with _lock:
+        if _state['status'] in ('running', 'ready'):
+            return
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+def warm_up_status():
+    with _lock:
+        started, finished = _state['started_at'], _state['finished_at']
+        return {
+            'ready': _state['status'] == 'ready',
+            'status': _state['status'],
+            'started_at': started.isoformat() if started else None,
+            'total_ms': round((finished - started).total_seconds() * 1000, 1) if started and finished else None,
+            'steps': {name: dict(step) for name, step in _state['steps'].items()},
+            'error': _state['error'],
+        }
+
+
+# Process kinds warmed up with WARMUP_ON_STARTUP=auto: long-lived processes, where the
+# warm-up is paid once. A serverless instance loads the WSGI application on its cold start and
+# would pay it (deferred imports, a model endpoint round trip) on every one.
+LONG_LIVED = ('asgi', 'worker')
+
+
+def warm_up_on_startup(process):
+    """
+    Called by the entry points with their process kind ('wsgi', 'asgi' or 'worker');
+    see WARMUP_ON_STARTUP
+    """
+    mode = str(getattr(settings, 'WARMUP_ON_STARTUP', 'auto')).lower()
+    if mode in ('1', 'true', 'yes') or (mode == 'auto' and process in LONG_LIVED):
+        start_warm_up()
@@ -0,0 +1,326 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http.request import split_domain_port, validate_host
+from django.utils import timezone
+
+from .agents import arun_flow
+from .events import listening, publish, session_channel, customer_channel
+from .llm_limiter import BUSY_MESSAGE, LLMBusyError
+from .models import ChatSession, LoanApplication, VerificationJob
+from .verification_jobs import jobs_enabled, job_status_body
+
+
+logger = logging.getLogger(__name__)
+
+CHAT_SOCKET_PATH = '/ws/chat/'
+
+# Seconds between database checks for results produced by other processes
+# (the verification worker, letters generated from the admin); one check per
+# process, shared by all its connections (see ResultWatcher)
+WATCH_INTERVAL = 3.0
+
+# The session is kept in memory for the life of the connection; the large
+# PAN image is only needed by the upload views
+SESSION_DEFERRED_FIELDS = ('temp_pan_image_data',)
+
+
+def _session_queryset():
+    return ChatSession.objects.select_related('customer').defer(*SESSION_DEFERRED_FIELDS)
+
+
+def _origin_allowed(scope):
+    """Browsers send Origin on WebSocket handshakes; only accept pages served by an allowed host"""
+    headers = dict(scope.get('headers') or [])
+    origin = headers.get(b'origin', b'').decode('latin-1')
+    if not origin:
+        return True
+    host = origin.split('://', 1)[-1]
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, settings.ALLOWED_HOSTS)
+
+
+class ChatConnection:
+    """
+    One chat over a WebSocket. The client sends JSON messages:
+      {"type": "start"}                         new session, greeting streamed
+      {"type": "resume", "session_id": "..."}   continue an existing session
+      {"type": "message", "message": "..."}     one chat turn
+      {"type": "ping"}
+    and receives:
+      {"type": "session", ...}   session started / resumed
+      {"type": "token", "delta": "..."}   reply text as it is generated
+      {"type": "message", ...}   the turn's full response (same body as /chat/)
+      {"type": "event", "event": "verification_result" | "sanction_letter_ready", ...}
+      {"type": "error", "message": "..."}
+    Uploads stay on the HTTP endpoints; their queued results are pushed here.
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self.session = None
+        self.events = asyncio.Queue()
+        self.delivered = set()
+        self.tasks = []
+        # Listeners and watcher of the current session
+        self.session_tasks = []
+
+    async def send_json(self, data):
+        async with self._send_lock:
+            await self._send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if not _origin_allowed(self.scope):
+            await self._send({'type': 'websocket.close', 'code': 4403})
+            return
+        await self._send({'type': 'websocket.accept'})
+
+        # Client messages are handled one at a time, in order, while events
+        # are pushed independently
+        inbox = asyncio.Queue()
+        self.tasks = [
+            asyncio.create_task(self.handle_messages(inbox)),
+            asyncio.create_task(self.push_events()),
+        ]
+        try:
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    await inbox.put(message.get('text') or (message.get('bytes') or b'').decode('utf-8', 'replace'))
+        finally:
+            tasks = self.tasks + self.session_tasks
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def handle_messages(self, inbox):
+        while True:
+            text = await inbox.get()
+            try:
+                data = json.loads(text)
+                handler = {
+                    'start': self.start,
+                    'resume': self.resume,
+                    'message': self.chat,
+                    'ping': self.ping,
+                }.get(data.get('type') if isinstance(data, dict) else None)
+                if handler is None:
+                    await self.send_json({'type': 'error', 'message': 'Unknown message type'})
+                    continue
+                await handler(data)
+            except json.JSONDecodeError:
+                await self.send_json({'type': 'error', 'message': 'Messages must be JSON'})
+            except LLMBusyError as e:
+                await self.send_json({
+                    'type': 'error',
+                    'busy': True,
+                    'message': BUSY_MESSAGE,
+                    'retry_after': e.retry_after
+                })
+            except Exception as e:
+                await self.send_json({'type': 'error', 'message': f'Error processing request: {str(e)}'})
+
+    async def stream_token(self, delta):
+        await self.send_json({'type': 'token', 'delta': delta})
+
+    async def ping(self, data):
+        await self.send_json({'type': 'pong'})
+
+    async def start(self, data):
+        from .views import astart_session
+
+        session, greeting = await astart_session(stream=self.stream_token)
+        await self.attach(session)
+        await self.send_json({
+            'type': 'session',
+            'session_id': str(session.id),
+            'message': greeting,
+            'agent': 'master',
+            'workflow_stage': session.stage
+        })
+
+    async def resume(self, data):
+        try:
+            session = await _session_queryset().aget(id=data.get('session_id'))
+        except (ChatSession.DoesNotExist, ValueError, ValidationError):
+            await self.send_json({'type': 'error', 'message': 'Invalid session'})
+            return
+        await self.attach(session)
+        await self.send_json({
+            'type': 'session',
+            'session_id': str(session.id),
+            'workflow_stage': session.stage,
+            'resumed': True
+        })
+
+    async def attach(self, session):
+        """Make session this connection's session and start listening for its events"""
+        self.session = session
+        self.delivered = set()
+        for task in self.session_tasks:
+            task.cancel()
+        self.session_tasks = [asyncio.create_task(self.listen_session(session.id))]
+        if session.customer_id:
+            self.session_tasks.append(asyncio.create_task(self.listen_customer(session.customer_id)))
+
+    async def listen_session(self, session_id):
+        with listening(session_channel(session_id), self.events), \
+                result_watcher.watching(sessions=[session_id]):
+            await asyncio.Event().wait()
+
+    async def listen_customer(self, customer_id):
+        with listening(customer_channel(customer_id), self.events), \
+                result_watcher.watching(customers=[customer_id]):
+            await asyncio.Event().wait()
+
+    async def refresh_session(self):
+        """
+        Reload the session if it changed outside this connection (the upload
+        views advance the workflow over HTTP). One indexed lookup per turn
+        instead of reloading the session and its customer.
+        """
+        updated_at = await (
+            ChatSession.objects.filter(id=self.session.id)
+            .values_list('updated_at', flat=True)
+            .afirst()
+        )
+        if updated_at != self.session.updated_at:
+            customer_id = self.session.customer_id
+            self.session = await _session_queryset().aget(id=self.session.id)
+            if self.session.customer_id != customer_id and self.session.customer_id:
+                self.session_tasks.append(
+                    asyncio.create_task(self.listen_customer(self.session.customer_id))
+                )
+
+    async def chat(self, data):
+        from .views import chat_flow
+
+        if self.session is None:
+            await self.send_json({'type': 'error', 'message': 'Invalid session'})
+            return
+        await self.refresh_session()
+        response_data = await arun_flow(
+            chat_flow(self.session, data.get('message') or ''),
+            step=sync_to_async,
+            stream=self.stream_token
+        )
+        await self.send_json({'type': 'message', **response_data})
+
+    def _event_key(self, event):
+        if event.get('event') == 'verification_result':
+            return ('job', event.get('job_id'))
+        if event.get('event') == 'sanction_letter_ready':
+            return ('letter', event.get('loan_id'), event.get('generated_at'))
+        return None
+
+    async def push_events(self):
+        while True:
+            event = await self.events.get()
+            key = self._event_key(event)
+            if key is not None:
+                # The same result can arrive both in-process and from the
+                # result watcher
+                if key in self.delivered:
+                    continue
+                self.delivered.add(key)
+            await self.send_json(event)
+
+
+class ResultWatcher:
+    """
+    Picks up results written by other processes (the verification worker,
+    letters generated from the admin) for every connection of this process:
+    one poll of each table per interval for all watched sessions and
+    customers, published on their channels like in-process results.
+    """
+
+    def __init__(self):
+        self.sessions = Counter()
+        self.customers = Counter()
+        self._task = None
+
+    @contextmanager
+    def watching(self, sessions=(), customers=()):
+        """Watch for results of sessions and customers (call from the event loop)"""
+        self.sessions.update(sessions)
+        self.customers.update(customers)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self.run())
+        try:
+            yield
+        finally:
+            self.sessions.subtract(sessions)
+            self.customers.subtract(customers)
+            # Drop ids nobody watches any more
+            self.sessions = +self.sessions
+            self.customers = +self.customers
+
+    async def run(self):
+        since = timezone.now()
+        while self.sessions or self.customers:
+            await asyncio.sleep(WATCH_INTERVAL)
+            now = timezone.now()
+            try:
+                # Overlapping windows so rows committed just after a check are
+                # not missed; repeats are dropped by ChatConnection.push_events()
+                await self.poll(since - timedelta(seconds=WATCH_INTERVAL))
+            except Exception:
+                logger.exception("Checking for verification results and sanction letters failed")
+            since = now
+
+    async def poll(self, since):
+        from .sanction_letters import letter_ready_event
+
+        sessions = list(self.sessions)
+        customers = list(self.customers)
+        if sessions and jobs_enabled():
+            jobs = VerificationJob.objects.filter(
+                session_id__in=sessions, finished_at__gte=since
+            ).defer('image_data')
+            async for job in jobs:
+                publish(
+                    session_channel(job.session_id),
+                    'verification_result',
+                    job_id=str(job.id),
+                    kind=job.kind,
+                    result=job_status_body(job)[0]
+                )
+        if customers:
+            loans = LoanApplication.objects.filter(
+                customer_id__in=customers,
+                sanction_letter_generated_at__gte=since
+            ).only('id', 'customer_id', 'sanction_letter_generated_at')
+            async for loan_application in loans:
+                publish(
+                    customer_channel(loan_application.customer_id),
+                    'sanction_letter_ready',
+                    **letter_ready_event(loan_application)
+                )
+
+
+result_watcher = ResultWatcher()
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application for WebSocket connections (routed from project.asgi)"""
+    if scope['path'] != CHAT_SOCKET_PATH:
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await ChatConnection(scope, receive, send).run()
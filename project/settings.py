@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'base.middleware.LLMBusyMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -96,9 +98,42 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Without pooling each request thread keeps its own connection for DB_CONN_MAX_AGE seconds
+# (use 0 on serverless, where instances come and go), checked before reuse
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "600"))
+
 DATABASES = {
-    'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600, ssl_require=False)
+    'default': dj_database_url.parse(
+        DATABASE_URL, conn_max_age=DB_CONN_MAX_AGE, conn_health_checks=True, ssl_require=False
+    )
 }
+
+# Connection pool (PostgreSQL with psycopg 3): all threads of a process share at most
+# DB_POOL_MAX_SIZE connections, so Postgres sees at most processes x DB_POOL_MAX_SIZE however
+# many threads serve requests. A request waits up to DB_POOL_TIMEOUT seconds for a free
+# connection; connections are checked before reuse and closed after DB_POOL_MAX_IDLE seconds
+# idle or DB_POOL_MAX_LIFETIME seconds in total. Pool stats are reported on /metrics/.
+# Behind an external transaction pooler (PgBouncer, the provider's pooled URL) set
+# DB_POOL_ENABLED=False and DB_DISABLE_SERVER_SIDE_CURSORS=True instead.
+DB_POOL_ENABLED = os.getenv("DB_POOL_ENABLED", "True").lower() in ("1", "true", "yes")
+
+if DB_POOL_ENABLED and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    from base.db_pool import check_connection
+
+    # Pooled connections are returned to the pool after each request instead of persisting
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+        'max_size': int(os.getenv("DB_POOL_MAX_SIZE", "8")),
+        'timeout': float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        'max_idle': float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+        'max_lifetime': float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+        'check': check_connection,
+    }
+
+DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = (
+    os.getenv("DB_DISABLE_SERVER_SIDE_CURSORS", "False").lower() in ("1", "true", "yes")
+)
 # settings.py
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Password validation
@@ -146,3 +181,73 @@ import os
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+# OpenAI-compatible endpoint to call instead of api.openai.com, e.g. the stub_llm_server
+# command for load tests (http://127.0.0.1:8001/v1); empty uses the SDK default
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+
+# Indicative annual interest rate (percent, reducing balance) used for EMI calculations
+LOAN_INTEREST_RATE = float(os.getenv("LOAN_INTEREST_RATE", "12.0"))
+
+# Image normalization before vision calls (long edge in px, JPEG or WEBP, quality 1-95)
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "64"))
+
+# Per-kind overrides for the local image quality gate, e.g. {"document": {"min_sharpness": 60}}
+# (defaults in base.imaging.QUALITY_THRESHOLDS)
+IMAGE_QUALITY_THRESHOLDS = {}
+
+# Reuse PAN / face-match verdicts for repeated uploads within this many seconds (0 disables);
+# near-duplicates match when their perceptual hashes differ by at most MAX_DISTANCE bits
+VERIFICATION_CACHE_TTL = int(os.getenv("VERIFICATION_CACHE_TTL", "900"))
+VERIFICATION_CACHE_MAX_DISTANCE = int(os.getenv("VERIFICATION_CACHE_MAX_DISTANCE", "6"))
+
+# Queue PAN / selfie verification for `manage.py run_verification_worker` and return 202 from
+# the upload endpoints. Leave off where no worker process runs (e.g. Vercel).
+VERIFICATION_JOBS_ENABLED = os.getenv("VERIFICATION_JOBS_ENABLED", "False").lower() in ("1", "true", "yes")
+
+# Salary slip verification: allowed shortfall of the slip against declared monthly income,
+# and the oldest pay month accepted
+SALARY_SLIP_INCOME_TOLERANCE = float(os.getenv("SALARY_SLIP_INCOME_TOLERANCE", "0.15"))
+SALARY_SLIP_MAX_AGE_MONTHS = int(os.getenv("SALARY_SLIP_MAX_AGE_MONTHS", "3"))
+
+# Process-wide limits on OpenAI calls (base.llm_limiter); 0 disables a rate limit. Limits are
+# per process: divide the account's limits by the number of server processes. Callers queue
+# up to LLM_QUEUE_TIMEOUT seconds (at most LLM_MAX_QUEUE of them) before the request is
+# answered with 503 + Retry-After.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_REQUESTS_PER_SECOND = float(os.getenv("LLM_REQUESTS_PER_SECOND", "0"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+
+# Fixed workflow replies (greeting, PAN / KYC requests, closing) are served from the templates in
+# base.agents.RESPONSE_MESSAGES without a model call; message ids listed here are rephrased by
+# the model instead, e.g. "greeting,thank_and_close"
+LLM_REPHRASE_MESSAGES = [m.strip() for m in os.getenv("LLM_REPHRASE_MESSAGES", "").split(",") if m.strip()]
+
+# Bearer token for scraping /metrics/ without a staff login (empty: staff only)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Per-request timing (base.timing): Server-Timing header, and a log of requests slower than
+# the threshold with their slowest / repeated queries. Written as JSONL to REQUEST_SLOW_LOG
+# when set; otherwise (or when the file cannot be written) to the base.timing logger
+REQUEST_TIMING_ENABLED = os.getenv("REQUEST_TIMING_ENABLED", "True").lower() in ("1", "true", "yes")
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "True").lower() in ("1", "true", "yes")
+REQUEST_SLOW_THRESHOLD_MS = float(os.getenv("REQUEST_SLOW_THRESHOLD_MS", "1000"))
+REQUEST_SLOW_LOG = os.getenv("REQUEST_SLOW_LOG", "")
+
+# Idempotency keys on chat / upload requests (base.idempotency): stored responses are replayed
+# to retries for this long, and a first attempt still unfinished after IDEMPOTENCY_LOCK_TIMEOUT
+# seconds is treated as dead so a retry can run it again
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "120"))
+
+# Warm up each process in the background when it starts: open the database connection, import
+# reportlab / Pillow / openai, connect to the model endpoint and load the templates. /ready/
+# answers 503 until it has finished (base.warmup). "auto" warms the long-lived ASGI server and
+# verification worker only, not the WSGI entry point the serverless deployment cold-starts on
+# every instance; "true" / "false" turn it on or off everywhere.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "auto").lower()
@@ -15,3 +15,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
 application = get_wsgi_application()
 app = application
+
+# Off by default here (WARMUP_ON_STARTUP=auto): this is the serverless entry point
+from base.warmup import warm_up_on_startup
+warm_up_on_startup('wsgi')